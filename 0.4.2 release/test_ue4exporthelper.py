@@ -0,0 +1,270 @@
+"""
+Tests of UE4 Export Helper, run from Blender (see conftest.py).
+"""
+
+import pytest
+
+np = pytest.importorskip("numpy")
+
+
+@pytest.fixture
+def scene(ue4eh):
+    import bpy
+    ue4eh.register()
+    scene = bpy.context.scene
+    for ob in scene.objects[:]:
+        scene.objects.unlink(ob)
+    scene.applyTransform = True
+    scene.rotateMinusNinety = False
+    scene.unparent = True
+    scene.orgToGeo = True
+    scene.orgToBottom = False
+    scene.createLightmap = False
+    scene.join = False
+    scene.triangulate = False
+    scene.includeConnected = False
+    scene.peOneStepToogle = True
+    yield scene
+    ue4eh.unregister()
+
+
+def link(scene, ob):
+    scene.objects.link(ob)
+    ob.layers = [True] + [False] * 19
+    return ob
+
+
+def mesh_object(scene, name, location=(1.0, 2.0, 3.0), rotation=(0.3, 0.5, 1.1), scale=(1.0, 2.0, 3.0)):
+    import bpy
+    me = bpy.data.meshes.new(name)
+    verts = [(x + 0.5, y - 0.25, z + 2.0) for x in (-1.0, 1.0) for y in (-1.0, 1.0) for z in (-1.0, 1.0)]
+    faces = [(0, 1, 3, 2), (4, 6, 7, 5), (0, 4, 5, 1), (2, 3, 7, 6), (0, 2, 6, 4), (1, 5, 7, 3)]
+    me.from_pydata(verts, [], faces)
+    me.update()
+    ob = link(scene, bpy.data.objects.new(name, me))
+    ob.location = location
+    ob.rotation_euler = rotation
+    ob.scale = scale
+    return ob
+
+
+def case_transform(scene):
+    return mesh_object(scene, "Transformed")
+
+
+def case_parented(scene):
+    import bpy
+    parent = link(scene, bpy.data.objects.new("Parent", None))
+    parent.location = (-2.0, 0.5, 1.0)
+    parent.rotation_euler = (0.0, 0.7, -0.4)
+    parent.scale = (2.0, 0.5, 1.5)
+    scene.update()
+    ob = mesh_object(scene, "Child")
+    ob.parent = parent
+    ob.matrix_parent_inverse = parent.matrix_world.inverted()
+    return ob
+
+
+def case_curve(scene):
+    import bpy
+    cu = bpy.data.curves.new("Curve", 'CURVE')
+    cu.dimensions = '3D'
+    cu.extrude = 0.25
+    spline = cu.splines.new('BEZIER')
+    spline.bezier_points.add(2)
+    for point, co in zip(spline.bezier_points, ((0.0, 0.0, 1.0), (1.0, 2.0, 0.5), (3.0, 1.0, 2.0))):
+        point.co = co
+        point.handle_left_type = point.handle_right_type = 'AUTO'
+    ob = link(scene, bpy.data.objects.new("Curve", cu))
+    ob.location = (0.5, -1.0, 2.0)
+    ob.rotation_euler = (0.2, 0.0, 0.9)
+    ob.scale = (1.5, 1.5, 0.5)
+    return ob
+
+
+def case_modifier(scene):
+    ob = mesh_object(scene, "Modified")
+    mod = ob.modifiers.new("Array", 'ARRAY')
+    mod.count = 3
+    mod.relative_offset_displace = (1.2, 0.3, 0.0)
+    return ob
+
+
+def prepare(scene, ob, engine):
+    """Run the prepare operator on ob with given engine, returns vertex coordinates and world matrix of the copy"""
+    import bpy
+    scene.layers = [True] + [False] * 19
+    for other in scene.objects:
+        other.select = False
+    ob.select = True
+    scene.objects.active = ob
+    scene.prepareEngine = engine
+    assert bpy.ops.object.prepareue4() == {'FINISHED'}
+    scene.update()
+    copies = [copy for copy in scene.objects if copy.get("isUEEHCopy")]
+    assert len(copies) == 1
+    copy = copies[0]
+    assert copy.type == 'MESH' and copy.parent is None
+    coords = np.empty(len(copy.data.vertices) * 3, dtype=np.float32)
+    copy.data.vertices.foreach_get("co", coords)
+    matrix = np.array(copy.matrix_world)
+    scene.objects.unlink(copy)
+    return coords.reshape(-1, 3), matrix
+
+
+@pytest.mark.parametrize("make", [case_transform, case_parented, case_curve, case_modifier])
+def test_prepare_engines(scene, make):
+    """The 'Mesh data' prepare engine must give the same copies as the operators based one"""
+    ob = make(scene)
+    ops_coords, ops_matrix = prepare(scene, ob, 'OPS')
+    data_coords, data_matrix = prepare(scene, ob, 'DATA')
+
+    assert data_coords.shape == ops_coords.shape
+    assert np.allclose(data_coords, ops_coords, atol=1e-4)
+    # Same origin, same rotation and scale (both are applied, so the world matrix is a translation).
+    assert np.allclose(data_matrix[:3, 3], ops_matrix[:3, 3], atol=1e-4)
+    assert np.allclose(data_matrix, ops_matrix, atol=1e-4)
+    assert np.allclose(data_matrix[:3, :3], np.identity(3), atol=1e-4)
+
+
+def uv_job(faces, margin=0.1, grid=0):
+    """lightmapPack job of faces given as lists of (vertex index, u, v) corners"""
+    import array
+    loopStarts = array.array('i')
+    loopTotals = array.array('i')
+    vertIndices = array.array('i')
+    uvs = array.array('f')
+    for corners in faces:
+        loopStarts.append(len(vertIndices))
+        loopTotals.append(len(corners))
+        for vert, u, v in corners:
+            vertIndices.append(vert)
+            uvs.extend((u, v))
+    return (uvs, loopStarts, loopTotals, vertIndices, margin, grid, True)
+
+
+ISLAND_FACES = [
+    [(0, 0.0, 0.0), (1, 1.0, 0.0), (2, 1.0, 1.0), (3, 0.0, 1.0)],
+    # Shares the 1-2 edge and its UVs with the first face.
+    [(1, 1.0, 0.0), (4, 2.0, 0.0), (5, 2.0, 1.0), (2, 1.0, 1.0)],
+    # Only shares vertex 5 with the second face.
+    [(5, 2.0, 1.0), (6, 3.0, 1.0), (7, 3.0, 2.0), (8, 2.0, 2.0)],
+    # Shares the 4-5 edge with the second face, but not its UVs (a seam).
+    [(4, 5.0, 0.0), (9, 6.0, 0.0), (10, 6.0, 0.5), (5, 5.0, 0.5)],
+]
+
+
+def test_lightmap_islands(ue4eh):
+    uvs, loopStarts, loopTotals, vertIndices = uv_job(ISLAND_FACES)[:4]
+    islands = ue4eh.lightmapIslands(uvs, loopStarts, loopTotals, vertIndices)
+    assert sorted(sorted(faces) for faces in islands) == [[0, 1], [2], [3]]
+
+
+def packed_boxes(job, uvs):
+    """UV bounding box of each packed face"""
+    loopStarts, loopTotals = job[1], job[2]
+    boxes = []
+    for start, total in zip(loopStarts, loopTotals):
+        us = uvs[start * 2:(start + total) * 2:2]
+        vs = uvs[start * 2 + 1:(start + total) * 2:2]
+        boxes.append((min(us), min(vs), max(us), max(vs)))
+    return boxes
+
+
+def random_faces(count, seed=0):
+    import random
+    rnd = random.Random(seed)
+    faces = []
+    for face in range(count):
+        u, v = rnd.uniform(-5.0, 5.0), rnd.uniform(-5.0, 5.0)
+        w, h = rnd.uniform(0.05, 2.0), rnd.uniform(0.05, 2.0)
+        faces.append([(face * 4, u, v), (face * 4 + 1, u + w, v), (face * 4 + 2, u + w, v + h), (face * 4 + 3, u, v + h)])
+    return faces
+
+
+@pytest.mark.parametrize("faces", [ISLAND_FACES, random_faces(200)])
+@pytest.mark.parametrize("margin", [0.0, 0.1])
+def test_lightmap_pack(ue4eh, faces, margin):
+    job = uv_job(faces, margin)
+    uvs = ue4eh.lightmapPack(job)
+    assert len(uvs) == len(job[0])
+    assert all(-1e-6 <= value <= 1.0 + 1e-6 for value in uvs)
+
+    # Islands of rectangles stay rectangles, so their face boxes must not overlap, unless they are the same island.
+    islands = ue4eh.lightmapIslands(*job[:4])
+    islandOf = {face: index for index, island in enumerate(islands) for face in island}
+    boxes = packed_boxes(job, uvs)
+    for a in range(len(boxes)):
+        for b in range(a + 1, len(boxes)):
+            if islandOf[a] == islandOf[b]:
+                continue
+            boxA, boxB = boxes[a], boxes[b]
+            overlapU = min(boxA[2], boxB[2]) - max(boxA[0], boxB[0])
+            overlapV = min(boxA[3], boxB[3]) - max(boxA[1], boxB[1])
+            assert overlapU <= 1e-5 or overlapV <= 1e-5
+
+
+def test_lightmap_pack_grid(ue4eh):
+    grid = 64
+    uvs = ue4eh.lightmapPack(uv_job(random_faces(20), grid=grid))
+    assert all(0.0 <= value <= 1.0 for value in uvs)
+    assert all(abs(value * grid - round(value * grid)) < 1e-3 for value in uvs)
+
+
+def test_cache_lru(ue4eh):
+    from collections import OrderedDict
+    cache = OrderedDict()
+    for key in "abc":
+        ue4eh.cacheSet(cache, key, key.upper(), 3)
+    assert ue4eh.cacheGet(cache, "a") == "A"
+    assert ue4eh.cacheGet(cache, "z") is None
+    # "b" is now the least recently used entry.
+    ue4eh.cacheSet(cache, "d", "D", 3)
+    assert list(cache) == ["c", "a", "d"]
+    ue4eh.cacheSet(cache, "c", "C2", 3)
+    assert list(cache) == ["a", "d", "c"] and cache["c"] == "C2"
+
+
+def test_lightmap_job_hash(ue4eh):
+    job = uv_job(ISLAND_FACES)
+    key = ue4eh.lightmapJobHash(job)
+    assert ue4eh.lightmapJobHash(uv_job(ISLAND_FACES)) == key
+
+    # Anything the packed UVs depend on changes the key.
+    uvs, loopStarts, loopTotals, vertIndices, margin, grid, rotate = job
+    moved = uv_job([[(vert, u + 0.5, v) for vert, u, v in ISLAND_FACES[0]]] + ISLAND_FACES[1:])
+    others = [
+        moved,
+        uv_job(ISLAND_FACES[:3]),
+        uv_job(ISLAND_FACES, margin=0.2),
+        uv_job(ISLAND_FACES, grid=64),
+        (None, loopStarts, loopTotals, vertIndices, margin, grid, rotate),
+        (uvs, loopStarts, loopTotals, vertIndices, margin, grid, False),
+    ]
+    keys = {key} | {ue4eh.lightmapJobHash(other) for other in others}
+    assert len(keys) == len(others) + 1
+
+
+class FakeCollection(list):
+    """Duck-typed bpy collection of SimpleNamespace items, with bulk attribute access"""
+
+    def foreach_get(self, attr, seq):
+        values = [value for item in self for value in (getattr(item, attr) if attr == "co" else (getattr(item, attr),))]
+        seq[:] = type(seq)(seq.typecode, values) if hasattr(seq, "typecode") else values
+
+    def foreach_set(self, attr, seq):
+        seq = list(seq)
+        for i, item in enumerate(self):
+            setattr(item, attr, tuple(seq[i * 3:i * 3 + 3]) if attr == "co" else seq[i])
+
+
+def test_mesh_bulk_edits(ue4eh):
+    from types import SimpleNamespace
+    me = SimpleNamespace(
+        vertices=FakeCollection(SimpleNamespace(co=(x, 0.5, x * 2.0), select=False) for x in (0.0, 1.0, 2.0)),
+        edges=FakeCollection(SimpleNamespace(select=False) for _i in range(2)),
+        polygons=FakeCollection(SimpleNamespace(select=False) for _i in range(1)))
+    ue4eh.meshSelectAll(me)
+    assert all(item.select for items in (me.vertices, me.edges, me.polygons) for item in items)
+    ue4eh.meshOffsetZ(me, -1.5)
+    assert [vert.co for vert in me.vertices] == [(0.0, 0.5, -1.5), (1.0, 0.5, 0.5), (2.0, 0.5, 2.5)]
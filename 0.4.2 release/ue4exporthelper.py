@@ -20,9 +20,15 @@ from bpy.props import *
 from bpy.types import Operator, Panel, UIList, AddonPreferences, PropertyGroup
 from bl_operators.presets import AddPresetBase
 import os
-from math import radians
+import array
+import hashlib
+import time
+import bmesh
+from math import radians, pi, cos, sin, atan2, sqrt, floor
 import mathutils
 from mathutils import *
+from collections import OrderedDict
+from bpy_extras.io_utils import axis_conversion
 import re
 
 bpy.types.Scene.singleOb = BoolProperty(default=False, description='Save each object into separate files (better for some cases with lightmapping and for high poly objects)')
@@ -50,10 +56,19 @@ bpy.types.Scene.returnToLocal = StringProperty(default="")
 bpy.types.Scene.triangulate = BoolProperty(default=True, description='Convert Quads to Tris on preparation')
 bpy.types.Scene.includeConnected = BoolProperty(default=False, description='Include all objects that are connected to the current selection via parent / child relationship')
 bpy.types.Scene.rotateMinusNinety = BoolProperty(default=False, description='Apply a +90° Rotation around Z on preparation to humanly translate the forward axis')
+bpy.types.Scene.leanExport = BoolProperty(default=False, description='Do not write mesh data UE4 recomputes or ignores on import (edges and binormals), for smaller files. Off by default, compare the reported file sizes before relying on it')
+bpy.types.Scene.animWorkers = IntProperty(default=0, description='Bake the actions of large animation libraries in this many background Blender processes (0 to bake them in this one)', min=0, max=64)
+bpy.types.Scene.animPadPre = FloatProperty(default=0.0, description='When exporting all actions, frames baked before the first keyframe of each action', min=0.0, max=1000.0)
+bpy.types.Scene.animPadPost = FloatProperty(default=0.0, description='When exporting all actions, frames baked after the last keyframe of each action', min=0.0, max=1000.0)
+bpy.types.Scene.animAdaptive = BoolProperty(default=False, description='Only bake the frames needed to reproduce animations within the FBX simplify tolerance, instead of every frame (not suited to simulations)')
+bpy.types.Scene.animCacheDir = StringProperty(default="", subtype='DIR_PATH', description='When exporting all actions, keep baked actions in this folder and re-use them on next exports while they are unchanged (empty to always bake them)')
+bpy.types.Scene.streamExport = BoolProperty(default=False, description='Prepare & Export in one step prepares the objects in memory and exports them directly, without adding copies to the .blend file. Always uses the mesh data engine and the built-in lightmap packer, not available with Join Objects')
 
 bpy.types.Scene.selLayers = StringProperty(default="")
 
 bpy.types.Scene.collisionType = EnumProperty(items = [('UBX', 'Box', 'Add static box as collision mesh. Don\'t deform in edit mode!'), ('USP', 'Sphere', 'Add static sphere as collision mesh. Don\'t deform in edit mode, don\'t scale on single axis!'), ('UCX', 'Convex shape', 'Add convex shape as collision mesh. Can be deformed in edit mode, but has to remain convex!')], name = "", default = 'UCX') 
+bpy.types.Scene.lightmapEngine = EnumProperty(items = [('OPS', 'Operators', 'Pack lightmap UVs with Blender operators (needs the UI)'), ('BUILTIN', 'Built-in', 'Pack lightmap UVs with the UE4EH packer: works in background mode, and packs several objects in parallel')], name = "", default = 'OPS')
+bpy.types.Scene.prepareEngine = EnumProperty(items = [('OPS', 'Operators', 'Prepare objects with Blender operators'), ('DATA', 'Mesh data', 'Prepare objects by editing their mesh data directly, without operators. Objects with shape keys and modifiers still use operators')], name = "", default = 'OPS')
 bpy.types.Scene.orgOffsetType = EnumProperty(items = [('PERC', 'Percentage', 'Offset as percentage value of each object\'s height'), ('ABS', 'Absolute', 'Offset as absolute value in Blender units e.g. meters/cm')], name = "", default = 'ABS') 
     
 class UE4Export_addPreset(AddPresetBase, bpy.types.Operator):
@@ -92,7 +107,16 @@ class UE4Export_addPreset(AddPresetBase, bpy.types.Operator):
         "scene.activateLOD",
         "scene.centerLODToOb",
         "scene.includeConnected",
-        "scene.rotateMinusNinety"
+        "scene.rotateMinusNinety",
+        "scene.prepareEngine",
+        "scene.lightmapEngine",
+        "scene.leanExport",
+        "scene.animWorkers",
+        "scene.animPadPre",
+        "scene.animPadPost",
+        "scene.animAdaptive",
+        "scene.animCacheDir",
+        "scene.streamExport"
         ]
 
 class UE4Export_presets(bpy.types.Menu):
@@ -300,6 +324,73 @@ def includeConnected():
     #Reset the active object
     bpy.context.scene.objects.active = currentActiveOb
 
+def fbxExporterModule():
+    """Return the FBX exporter module if it is the modified one shipped with UE4EH, None otherwise"""
+    try:
+        from io_scene_fbx import export_fbx_bin
+    except ImportError:
+        return None
+    if not hasattr(export_fbx_bin, "batch_session_begin"):
+        return None
+    return export_fbx_bin
+
+def fbxExportOptions(scene, axisForward):
+    """Keyword arguments of the modified FBX exporter for UE4: the export settings, and the options only exposed in the UE4EH panel"""
+    animCacheDir = None
+    if scene.animCacheDir != "":
+        animCacheDir = bpy.path.abspath(scene.animCacheDir)
+    return dict(global_matrix=axis_conversion(to_forward=axisForward, to_up='Z').to_4x4(),
+                apply_unit_scale=True,
+                axis_forward=axisForward,
+                axis_up='Z',
+                object_types={'EMPTY', 'LAMP', 'MESH', 'CAMERA', 'ARMATURE'},
+                use_mesh_modifiers=False,
+                mesh_smooth_type='FACE',
+                use_mesh_edges=False,
+                use_tspace=False,
+                use_armature_deform_only=False,
+                bake_anim=True,
+                bake_anim_use_all_actions=True,
+                path_mode='AUTO',
+                use_metadata=True,
+                add_leaf_bones=False,
+                use_ue4_lean=scene.leanExport,
+                bake_anim_workers=scene.animWorkers,
+                bake_anim_action_pad_pre=scene.animPadPre,
+                bake_anim_action_pad_post=scene.animPadPost,
+                bake_anim_cache_dir=animCacheDir,
+                bake_anim_adaptive=scene.animAdaptive)
+
+def fbxExport(operator, context, filepath, axisForward):
+    """Export the selected objects for UE4. The UE4EH export options need the modified FBX exporter, the export operator does not know about them"""
+    fbxExporter = fbxExporterModule()
+    if fbxExporter is not None:
+        fbxExporter.save(operator, context, filepath, use_selection=True, **fbxExportOptions(context.scene, axisForward))
+        return
+
+    bpy.ops.export_scene.fbx(filepath=filepath, 
+                            check_existing=True, 
+                            filter_glob="*.fbx", 
+                            use_selection=True, 
+                            global_scale=1.0, 
+                            axis_forward=axisForward, 
+                            axis_up='Z', 
+                            object_types={'EMPTY', 'LAMP', 'MESH', 'CAMERA', 'ARMATURE'}, 
+                            use_mesh_modifiers=False, 
+                            mesh_smooth_type='FACE', 
+                            use_mesh_edges=False, 
+                            use_armature_deform_only=False, 
+                            use_anim=True, 
+                            use_anim_action_all=True, 
+                            use_default_take=True, 
+                            use_anim_optimize=True, 
+                            anim_optimize_precision=6.0, 
+                            path_mode='AUTO', 
+                            batch_mode='OFF', 
+                            use_batch_own_dir=True, 
+                            use_metadata=True,
+                            add_leaf_bones=False)
+
 def clearSelection():
     #unselect all collision objects
     for ob in bpy.context.selected_objects:
@@ -311,6 +402,93 @@ def clearSelection():
     if ob is not None:        
         if "UCX_" in ob.name or "USP_" in ob.name or "UBX_"in ob.name :
             bpy.context.scene.objects.active = ob.parent
+
+def socketNames(ob, key):
+    """Names of the existing objects listed in the "colSocket" or "lodSocket" property of ob"""
+    socket = ""
+    try:
+        socket = ob[key]
+    except:
+        pass
+
+    socket = colGarbageCollect(socket)
+    if socket == "":
+        return []
+    return socket.split(',')
+
+def exportSeparateBase(filename):
+    """Path all file names of a separate files export start with"""
+    if filename[-4:].lower() == ".fbx":
+        filename = filename[:len(filename)-4]
+    if bpy.context.scene.createFolder:
+        filename += "\\"
+    return filename
+
+def exportSeparatePath(filename, file, name):
+    """File path of object name in a separate files export, filename as given by exportSeparateBase() and file as picked in the file browser"""
+    base = filename
+    if bpy.context.scene.createFolder:
+        if not os.path.exists(base):
+            os.makedirs(base)
+
+    if bpy.context.scene.useObName:
+        return base + name.replace(".", "_") + ".fbx"
+    if bpy.context.scene.createFolder:
+        base += file
+    return base + "_" + name.replace(".", "_") + ".fbx"
+
+def exportSinglePath(filename, file, name):
+    """File path of a single file export, named after object name if useObName is on"""
+    if bpy.context.scene.useObName:
+        if len(file) > 0:
+            filename = filename[:-len(file)]
+        filename += name.replace(".", "_") + ".fbx"
+
+    if filename[-4:].lower() != ".fbx":
+        filename += ".fbx"
+    return filename
+
+def parentKeepTransform(scene, ob, parent):
+    """Same as parenting ob to parent (None to clear it) keeping its world transform"""
+    scene.update()
+    matrixWorld = ob.matrix_world.copy()
+    ob.parent = parent
+    ob.matrix_world = matrixWorld
+
+def LODSetup(scene, ob, realName, elements, orgLocation, colObs):
+    """Parent ob and its LOD objects elements (in export order) to a new LOD group empty linked to scene, and name them after realName. The collision meshes colObs are renamed after the LOD0 object. Returns the LOD group empty"""
+    LODParent = bpy.data.objects.new("LOD_" + realName, None)
+    LODParent.location = ob.location
+    LODParent.layers = ob.layers
+    LODParent["isLODParent"] = True
+    scene.objects.link(LODParent)
+    parentKeepTransform(scene, ob, LODParent)
+    ob.name = mainObName = realName + "_LOD0"
+
+    for LODCounter, element in enumerate(elements, 1):
+        element.name = realName + "_LOD" + str(LODCounter)
+
+        """ Centre LODs or move them relatively """
+        if bpy.context.scene.centerLODToOb:
+            element.location = orgLocation
+        else:
+            element.location -= orgLocation
+
+        parentKeepTransform(scene, element, LODParent)
+
+    """Rename Collision meshes"""
+    for colCounter, element in enumerate(colObs):
+        element.name = element.name[:4] + mainObName + "_" + str(colCounter).zfill(2)
+
+    return LODParent
+
+def LODNames(ob):
+    """Names of the LOD objects of ob, in export order"""
+    names = socketNames(ob, "lodSocket")
+    """ Reverse LOD order optional """
+    if bpy.context.scene.reverseLODs:
+        names.reverse()
+    return names
  
 
     
@@ -479,19 +657,34 @@ class PrepareAndExport_UE4(bpy.types.Operator):
     bl_options = {'UNDO'}
 
     def execute(self, context):   
-        layers = [layer for layer in bpy.context.scene.layers]
-        bpy.context.scene.selLayers = ""   
-        for i in range(0,20):
-             bpy.context.scene.selLayers += str(int(layers[i]))
-             if i < 19:
-                bpy.context.scene.selLayers += ',' 
-        
-        bpy.context.scene.peOneStepToogle = True
-        bpy.ops.object.prepareue4()
-        bpy.ops.object.callue4export('INVOKE_DEFAULT')
+        if bpy.context.scene.streamExport:
+            if bpy.context.scene.join:
+                print("UE4EH: Join Objects needs prepared copies, falling back to the default export")
+            elif fbxExporterModule() is None:
+                print("UE4EH: Non-destructive export requires the modified FBX-Exporter script, falling back to the default export")
+            else:
+                bpy.ops.object.streamexportue4('INVOKE_DEFAULT')
+                return {'FINISHED'}
 
+        copyExport()
         return {'FINISHED'}
 
+def copyExport(filepath=None):
+    """Prepare copies of the selected objects and export them. Without filepath, the file browser is opened"""
+    layers = [layer for layer in bpy.context.scene.layers]
+    bpy.context.scene.selLayers = ""   
+    for i in range(0,20):
+         bpy.context.scene.selLayers += str(int(layers[i]))
+         if i < 19:
+            bpy.context.scene.selLayers += ',' 
+    
+    bpy.context.scene.peOneStepToogle = True
+    bpy.ops.object.prepareue4()
+    if filepath is None:
+        bpy.ops.object.callue4export('INVOKE_DEFAULT')
+    else:
+        bpy.ops.object.callue4export(filepath=filepath)
+
 class Call_UE4_Export(bpy.types.Operator):
     """Call fbx exporter"""
     bl_idname = "object.callue4export"
@@ -520,10 +713,7 @@ class Call_UE4_Export(bpy.types.Operator):
         clearSelection()
         
         if bpy.context.scene.singleOb: # Separate Files, variable name is misleading
-            if filename[-4:].lower() == ".fbx":
-                filename = filename[:len(filename)-4]
-            if bpy.context.scene.createFolder:
-                filename += "\\"                              
+            filename = exportSeparateBase(filename)
                 
             if bpy.context.scene.objects.active is None:
                 bpy.context.scene.objects.active = bpy.context.selected_objects[0]   
@@ -535,95 +725,67 @@ class Call_UE4_Export(bpy.types.Operator):
             
             for ob in objects:
                 ob.select = False
+            
+            #All files of this export share the same materials, let the exporter cache them for the whole batch
+            fbxExporter = fbxExporterModule()
+            if fbxExporter is not None:
+                fbxExporter.batch_session_begin()
                 
-            for ob in objects:
-                ob.select = True
-                bpy.context.scene.objects.active = ob
-                base = filename
-                if bpy.context.scene.createFolder:
-                    if not os.path.exists(base):
-                        os.makedirs(base)
+            try:
+                for ob in objects:
+                    ob.select = True
+                    bpy.context.scene.objects.active = ob
                    
-                realName = ""
-                try:
-                    realName = ob["realName"]
-                except:
-                    realName = ob.name
+                    realName = ""
+                    try:
+                        realName = ob["realName"]
+                    except:
+                        realName = ob.name
                     
-                if bpy.context.scene.useObName:
-                    path = base + realName.replace(".", "_") + ".fbx"
-                else:
-                    if bpy.context.scene.createFolder:
-                        base += file
-                    path = base+ "_" + realName.replace(".", "_") + ".fbx"
+                    path = exportSeparatePath(filename, file, realName)
                
-                lodPrepLocation = ob.location              
-                if bpy.context.scene.centerOb:
-                    if bpy.context.scene.centerRel:
-                        ob.location -= orgLocation   
-                        lodPrepLocation = ob.location                  
-                    else:
-                        thisObLocation = ob.location.copy()
-                        ob.location = Vector([0, 0, 0])
-                        lodPrepLocation = thisObLocation 
-                
-                #Try and select the attached collision meshes
-                colSocket = ""
-                try:
-                    colSocket = ob["colSocket"]
-                except:
-                    pass
+                    lodPrepLocation = ob.location              
+                    if bpy.context.scene.centerOb:
+                        if bpy.context.scene.centerRel:
+                            ob.location -= orgLocation   
+                            lodPrepLocation = ob.location                  
+                        else:
+                            thisObLocation = ob.location.copy()
+                            ob.location = Vector([0, 0, 0])
+                            lodPrepLocation = thisObLocation 
                 
-                colSocket = colGarbageCollect(colSocket)
-                if colSocket != "":
-                    for name in colSocket.split(","):
+                    #Try and select the attached collision meshes
+                    for name in socketNames(ob, "colSocket"):
                         bpy.data.objects[name].select = True
                  
-                bpy.ops.object.parent_clear(type='CLEAR_KEEP_TRANSFORM')    
+                    bpy.ops.object.parent_clear(type='CLEAR_KEEP_TRANSFORM')    
         
-                LODPrepare(ob, lodPrepLocation)   
+                    LODPrepare(ob, lodPrepLocation)   
                     
-                bpy.ops.export_scene.fbx(filepath=path, 
-                                        check_existing=True, 
-                                        filter_glob="*.fbx", 
-                                        use_selection=True, 
-                                        global_scale=1.0, 
-                                        axis_forward='-Y', 
-                                        axis_up='Z', 
-                                        object_types={'EMPTY', 'LAMP', 'MESH', 'CAMERA', 'ARMATURE'}, 
-                                        use_mesh_modifiers=False, 
-                                        mesh_smooth_type='FACE', 
-                                        use_mesh_edges=False, 
-                                        use_armature_deform_only=False, 
-                                        use_anim=True, 
-                                        use_anim_action_all=True, 
-                                        use_default_take=True, 
-                                        use_anim_optimize=True, 
-                                        anim_optimize_precision=6.0, 
-                                        path_mode='AUTO', 
-                                        batch_mode='OFF', 
-                                        use_batch_own_dir=True, 
-                                        use_metadata=True,
-                                        add_leaf_bones=False)
+                    fbxExport(self, context, path, '-Y')
                                         
                                         
-                #undo the operation for the collision objects    
-                """ Has to be redone for the new LOD options 
-                if colSocket != "":
-                    for name in colSocket.split(","):
-                        colOb = bpy.data.objects[name]
-                        colMatrix = colOb.matrix_world
-                        colOb.parent = ob
-                        colOb.matrix_world = colMatrix
-                        colOb.select = False
-                        colList.append(colOb) """
+                    #undo the operation for the collision objects    
+                    """ Has to be redone for the new LOD options 
+                    if colSocket != "":
+                        for name in colSocket.split(","):
+                            colOb = bpy.data.objects[name]
+                            colMatrix = colOb.matrix_world
+                            colOb.parent = ob
+                            colOb.matrix_world = colMatrix
+                            colOb.select = False
+                            colList.append(colOb) """
                         
-                if bpy.context.scene.centerOb:
-                    if bpy.context.scene.centerRel:
-                        ob.location += orgLocation                    
-                    else:
-                        ob.location = thisObLocation    
-                ob.select = False
+                    if bpy.context.scene.centerOb:
+                        if bpy.context.scene.centerRel:
+                            ob.location += orgLocation                    
+                        else:
+                            ob.location = thisObLocation    
+                    ob.select = False
+                
+            finally:
+                if fbxExporter is not None:
+                    fbxExporter.batch_session_end()
                               
         else: # Single file        
             """Find the originally active object"""
@@ -651,13 +813,7 @@ class Call_UE4_Export(bpy.types.Operator):
             except:
                 realName = ob.name
                 
-            if bpy.context.scene.useObName:
-                if len(file) > 0:
-                    filename = filename[:-len(file)]
-                filename += realName.replace(".", "_") + ".fbx"          
-                
-            if filename[-4:].lower() != ".fbx":
-               filename += ".fbx"
+            filename = exportSinglePath(filename, file, realName)
 
             if bpy.context.scene.centerOb:
                 for element in objects:
@@ -665,43 +821,14 @@ class Call_UE4_Export(bpy.types.Operator):
        
             #Try and select the attached collision meshes
             for element in objects:
-                colSocket = ""
-                try:
-                    colSocket = element["colSocket"]
-                except:
-                    pass
-                
-                colSocket = colGarbageCollect(colSocket)
-                if colSocket != "":
-                    for name in colSocket.split(","):
-                        bpy.data.objects[name].select = True
+                for name in socketNames(element, "colSocket"):
+                    bpy.data.objects[name].select = True
              
             bpy.ops.object.parent_clear(type='CLEAR_KEEP_TRANSFORM')    
 
             LODPrepare(ob, orgLocation)   
     
-            bpy.ops.export_scene.fbx(filepath=filename, 
-                                    check_existing=True, 
-                                    filter_glob="*.fbx", 
-                                    use_selection=True, 
-                                    global_scale=1.0, 
-                                    axis_forward='Y', 
-                                    axis_up='Z', 
-                                    object_types={'EMPTY', 'LAMP', 'MESH', 'CAMERA', 'ARMATURE'}, 
-                                    use_mesh_modifiers=False, 
-                                    mesh_smooth_type='FACE', 
-                                    use_mesh_edges=False, 
-                                    use_armature_deform_only=False, 
-                                    use_anim=True, 
-                                    use_anim_action_all=True, 
-                                    use_default_take=True, 
-                                    use_anim_optimize=True, 
-                                    anim_optimize_precision=6.0, 
-                                    path_mode='AUTO', 
-                                    batch_mode='OFF', 
-                                    use_batch_own_dir=True, 
-                                    use_metadata=True,
-                                    add_leaf_bones=False)
+            fbxExport(self, context, filename, 'Y')
                          
             #undo the operation for the collision objects  
             """ Has to be redone for the new LOD options
@@ -808,83 +935,449 @@ def returnToLocalView():
 
 def LODPrepare(ob, orgLocation):
     """Prepare LOD Export"""
-    LODSocket = ""
+    names = LODNames(ob)
+    if not names:
+        return "noLOD"
+
+    realName = ""
     try:
-        LODSocket = ob["lodSocket"]
+        realName = ob["realName"]
     except:
-        pass
-  
-    LODSocket = colGarbageCollect(LODSocket) 
-                          
-    if LODSocket != "":
-        realName = ""
-        try:
-            realName = ob["realName"]
-        except:
-            realName = ob.name
-        
-        bpy.ops.object.empty_add(type='PLAIN_AXES')
-        LODParent = bpy.context.active_object
-        LODParent.name = "LOD_" + realName
-        LODParent.location = ob.location
-        LODParent.select = True
-        LODParent["isLODParent"] = True
-        bpy.context.scene.update()
-        matrixWorld = ob.matrix_world
-        print(ob.location)
-        ob.parent = LODParent
-        ob.matrix_world = matrixWorld
-        print(ob.location)
-        ob.name = mainObName = realName + "_LOD0"
-        ob.select = True
-
-        LODCounter = 1
-                   
-        """ Reverse LOD order optional """
-        names = LODSocket.split(',')
+        realName = ob.name
 
-        if bpy.context.scene.reverseLODs:
-            names = reversed(names)
-            
-        for name in names:
-            element = bpy.data.objects[name]  
-            element.name = realName + "_LOD" + str(LODCounter)
-            
-            """ Centre LODs or move them relatively """
-            if bpy.context.scene.centerLODToOb:
-                element.location = orgLocation
-            else:
-                element.location -= orgLocation
-                
-            bpy.context.scene.update()
-            matrixWorld = element.matrix_world
-            element.parent = LODParent
-            element.matrix_world = matrixWorld
-            element.select = True
-            LODCounter += 1
+    elements = [bpy.data.objects[name] for name in names]
+    colObs = [bpy.data.objects[name] for name in socketNames(ob, "colSocket")]
+    LODParent = LODSetup(bpy.context.scene, ob, realName, elements, orgLocation, colObs)
+    for element in [LODParent, ob] + elements + colObs:
+        element.select = True
+    return ob.name
 
-        
-        """Rename Collision meshes"""
-        colSocket = ""
-        try:
-            colSocket = ob["colSocket"]
-        except:
-            pass
-      
-        colSocket = colGarbageCollect(colSocket) 
-                    
-        if colSocket != "":
-             colCounter = 0
-             
-             for name in colSocket.split(','):
-                 element = bpy.data.objects[name]
-                 element.name = element.name[:4] + mainObName + "_" + str(colCounter).zfill(2)
-                 colCounter += 1
-                 element.select = True
-        
-        return mainObName
-        
-    return "noLOD"
+def packLightmap():
+    """Add a lightmap UV layer to the mesh in edit mode, and pack (and optionally snap to grid) its islands"""
+    bpy.ops.mesh.uv_texture_add()
+    #optional for objects with only 1 uv layer
+    #bpy.context.object.data.active_index = 1
+    bpy.ops.uv.select_all(action='SELECT')
+    bpy.ops.uv.pack_islands(margin=bpy.context.scene.lightMargin, rotate=True)
+    if bpy.context.scene.lightmapSnap:
+        orgImage = None
+
+        area_type = bpy.context.area.type
+        bpy.context.area.type = 'IMAGE_EDITOR'
+        orgImage = bpy.context.space_data.image
+        bpy.context.space_data.image = bpy.data.images["lightmap_" + str(bpy.context.scene.lightGrid)]
+
+        bpy.ops.uv.snap_selected(target='PIXELS')
+        if orgImage != None:
+            bpy.context.area.spaces.active.image = orgImage
+        bpy.context.area.type = area_type
+
+def lightmapIslands(uvs, loopStarts, loopTotals, vertIndices):
+    """Group faces into UV islands (faces sharing an edge with the same UVs, as pack_islands does), returns a list of lists of face indices"""
+    parents = list(range(len(loopStarts)))
+
+    def find(face):
+        while parents[face] != face:
+            parents[face] = parents[parents[face]]
+            face = parents[face]
+        return face
+
+    uvFaces = {}
+    for face, (start, total) in enumerate(zip(loopStarts, loopTotals)):
+        corners = [(vertIndices[loop], round(uvs[loop * 2], 5), round(uvs[loop * 2 + 1], 5)) for loop in range(start, start + total)]
+        for i in range(total):
+            """An edge is shared when both its vertices have the same UVs in both faces"""
+            key = tuple(sorted((corners[i - 1], corners[i])))
+            other = uvFaces.setdefault(key, face)
+            if other != face:
+                parents[find(face)] = find(other)
+
+    islands = {}
+    for face in range(len(loopStarts)):
+        islands.setdefault(find(face), []).append(face)
+    return list(islands.values())
+
+def lightmapConvexHull(points):
+    """Convex hull of 2D points (monotone chain)"""
+    points = sorted(set(points))
+    if len(points) < 3:
+        return points
+    def cross(o, a, b):
+        return (a[0] - o[0]) * (b[1] - o[1]) - (a[1] - o[1]) * (b[0] - o[0])
+    lower = []
+    upper = []
+    for p in points:
+        while len(lower) >= 2 and cross(lower[-2], lower[-1], p) <= 0:
+            lower.pop()
+        lower.append(p)
+    for p in reversed(points):
+        while len(upper) >= 2 and cross(upper[-2], upper[-1], p) <= 0:
+            upper.pop()
+        upper.append(p)
+    return lower[:-1] + upper[:-1]
+
+def lightmapPack(job):
+    """Pack UV islands into the unit square with margin (and rotation), and optionally snap UVs to the lightmap grid.
+    Only works on plain arrays (see lightmapJob), so it can run headless. Returns the new UVs"""
+    uvs, loopStarts, loopTotals, vertIndices, margin, grid, rotate = job
+
+    if uvs is None:
+        """Mesh without UVs, like Blender each face gets its own square (quads) or circle shaped UVs"""
+        uvs = array.array('f', [0.0]) * (len(vertIndices) * 2)
+        for start, total in zip(loopStarts, loopTotals):
+            for i in range(total):
+                if total == 4:
+                    u, v = ((0.0, 0.0), (1.0, 0.0), (1.0, 1.0), (0.0, 1.0))[i]
+                else:
+                    angle = 2.0 * pi * i / total
+                    u, v = 0.5 + 0.5 * cos(angle), 0.5 + 0.5 * sin(angle)
+                uvs[(start + i) * 2] = u
+                uvs[(start + i) * 2 + 1] = v
+        islands = [[face] for face in range(len(loopStarts))]
+    else:
+        uvs = array.array('f', uvs)
+        islands = lightmapIslands(uvs, loopStarts, loopTotals, vertIndices)
+
+    """Rotate each island to its minimal area bounding box, and make it lie flat"""
+    boxes = []
+    islandsArea = 0.0
+    for faces in islands:
+        loops = [loop for face in faces for loop in range(loopStarts[face], loopStarts[face] + loopTotals[face])]
+        islandArea = 0.0
+        for face in faces:
+            start, total = loopStarts[face], loopTotals[face]
+            faceArea = 0.0
+            for i in range(total):
+                j = start + (i + 1) % total
+                faceArea += uvs[(start + i) * 2] * uvs[j * 2 + 1] - uvs[j * 2] * uvs[(start + i) * 2 + 1]
+            islandArea += abs(faceArea) / 2
+        islandsArea += sqrt(islandArea)
+        hull = lightmapConvexHull([(uvs[loop * 2], uvs[loop * 2 + 1]) for loop in loops])
+        bestAngle = 0.0
+        if rotate and len(hull) > 2:
+            bestArea = None
+            for p, q in zip(hull, hull[1:] + hull[:1]):
+                angle = atan2(q[1] - p[1], q[0] - p[0])
+                c, s = cos(-angle), sin(-angle)
+                us = [x * c - y * s for x, y in hull]
+                vs = [x * s + y * c for x, y in hull]
+                area = (max(us) - min(us)) * (max(vs) - min(vs))
+                if bestArea is None or area < bestArea:
+                    bestArea, bestAngle = area, -angle
+        c, s = cos(bestAngle), sin(bestAngle)
+        for loop in loops:
+            x, y = uvs[loop * 2], uvs[loop * 2 + 1]
+            uvs[loop * 2], uvs[loop * 2 + 1] = x * c - y * s, x * s + y * c
+        us = [uvs[loop * 2] for loop in loops]
+        vs = [uvs[loop * 2 + 1] for loop in loops]
+        minU, minV, width, height = min(us), min(vs), max(us) - min(us), max(vs) - min(vs)
+        if rotate and height > width:
+            for loop in loops:
+                x, y = uvs[loop * 2], uvs[loop * 2 + 1]
+                uvs[loop * 2], uvs[loop * 2 + 1] = -y, x
+            minU, minV, width, height = -(minV + height), minU, height, width
+        boxes.append([loops, minU, minV, width, height])
+
+    """Same margin as Blender's pack islands (param_pack): scaled by the sum of the square roots of the islands UV areas,
+    and kept on each side of the islands"""
+    margin = margin * islandsArea * 0.1
+    padding = margin * 2
+
+    """Shelf packing of islands by decreasing height, trying a few widths and keeping the most square result"""
+    boxes.sort(key=lambda box: -box[4])
+    paddedArea = sum((box[3] + padding) * (box[4] + padding) for box in boxes)
+    maxWidth = max([box[3] + padding for box in boxes] + [0.0])
+    best = None
+    for factor in (1.0, 1.05, 1.1, 1.2, 1.35, 1.5):
+        shelfWidth = max(sqrt(paddedArea) * factor, maxWidth)
+        x = y = shelfHeight = usedWidth = 0.0
+        positions = []
+        for loops, minU, minV, width, height in boxes:
+            if x > 0.0 and x + width + padding > shelfWidth:
+                y += shelfHeight
+                x = shelfHeight = 0.0
+            positions.append((x + margin - minU, y + margin - minV))
+            x += width + padding
+            usedWidth = max(usedWidth, x)
+            shelfHeight = max(shelfHeight, height + padding)
+        side = max(usedWidth, y + shelfHeight)
+        if best is None or side < best[0]:
+            best = (side, positions)
+
+    side, positions = best
+    scale = 1.0 / side if side > 0.0 else 1.0
+    for (loops, minU, minV, width, height), (offsetU, offsetV) in zip(boxes, positions):
+        for loop in loops:
+            uvs[loop * 2] = (uvs[loop * 2] + offsetU) * scale
+            uvs[loop * 2 + 1] = (uvs[loop * 2 + 1] + offsetV) * scale
+
+    """Snap to pixels, like uv.snap_selected(target='PIXELS')"""
+    if grid:
+        for i in range(len(uvs)):
+            uvs[i] = floor(uvs[i] * grid + 0.5) / grid
+
+    return uvs
+
+def cacheGet(cache, key):
+    """Return the value stored under key in an OrderedDict cache (None if there is none), marking it as recently used"""
+    value = cache.get(key)
+    if value is not None:
+        cache.move_to_end(key)
+    return value
+
+def cacheSet(cache, key, value, size):
+    """Store value under key in an OrderedDict cache, dropping the least recently used entries beyond size"""
+    cache[key] = value
+    cache.move_to_end(key)
+    while len(cache) > size:
+        cache.popitem(last=False)
+
+"""Packed lightmap UVs, per lightmapPack job hash. Entries hold a float per UV coordinate, keep only the recent ones"""
+lightmapCache = OrderedDict()
+lightmapCacheSize = 64
+
+def lightmapJobHash(job):
+    """Hash of everything lightmapPack result depends on: topology, source UVs and lightmap settings"""
+    uvs, loopStarts, loopTotals, vertIndices, margin, grid, rotate = job
+    hash = hashlib.sha1(repr((margin, grid, rotate, uvs is None)).encode())
+    for data in (uvs, loopStarts, loopTotals, vertIndices):
+        if data is not None:
+            hash.update(data.tobytes())
+    return hash.digest()
+
+def lightmapJob(me):
+    """Read what lightmapPack needs from the mesh"""
+    loopStarts = array.array('i', [0]) * len(me.polygons)
+    loopTotals = array.array('i', [0]) * len(me.polygons)
+    vertIndices = array.array('i', [0]) * len(me.loops)
+    me.polygons.foreach_get("loop_start", loopStarts)
+    me.polygons.foreach_get("loop_total", loopTotals)
+    me.loops.foreach_get("vertex_index", vertIndices)
+    uvs = None
+    if me.uv_layers.active is not None:
+        uvs = array.array('f', [0.0]) * (len(me.loops) * 2)
+        me.uv_layers.active.data.foreach_get("uv", uvs)
+    scene = bpy.context.scene
+    return (uvs, loopStarts, loopTotals, vertIndices, scene.lightMargin, scene.lightGrid if scene.lightmapSnap else 0, True)
+
+def lightmapPackAll(meshes):
+    """Add a packed lightmap UV layer to all meshes, without operators"""
+    jobs = [lightmapJob(me) for me in meshes]
+    keys = [lightmapJobHash(job) for job in jobs]
+
+    """Unchanged meshes re-use their packed UVs from previous runs"""
+    packed = {}
+    for key in keys:
+        uvs = cacheGet(lightmapCache, key)
+        if uvs is not None:
+            packed[key] = uvs
+    for key, job in zip(keys, jobs):
+        if key in packed:
+            continue
+        uvs = lightmapPack(job)
+        packed[key] = uvs
+        cacheSet(lightmapCache, key, uvs, lightmapCacheSize)
+    results = [packed[key] for key in keys]
+
+    for me, uvs in zip(meshes, results):
+        layer = me.uv_textures.new()
+        if layer is None:
+            print("Warning: Couldn't add lightmap UV layer to ", me.name)
+            continue
+        me.uv_textures.active = layer
+        me.uv_layers[layer.name].data.foreach_set("uv", uvs)
+
+def meshSelectAll(me):
+    """Select all vertices, edges and faces of the mesh at once"""
+    me.vertices.foreach_set("select", [True] * len(me.vertices))
+    me.edges.foreach_set("select", [True] * len(me.edges))
+    me.polygons.foreach_set("select", [True] * len(me.polygons))
+
+def meshOffsetZ(me, offset):
+    """Move all vertices of the mesh along Z at once"""
+    coords = array.array('f', [0.0]) * (len(me.vertices) * 3)
+    me.vertices.foreach_get("co", coords)
+    coords[2::3] = array.array('f', [z + offset for z in coords[2::3]])
+    me.vertices.foreach_set("co", coords)
+
+def triangulateMesh(me):
+    """Same as quads_convert_to_tris(quad_method='BEAUTY', ngon_method='BEAUTY') on all visible faces, without edit mode"""
+    bm = bmesh.new()
+    bm.from_mesh(me)
+    # quad_method and ngon_method 0 are 'BEAUTY'
+    bmesh.ops.triangulate(bm, faces=[face for face in bm.faces if not face.hide], quad_method=0, ngon_method=0)
+    bm.to_mesh(me)
+    bm.free()
+    me.update()
+
+def dataPrepareSupported(ob):
+    """Whether the 'Mesh data' prepare engine gives the same result as operators for this object"""
+    if ob.type == 'MESH' and ob.data.shape_keys is not None:
+        # Operators cannot apply modifiers on meshes with shape keys, and keep them instead
+        return not any(mod.show_viewport for mod in ob.modifiers)
+    return True
+
+def dataApplyTransform(ob, rotation=True, scale=True):
+    """Same as bpy.ops.object.transform_apply(location=False, ...), done on the mesh data directly"""
+    #Rotation and scale matrices of the object, delta transforms included
+    if ob.rotation_mode == 'QUATERNION':
+        rotMatrix = ob.delta_rotation_quaternion.normalized().to_matrix() * ob.rotation_quaternion.normalized().to_matrix()
+    elif ob.rotation_mode == 'AXIS_ANGLE':
+        rotMatrix = Quaternion(ob.rotation_axis_angle[1:], ob.rotation_axis_angle[0]).to_matrix()
+    else:
+        rotMatrix = Euler(ob.delta_rotation_euler, ob.rotation_mode).to_matrix() * Euler(ob.rotation_euler, ob.rotation_mode).to_matrix()
+    size = [s * ds for s, ds in zip(ob.scale, ob.delta_scale)]
+    scaleMatrix = Matrix(((size[0], 0.0, 0.0), (0.0, size[1], 0.0), (0.0, 0.0, size[2])))
+
+    if rotation and scale:
+        matrix = rotMatrix * scaleMatrix
+    elif scale:
+        matrix = scaleMatrix
+    else:
+        """The object keeps its scale, so the rotation is applied in scaled space"""
+        matrix = scaleMatrix.inverted_safe() * rotMatrix * scaleMatrix
+    ob.data.transform(matrix.to_4x4(), shape_keys=True)
+    if rotation:
+        ob.rotation_euler = (0.0, 0.0, 0.0)
+        ob.rotation_quaternion = (1.0, 0.0, 0.0, 0.0)
+        ob.rotation_axis_angle = (0.0, 0.0, 1.0, 0.0)
+        ob.delta_rotation_euler = (0.0, 0.0, 0.0)
+        ob.delta_rotation_quaternion = (1.0, 0.0, 0.0, 0.0)
+    if scale:
+        ob.scale = (1.0, 1.0, 1.0)
+        ob.delta_scale = (1.0, 1.0, 1.0)
+
+def dataMeshObject(ob, me):
+    """Return a new mesh object using me, with the transformation, parenting, custom properties, object materials and action of ob. It is not linked to any scene"""
+    meshOb = bpy.data.objects.new(ob.name, me)
+    meshOb.rotation_mode = ob.rotation_mode
+    for prop in ('location', 'rotation_euler', 'rotation_quaternion', 'rotation_axis_angle', 'scale',
+                 'delta_location', 'delta_rotation_euler', 'delta_rotation_quaternion', 'delta_scale',
+                 'parent', 'parent_type', 'parent_bone', 'matrix_parent_inverse', 'layers', 'pass_index'):
+        setattr(meshOb, prop, getattr(ob, prop))
+    for key in ob.keys():
+        meshOb[key] = ob[key]
+    for slot, meshSlot in zip(ob.material_slots, meshOb.material_slots):
+        if slot.link == 'OBJECT':
+            meshSlot.link = 'OBJECT'
+            meshSlot.material = slot.material
+    if ob.animation_data is not None and ob.animation_data.action is not None:
+        meshOb.animation_data_create().action = ob.animation_data.action
+    return meshOb
+
+def dataConvertToMesh(scene, ob):
+    """Same as converting ob to mesh and applying its viewport modifiers, returns the resulting mesh object"""
+    if ob.type == 'MESH' and not any(mod.show_viewport for mod in ob.modifiers):
+        for mod in reversed(ob.modifiers[:]):
+            ob.modifiers.remove(mod)
+        return ob
+
+    me = ob.to_mesh(scene, True, 'PREVIEW')
+    for mod in reversed(ob.modifiers[:]):
+        ob.modifiers.remove(mod)
+
+    if ob.type == 'MESH':
+        orgMesh = ob.data
+        ob.data = me
+        bpy.data.meshes.remove(orgMesh)
+        return ob
+
+    """Curves and texts need a new object, an object can't change its type"""
+    meshOb = dataMeshObject(ob, me)
+    scene.objects.link(meshOb)
+    meshOb.select = ob.select
+
+    name = ob.name
+    curve = ob.data
+    scene.objects.unlink(ob)
+    bpy.data.objects.remove(ob)
+    if curve.users == 0:
+        bpy.data.curves.remove(curve)
+    meshOb.name = name
+    return meshOb
+
+def dataWorldMatrix(scene, ob):
+    """World matrix of ob from its current transform. The scene is only updated for parents the object matrices can't be combined for (bones, vertices, constraints)"""
+    if not ob.constraints:
+        if ob.parent is None:
+            return ob.matrix_basis.copy()
+        if ob.parent_type == 'OBJECT':
+            return ob.parent.matrix_world * ob.matrix_parent_inverse * ob.matrix_basis
+    scene.update()
+    return ob.matrix_world.copy()
+
+def dataDimensionZ(scene, ob):
+    """Same as ob.dimensions[2] of a mesh object without modifiers, without updating the scene first"""
+    me = ob.data
+    if len(me.vertices) > 0:
+        coords = array.array('f', [0.0]) * (len(me.vertices) * 3)
+        me.vertices.foreach_get("co", coords)
+        height = max(coords[2::3]) - min(coords[2::3])
+    else:
+        """Blender gives empty meshes a bounding box from -1 to 1"""
+        height = 2.0
+    return height * dataWorldMatrix(scene, ob).to_scale()[2]
+
+def dataPrepare(context, duplicate, lightmapMeshes, scene=None):
+    """Prepare a duplicate like the operators based preparation does, but on the mesh data directly. Returns the prepared object (curves and texts get a new mesh object). Meshes left to the built-in lightmap engine are added to lightmapMeshes. The duplicate may be linked to another scene than the context one, its settings are still read from the context scene"""
+    settings = context.scene
+    if scene is None:
+        scene = settings
+
+    duplicate = dataConvertToMesh(scene, duplicate)
+    scene.objects.active = duplicate
+    me = duplicate.data
+
+    if settings.applyTransform:
+        dataApplyTransform(duplicate, rotation=True, scale=True)
+
+    if settings.rotateMinusNinety: #important to keep this after the original "Apply Transformation"
+        dataApplyTransform(duplicate, rotation=True, scale=False)
+        duplicate.rotation_euler = (0, 0, radians(90))
+        dataApplyTransform(duplicate, rotation=True, scale=False)
+
+    if settings.unparent and duplicate.parent is not None:
+        matrixWorld = dataWorldMatrix(scene, duplicate)
+        duplicate.parent = None
+        duplicate.matrix_world = matrixWorld
+
+    if (settings.orgToGeo or settings.orgToBottom) and len(me.vertices) > 0:
+        """Origin to median of vertices"""
+        coords = array.array('f', [0.0]) * (len(me.vertices) * 3)
+        me.vertices.foreach_get("co", coords)
+        nbrVerts = len(me.vertices)
+        center = Vector((sum(coords[0::3]) / nbrVerts, sum(coords[1::3]) / nbrVerts, sum(coords[2::3]) / nbrVerts))
+        me.transform(Matrix.Translation(-center))
+        duplicate.location += dataWorldMatrix(scene, duplicate).to_3x3() * center
+
+    meshSelectAll(me)
+
+    dimension = dataDimensionZ(scene, duplicate)
+    originOffset = 0
+    if settings.orgOffsetType == 'ABS':
+        originOffset = settings.orgToBottomOffset
+    if settings.orgOffsetType == 'PERC':
+        originOffset = dimension / 100 * settings.orgToBottomOffset
+
+    if settings.orgToBottom:
+        meshOffsetZ(me, dimension / 2 - originOffset)
+
+    """Lightmap packing with operators has no data level API, only this part needs edit mode (so the context scene)"""
+    if settings.createLightmap and not settings.join and (settings.lightmapEngine == 'BUILTIN' or scene != settings):
+        lightmapMeshes.append(me)
+    elif settings.createLightmap and not settings.join:
+        bpy.ops.object.mode_set(mode='EDIT', toggle=False)
+        packLightmap()
+        bpy.ops.object.mode_set(mode='OBJECT', toggle=False)
+
+    if settings.triangulate:
+        triangulateMesh(me)
+
+    me.update()
+    if settings.orgToBottom:
+        duplicate.location[2] -= dimension / 2 - originOffset
+
+    return duplicate
 
 class Prepare_UE4_Export(bpy.types.Operator):
     """Prepare selected objects for UE4 export"""
@@ -938,7 +1431,7 @@ class Prepare_UE4_Export(bpy.types.Operator):
             LODList = {}
                 
             """Create grid image"""
-            if bpy.context.scene.lightmapSnap:
+            if bpy.context.scene.lightmapSnap and bpy.context.scene.lightmapEngine == 'OPS':
                 #check if existing:
                 imgName = "lightmap_"+str(bpy.context.scene.lightGrid)
                 tempImg = None
@@ -949,6 +1442,8 @@ class Prepare_UE4_Export(bpy.types.Operator):
                 if tempImg == None:                                  
                     tempImg = bpy.ops.image.new(name=imgName, width=bpy.context.scene.lightGrid, height=bpy.context.scene.lightGrid, color=(0.0, 0.0, 0.0, 1.0), alpha=False, float=False)    
                       
+            lightmapMeshes = []
+            prepareStart = time.perf_counter()
             for ob in objects:                
                 if ob.type == 'MESH' or ob.type == 'CURVE' or ob.type == 'FONT':                          
                     isLODOb = False
@@ -974,6 +1469,15 @@ class Prepare_UE4_Export(bpy.types.Operator):
                     duplicate.layers = (False, False, False, False, False, False, False, False, False, False, False, False, False, False, False, False, False, False, False, True)
                     duplicate.select = True
                     
+                    if bpy.context.scene.prepareEngine == 'DATA' and dataPrepareSupported(duplicate):
+                        isActive = activeOb == duplicate
+                        duplicate = dataPrepare(context, duplicate, lightmapMeshes)
+                        if isActive:
+                            activeOb = duplicate
+                        duplicate.select = False
+                        dupliList.append(duplicate)
+                        continue
+                    
                     if ob.type == 'CURVE' or ob.type == 'FONT':
                         bpy.ops.object.convert(target='MESH')
                         duplicate.select = True
@@ -1009,51 +1513,40 @@ class Prepare_UE4_Export(bpy.types.Operator):
                     context.tool_settings.mesh_select_mode = [True, False, False]
                     bpy.ops.object.mode_set(mode='OBJECT', toggle=False)
                     
+                    dimension = duplicate.dimensions[2]
                     originOffset = 0
                     if bpy.context.scene.orgOffsetType == 'ABS':
                         originOffset = bpy.context.scene.orgToBottomOffset
                     if bpy.context.scene.orgOffsetType == 'PERC':
-                        originOffset = duplicate.dimensions[2] / 100 * bpy.context.scene.orgToBottomOffset if bpy.context.scene.orgToBottomOffset is not 0 else 0
-                        
-                    for vert in duplicate.data.vertices:
-                        vert.select = True
+                        originOffset = dimension / 100 * bpy.context.scene.orgToBottomOffset
                         
-                        if bpy.context.scene.orgToBottom:
-                            vert.co[2] += duplicate.dimensions[2] / 2 - originOffset
+                    meshSelectAll(duplicate.data)
+                    if bpy.context.scene.orgToBottom:
+                        meshOffsetZ(duplicate.data, dimension / 2 - originOffset)
                     
                     bpy.ops.object.mode_set(mode='EDIT', toggle=False)
                     
                     if bpy.context.scene.createLightmap and not bpy.context.scene.join:
-                        bpy.ops.mesh.uv_texture_add() 
-                        #optional for objects with only 1 uv layer
-                        #bpy.context.object.data.active_index = 1
-                        bpy.ops.uv.select_all(action='SELECT')
-                        bpy.ops.uv.pack_islands(margin=bpy.context.scene.lightMargin, rotate=True)
-                        if bpy.context.scene.lightmapSnap:
-                            orgImage = None
-                    
-                            area_type = bpy.context.area.type
-                            bpy.context.area.type = 'IMAGE_EDITOR'
-                            orgImage =  bpy.context.space_data.image 
-                            bpy.context.space_data.image = bpy.data.images[imgName]
-
-                            bpy.ops.uv.snap_selected(target='PIXELS')
-                            if orgImage != None:
-                                bpy.context.area.spaces.active.image = orgImage
-                            bpy.context.area.type = area_type    
+                        if bpy.context.scene.lightmapEngine == 'BUILTIN':
+                            lightmapMeshes.append(duplicate.data)
+                        else:
+                            packLightmap()
                    
-                    if bpy.context.scene.triangulate:
-                        bpy.ops.mesh.quads_convert_to_tris(quad_method='BEAUTY', ngon_method='BEAUTY')
-                        
                     context.tool_settings.mesh_select_mode = sel_mode
                     bpy.ops.object.mode_set(mode='OBJECT', toggle=False)                   
                     
+                    if bpy.context.scene.triangulate:
+                        triangulateMesh(duplicate.data)
+                    
                     if bpy.context.scene.orgToBottom:
-                        duplicate.location[2] -= duplicate.dimensions[2] / 2 - originOffset
+                        duplicate.location[2] -= dimension / 2 - originOffset
                     duplicate.select = False
                     
                     dupliList.append(duplicate)
                     
+            if lightmapMeshes:
+                lightmapPackAll(lightmapMeshes)
+            print("UE4EH: prepared %d objects in %.3f sec. (%s engine)" % (len(dupliList), time.perf_counter() - prepareStart, bpy.context.scene.prepareEngine))
  
             #hidden objects get exported by the fbx exporter and so lead to mindbugging errors
             bpy.ops.object.hide_view_clear()
@@ -1074,33 +1567,20 @@ class Prepare_UE4_Export(bpy.types.Operator):
                 
             """When objects are joined, lightmap needs to be created after joining"""
 
-            if bpy.context.scene.createLightmap and bpy.context.scene.join:
+            if bpy.context.scene.createLightmap and bpy.context.scene.join and bpy.context.scene.lightmapEngine == 'BUILTIN':
+                lightmapPackAll([activeOb.data])
+            elif bpy.context.scene.createLightmap and bpy.context.scene.join:
                 bpy.context.scene.objects.active.select = True
                 bpy.ops.object.mode_set(mode='EDIT', toggle=False)
                 sel_mode = context.tool_settings.mesh_select_mode
                 context.tool_settings.mesh_select_mode = [True, False, False]
                 bpy.ops.object.mode_set(mode='OBJECT', toggle   =False)
 
-                for vert in activeOb.data.vertices:
-                    vert.select = True
+                meshSelectAll(activeOb.data)
                     
                 bpy.ops.object.mode_set(mode='EDIT', toggle=False)
             
-                bpy.ops.mesh.uv_texture_add() 
-                bpy.ops.uv.select_all(action='SELECT')
-                bpy.ops.uv.pack_islands(margin=bpy.context.scene.lightMargin, rotate=True)
-                if bpy.context.scene.lightmapSnap:
-                    orgImage = None
-            
-                    area_type = bpy.context.area.type
-                    bpy.context.area.type = 'IMAGE_EDITOR'
-                    orgImage =  bpy.context.space_data.image 
-                    bpy.context.space_data.image = bpy.data.images[imgName]
-
-                    bpy.ops.uv.snap_selected(target='PIXELS')
-                    if orgImage != None:
-                        bpy.context.area.spaces.active.image = orgImage
-                    bpy.context.area.type = area_type
+                packLightmap()
 
                 context.tool_settings.mesh_select_mode = sel_mode
                 bpy.ops.object.mode_set(mode='OBJECT', toggle=False)
@@ -1186,6 +1666,233 @@ class Prepare_UE4_Export(bpy.types.Operator):
             
             return {'FINISHED'}
         
+def streamMesh(context, scene, ob, lightmapMeshes):
+    """Link a prepared copy of ob to scene, made from its evaluated mesh: ob and its data are left untouched. Returns the copy"""
+    if ob.type == 'MESH' and ob.data.shape_keys is not None:
+        """to_mesh() drops shape keys. Meshes with both shape keys and modifiers are left to the copy based export (see streamUnsupported)"""
+        me = ob.data.copy()
+    else:
+        me = ob.to_mesh(context.scene, True, 'PREVIEW')
+
+    if ob.type == 'MESH':
+        streamOb = ob.copy()
+        streamOb.data = me
+        for mod in reversed(streamOb.modifiers[:]):
+            streamOb.modifiers.remove(mod)
+    else:
+        streamOb = dataMeshObject(ob, me)
+    streamOb.hide = False
+    scene.objects.link(streamOb)
+    return dataPrepare(context, streamOb, lightmapMeshes, scene)
+
+def streamClearParent(scene, ob):
+    """Same as bpy.ops.object.parent_clear(type='CLEAR_KEEP_TRANSFORM') on a stream object"""
+    if ob.parent is not None:
+        parentKeepTransform(scene, ob, None)
+
+def streamCollisions(scene, streamOb, ob):
+    """Link copies of the collision meshes attached to ob to scene, with rotation and scale applied and named after streamOb. They are parented to streamOb (keeping their transform), so they follow it when it gets centred, as in the copy based export. Returns them"""
+    colObs = []
+    colIndex = 0
+    for name in socketNames(ob, "colSocket"):
+        colOb = bpy.data.objects[name]
+        duplicate = colOb.copy()
+        duplicate.data = colOb.data.copy()
+        for mod in reversed(duplicate.modifiers[:]):
+            duplicate.modifiers.remove(mod)
+        duplicate["isColCopy"] = True
+        duplicate.hide = False
+        duplicate.parent = None
+        duplicate.matrix_world = colOb.matrix_world.copy()
+        scene.objects.link(duplicate)
+        dataApplyTransform(duplicate, rotation=True, scale=True)
+        scene.update()
+        duplicate.parent = streamOb
+        duplicate.matrix_parent_inverse = streamOb.matrix_world.inverted_safe()
+
+        for colTypeName in ("UBX", "USP", "UCX"):
+            if colTypeName + "_" in colOb.name:
+                duplicate.name = colTypeName + "_" + streamOb.name + "_" + str(colIndex).zfill(2)
+                colIndex += 1
+                break
+        colObs.append(duplicate)
+    return colObs
+
+def streamLODs(context, scene, streamOb, ob, orgLocation, lightmapMeshes, colObs):
+    """Same as LODPrepare() for streamOb, the stream copy of ob: links prepared copies of its LODs to scene. Returns the new objects"""
+    names = LODNames(ob)
+    if not names:
+        return []
+
+    elements = [streamMesh(context, scene, bpy.data.objects[name], lightmapMeshes) for name in names]
+    LODParent = LODSetup(scene, streamOb, ob.name, elements, orgLocation, colObs)
+    return [LODParent] + elements
+
+def streamUnsupported(objects):
+    """Names of the objects (or of their LOD objects) the non-destructive export can't prepare like the copy based one"""
+    names = []
+    for ob in objects:
+        for element in [ob] + [bpy.data.objects[name] for name in socketNames(ob, "lodSocket")]:
+            if not dataPrepareSupported(element):
+                names.append(element.name)
+    return names
+
+def streamRemove(scene, objects):
+    """Remove objects of the stream scene, and their meshes"""
+    for ob in objects:
+        data = ob.data
+        scene.objects.unlink(ob)
+        bpy.data.objects.remove(ob)
+        if data is not None and data.users == 0:
+            bpy.data.meshes.remove(data)
+
+def streamSave(operator, context, scene, filepath, axisForward, objects):
+    """Export objects of the stream scene with the modified FBX exporter, with the same options as Call_UE4_Export"""
+    fbxExporter = fbxExporterModule()
+    scene.update()
+    fbxExporter.save_single(operator, scene, filepath, context_objects=objects, **fbxExportOptions(context.scene, axisForward))
+
+class StreamExport_UE4(bpy.types.Operator):
+    """Prepare selected objects in memory and export them for UE4, without adding copies to the .blend file"""
+    bl_idname = "object.streamexportue4"
+    bl_label = "Save"
+
+    filepath = bpy.props.StringProperty(subtype="FILE_PATH")
+
+    def invoke(self, context, event):
+        if not len(bpy.context.selected_objects) > 0:
+            return {'FINISHED'}
+        else:
+            self.filepath = bpy.context.scene.path_settings.path
+            context.window_manager.fileselect_add(self)
+            return {'RUNNING_MODAL'}
+
+    def execute(self, context):
+        fbxExporter = fbxExporterModule()
+        if fbxExporter is None:
+            self.report({'ERROR'}, "Non-destructive export requires the modified FBX-Exporter script")
+            return {'CANCELLED'}
+
+        scene = bpy.context.scene
+        filename = self.filepath
+        file = os.path.basename(filename)
+
+        if scene.includeConnected:
+            includeConnected()
+        clearSelection()
+
+        """LOD objects are exported with their main object"""
+        objects = []
+        for ob in bpy.context.selected_objects:
+            isLODOb = False
+            try:
+                isLODOb = ob["isLODOb"]
+            except:
+                pass
+            if (ob.type == 'MESH' or ob.type == 'CURVE' or ob.type == 'FONT') and not isLODOb:
+                objects.append(ob)
+        if not objects:
+            return {'FINISHED'}
+
+        unsupported = streamUnsupported(objects)
+        if unsupported:
+            self.report({'WARNING'}, "Modifiers can't be applied with shape keys (%s), using the default export" % ", ".join(unsupported))
+            copyExport(self.filepath)
+            return {'FINISHED'}
+
+        activeOb = scene.objects.active
+        if activeOb not in objects:
+            activeOb = objects[0]
+        """The active object is prepared first, it gives the location objects are centred to"""
+        objects.remove(activeOb)
+        objects.insert(0, activeOb)
+
+        """Temp scene for the prepared objects, removed with all its content after export"""
+        streamScene = bpy.data.scenes.new(name="UE4EH_Temp")
+        streamScene.layers = [True] * 20
+        streamScene.unit_settings.system = scene.unit_settings.system
+        streamScene.unit_settings.system_rotation = scene.unit_settings.system_rotation
+        streamScene.unit_settings.scale_length = scene.unit_settings.scale_length
+        streamScene.frame_start = scene.frame_start
+        streamScene.frame_end = scene.frame_end
+        streamScene.frame_step = scene.frame_step
+        streamScene.frame_current = scene.frame_current
+        streamScene.render.fps = scene.render.fps
+        streamScene.render.fps_base = scene.render.fps_base
+
+        exportStart = time.perf_counter()
+        try:
+            if scene.singleOb: # Separate Files, variable name is misleading
+                filename = exportSeparateBase(filename)
+
+                #All files of this export share the same materials, let the exporter cache them for the whole batch
+                fbxExporter.batch_session_begin()
+
+                orgLocation = None
+                for ob in objects:
+                    lightmapMeshes = []
+                    streamOb = streamMesh(context, streamScene, ob, lightmapMeshes)
+                    if orgLocation is None:
+                        orgLocation = streamOb.location.copy()
+
+                    path = exportSeparatePath(filename, file, ob.name)
+
+                    colObs = streamCollisions(streamScene, streamOb, ob)
+                    lodPrepLocation = streamOb.location.copy()
+                    if scene.centerOb:
+                        if scene.centerRel:
+                            streamOb.location -= orgLocation
+                            lodPrepLocation = streamOb.location.copy()
+                        else:
+                            streamOb.location = Vector([0, 0, 0])
+
+                    streamClearParent(streamScene, streamOb)
+                    for colOb in colObs:
+                        streamClearParent(streamScene, colOb)
+                    streamObs = [streamOb] + colObs + streamLODs(context, streamScene, streamOb, ob, lodPrepLocation, lightmapMeshes, colObs)
+
+                    if lightmapMeshes:
+                        lightmapPackAll(lightmapMeshes)
+
+                    streamSave(self, context, streamScene, path, '-Y', streamObs)
+                    streamRemove(streamScene, streamObs)
+
+            else: # Single file
+                lightmapMeshes = []
+                streamObs = [streamMesh(context, streamScene, ob, lightmapMeshes) for ob in objects]
+                orgLocation = streamObs[0].location.copy()
+
+                filename = exportSinglePath(filename, file, activeOb.name)
+
+                colObs = []
+                for ob, element in zip(objects, streamObs):
+                    elementColObs = streamCollisions(streamScene, element, ob)
+                    colObs += elementColObs
+                    if ob == activeOb:
+                        activeColObs = elementColObs
+
+                if scene.centerOb:
+                    for element in streamObs:
+                        element.location -= orgLocation
+
+                streamObs += colObs
+                for element in streamObs:
+                    streamClearParent(streamScene, element)
+                streamObs += streamLODs(context, streamScene, streamObs[0], activeOb, orgLocation, lightmapMeshes, activeColObs)
+
+                if lightmapMeshes:
+                    lightmapPackAll(lightmapMeshes)
+
+                streamSave(self, context, streamScene, filename, 'Y', streamObs)
+        finally:
+            if scene.singleOb:
+                fbxExporter.batch_session_end()
+            streamRemove(streamScene, list(streamScene.objects))
+            bpy.data.scenes.remove(streamScene)
+
+        print("UE4EH: prepared and exported %d objects in %.3f sec. (non-destructive)" % (len(objects), time.perf_counter() - exportStart))
+        return {'FINISHED'}
+
 class PathSettings(PropertyGroup):
     path = StringProperty(
         name="",
@@ -1316,6 +2023,9 @@ class UE4PreparePanel(bpy.types.Panel):
              col = split.column(align=True)
              col.prop(context.scene, "lightGrid", text="Lightmap Resolution")
              col.prop(context.scene, "lightMargin", text="Island Margin")
+             split = layout.split(align=True)
+             col = split.column(align=True)
+             col.prop(context.scene, "lightmapEngine")
              
         split = layout.split(align=True)
         col = split.column(align=True)
@@ -1337,6 +2047,8 @@ class UE4PreparePanel(bpy.types.Panel):
         split = layout.split(align=True)
         col = split.column(align=True)
         col.prop(context.scene, "rotateMinusNinety", text="Apply +90° Z-Rotation")
+        col = split.column(align=True)
+        col.prop(context.scene, "prepareEngine")
         
         
         """Export options"""
@@ -1364,6 +2076,27 @@ class UE4PreparePanel(bpy.types.Panel):
         split = layout.split(align=True)
         col = split.column(align=True)
         col.prop(context.scene, "deleteCopy", text="Delete copies"),
+        split = layout.split(align=True)
+        col = split.column(align=True)
+        col.label(text="Requires the modified FBX-Exporter script:")
+        col.prop(context.scene, "streamExport", text="Non-destructive one step export")
+        split = layout.split(align=True)
+        col = split.column(align=True)
+        col.prop(context.scene, "leanExport", text="UE4 lean export")
+        split = layout.split(align=True)
+        col = split.column(align=True)
+        col.prop(context.scene, "animWorkers", text="Animation bake processes")
+        split = layout.split(align=True)
+        col = split.column(align=True)
+        col.prop(context.scene, "animPadPre", text="Action padding before")
+        col.prop(context.scene, "animPadPost", text="Action padding after")
+        split = layout.split(align=True)
+        col = split.column(align=True)
+        col.prop(context.scene, "animAdaptive", text="Adaptive animation baking")
+        split = layout.split(align=True)
+        col = split.column(align=True)
+        col.label(text="Baked actions cache")
+        col.prop(context.scene, "animCacheDir", text="")
         split = layout.split()
         col = split.column()
         col.label(text="Default Path")
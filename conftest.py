@@ -0,0 +1,37 @@
+"""
+Tests of UE4 Export Helper and of its modified FBX exporter.
+
+Both need Blender's Python API, so tests are run from Blender itself (with pytest installed in its Python):
+
+    blender --background --factory-startup --python-expr "import sys, pytest; sys.exit(pytest.main(['-q']))"
+
+They are all skipped when bpy is not available.
+"""
+
+import importlib.util
+import os
+
+import pytest
+
+ROOT = os.path.dirname(os.path.abspath(__file__))
+
+
+def load_module(name, path):
+    spec = importlib.util.spec_from_file_location(name, path)
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+
+@pytest.fixture(scope="session")
+def fbx_exporter():
+    pytest.importorskip("bpy")
+    # The exporter replaces a module of Blender's FBX addon, and imports its siblings from there.
+    pytest.importorskip("io_scene_fbx")
+    return load_module("io_scene_fbx.export_fbx_bin_ue4", os.path.join(ROOT, "export_fbx_bin.py"))
+
+
+@pytest.fixture(scope="session")
+def ue4eh():
+    pytest.importorskip("bpy")
+    return load_module("ue4exporthelper", os.path.join(ROOT, "0.4.2 release", "ue4exporthelper.py"))
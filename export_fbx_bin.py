@@ -23,12 +23,29 @@
 
 import array
 import datetime
+import hashlib
+import heapq
+import marshal
 import math
 import os
+import pickle
+import shutil
+import struct
+import subprocess
+import sys
+import tempfile
 import time
 
-from collections import OrderedDict
-from itertools import zip_longest, chain
+from collections import OrderedDict, namedtuple
+from concurrent.futures import ThreadPoolExecutor
+from itertools import zip_longest, chain, compress
+
+import numpy as np
+
+try:
+    import fcntl
+except ImportError:  # Not available on Windows.
+    fcntl = None
 
 if "bpy" in locals():
     import importlib
@@ -41,7 +58,7 @@ if "bpy" in locals():
 
 import bpy
 import bpy_extras
-from mathutils import Vector, Matrix
+from mathutils import Vector, Matrix, Quaternion, Euler
 
 from . import encode_bin, data_types, fbx_utils
 from .fbx_utils import (
@@ -96,6 +113,18 @@ from .fbx_utils import (
     FBXExportSettingsMedia, FBXExportSettings, FBXExportData,
 )
 
+# Settings specific to this flavor of the exporter, appended to stock FBXExportSettings ones
+# (so that fbx_utils does not need to be modified as well).
+FBXExportSettingsUE4 = namedtuple("FBXExportSettingsUE4", FBXExportSettings._fields + (
+    "batch_session",
+    "use_ue4_lean",  # Do not write mesh data UE4 re-computes or ignores on import.
+    "bake_anim_workers",  # Number of background Blender processes baking actions, 0 or 1 to bake them here.
+    "bake_anim_action_pad_pre",  # Frames baked before first keyframe of each action (all actions mode).
+    "bake_anim_action_pad_post",  # Frames baked after last keyframe of each action (all actions mode).
+    "bake_anim_cache_dir",  # Directory where baked actions are cached between exports, None to disable the cache.
+    "bake_anim_adaptive",  # Only sample frames needed to reach simplification tolerance, see fbx_animations_do().
+))
+
 # Units convertors!
 convert_sec_to_ktime = units_convertor("second", "ktime")
 convert_sec_to_ktime_iter = units_convertor_iter("second", "ktime")
@@ -106,6 +135,184 @@ convert_rad_to_deg = units_convertor("radian", "degree")
 convert_rad_to_deg_iter = units_convertor_iter("radian", "degree")
 
 
+# ##### Batch export sessions. #####
+
+# Some data only depends on Blender datablocks shared by all files of a batch export (e.g. the materials of a kit,
+# exported once per object in UE4EH "Separate Files" mode), it is cached here for the whole batch.
+# None when no batch export is running.
+_batch_session = None
+
+
+def _batch_session_new():
+    return {
+        "materials": {},  # {material: ((texture slot, image, FBX material properties), ...)}
+        "vid_paths": {},  # {(image, filepath, media settings...): (fname_abs, fname_rel, copy_set entries)}
+        "media_copier": FBXMediaCopier(),
+    }
+
+
+def _batch_session_update_handler(scene):
+    """
+    Invalidate cached data of datablocks tagged as updated.
+    """
+    if _batch_session is None:
+        return
+    if not (bpy.data.materials.is_updated or bpy.data.textures.is_updated or bpy.data.images.is_updated):
+        return
+    try:
+        mats_cache = _batch_session["materials"]
+        for mat, mat_texs in tuple(mats_cache.items()):
+            if mat.is_updated or any(tex.texture.is_updated or img.is_updated for tex, img, _props in mat_texs):
+                del mats_cache[mat]
+        vid_paths = _batch_session["vid_paths"]
+        for vid_key in tuple(vid_paths.keys()):
+            if vid_key[0].is_updated:
+                del vid_paths[vid_key]
+    except ReferenceError:
+        # Some cached datablock was removed, simpler to start again from scratch!
+        _batch_session["materials"].clear()
+        _batch_session["vid_paths"].clear()
+
+
+def batch_session_begin():
+    """
+    Start a batch export session: all following exports share the data cached in it, until batch_session_end().
+    """
+    global _batch_session
+    _batch_session = _batch_session_new()
+    if _batch_session_update_handler not in bpy.app.handlers.scene_update_post:
+        bpy.app.handlers.scene_update_post.append(_batch_session_update_handler)
+
+
+def batch_session_end():
+    """
+    End current batch export session, and free its cached data.
+    """
+    global _batch_session
+    if _batch_session is not None:
+        _batch_session["media_copier"].finish()
+    _batch_session = None
+    if _batch_session_update_handler in bpy.app.handlers.scene_update_post:
+        bpy.app.handlers.scene_update_post.remove(_batch_session_update_handler)
+
+
+def batch_session_get():
+    """
+    Return cached data of current batch session, or a throw-away one if no batch export is running.
+    """
+    return _batch_session if _batch_session is not None else _batch_session_new()
+
+
+# ##### Media files copy. #####
+
+# Linux ioctl to share the data of a file with another one (copy-on-write 'reflink', btrfs, xfs...).
+_FICLONE = 0x40049409
+
+
+def _media_file_hash(filepath):
+    h = hashlib.sha1()
+    with open(filepath, 'rb') as f:
+        for data in iter(lambda: f.read(1 << 20), b""):
+            h.update(data)
+    return h.digest()
+
+
+def _media_file_clone(src, dst):
+    """
+    Try to reflink dst to src, return True on success.
+    """
+    if fcntl is None:
+        return False
+    try:
+        with open(src, 'rb') as f_src, open(dst, 'wb') as f_dst:
+            fcntl.ioctl(f_dst.fileno(), _FICLONE, f_src.fileno())
+    except OSError:
+        try:
+            os.remove(dst)
+        except OSError:
+            pass
+        return False
+    shutil.copystat(src, dst)
+    return True
+
+
+class FBXMediaCopier:
+    """
+    Copy media files referenced by exported FBX files (path_mode 'COPY'), replacing
+    bpy_extras.io_utils.path_reference_copy().
+    Copies are done on a pool of threads, files already up-to-date at destination are skipped, and when possible
+    destination files are linked (reflink, or hardlink if allowed) to their source instead of being copied.
+    In batch exports, a single copier is shared by all exported files, so a given copy is only done once, and copies
+    keep going in the background while following files are exported.
+    """
+    __slots__ = ("_executor", "_copies", "_hashes")
+
+    def __init__(self):
+        self._executor = None
+        self._copies = OrderedDict()  # {(src, dst): future}
+        self._hashes = {}  # {(filepath, size, mtime): hash}, source files are hashed only once.
+
+    def copy(self, copy_set, use_hardlinks=False):
+        for src, dst in copy_set:
+            key = (os.path.normpath(src), os.path.normpath(dst))
+            if key in self._copies:
+                continue
+            if self._executor is None:
+                self._executor = ThreadPoolExecutor(max_workers=min(8, (os.cpu_count() or 1) * 2))
+            self._copies[key] = self._executor.submit(self._copy_file, *key, use_hardlinks=use_hardlinks)
+
+    def finish(self):
+        """
+        Wait for all pending copies to be done, and report failed ones.
+        """
+        for (src, dst), future in self._copies.items():
+            exc = future.exception()
+            if exc is not None:
+                print("WARNING: copying file {} to {} failed ({})".format(src, dst, exc))
+        self._copies.clear()
+        self._hashes.clear()
+        if self._executor is not None:
+            self._executor.shutdown()
+            self._executor = None
+
+    def _file_hash(self, filepath, st):
+        key = (filepath, st.st_size, st.st_mtime_ns)
+        file_hash = self._hashes.get(key)
+        if file_hash is None:
+            file_hash = self._hashes[key] = _media_file_hash(filepath)
+        return file_hash
+
+    def _copy_file(self, src, dst, use_hardlinks):
+        if not os.path.isfile(src):
+            print("WARNING: cannot copy missing file {}".format(src))
+            return
+        st_src = os.stat(src)
+        if os.path.exists(dst):
+            if os.path.samefile(src, dst):
+                return
+            st_dst = os.stat(dst)
+            if st_src.st_size == st_dst.st_size:
+                if st_src.st_mtime_ns == st_dst.st_mtime_ns:
+                    return
+                if self._file_hash(src, st_src) == self._file_hash(dst, st_dst):
+                    # Same content, sync mtime so that next check is a cheap one.
+                    os.utime(dst, ns=(st_src.st_atime_ns, st_src.st_mtime_ns))
+                    return
+            os.remove(dst)
+        else:
+            os.makedirs(os.path.dirname(dst), exist_ok=True)
+
+        if use_hardlinks:
+            try:
+                os.link(src, dst)
+                return
+            except OSError:  # Different filesystems, not supported...
+                pass
+        if _media_file_clone(src, dst):
+            return
+        shutil.copy2(src, dst)
+
+
 # ##### Templates #####
 # TODO: check all those "default" values, they should match Blender's default as much as possible, I guess?
 
@@ -527,6 +734,185 @@ def elem_connection(elem, c_type, uid_src, uid_dst, prop_dst=None):
         e.add_string(prop_dst)
 
 
+class FBXConnections:
+    """
+    Table of connections between FBX objects.
+    Animated scenes can generate hundreds of thousands of those, so instead of one tuple per connection,
+    we store them as parallel typed arrays (type, source uuid, destination uuid, destination property index).
+    """
+    __slots__ = ("types", "uids_src", "uids_dst", "props_dst", "props", "_props_idx")
+
+    c_types = (b"OO", b"OP")
+    _c_types_idx = {c_type: idx for idx, c_type in enumerate(c_types)}
+
+    def __init__(self):
+        self.types = array.array(data_types.ARRAY_INT32)
+        self.uids_src = array.array(data_types.ARRAY_INT64)
+        self.uids_dst = array.array(data_types.ARRAY_INT64)
+        self.props_dst = array.array(data_types.ARRAY_INT32)  # -1 means 'no property'.
+        self.props = []  # Property names are shared, most connections use only a few of them.
+        self._props_idx = {}
+
+    def __len__(self):
+        return len(self.types)
+
+    def add(self, c_type, uid_src, uid_dst, prop_dst=None):
+        prop_idx = -1
+        if prop_dst is not None:
+            prop_idx = self._props_idx.get(prop_dst)
+            if prop_idx is None:
+                prop_idx = self._props_idx[prop_dst] = len(self.props)
+                self.props.append(prop_dst)
+        self.types.append(self._c_types_idx[c_type])
+        self.uids_src.append(uid_src)
+        self.uids_dst.append(uid_dst)
+        self.props_dst.append(prop_idx)
+
+
+class FBXElemConnections(encode_bin.FBXElem):
+    """
+    FBX 'Connections' element, whose 'C' children are serialized straight from an FBXConnections table when
+    writing the FBX file, instead of being generated as one FBXElem each.
+    """
+    __slots__ = ("connections",)
+
+    # 'C' element header (end offset, number and length of properties, id), type, source and destination uuids.
+    _row = struct.Struct('<3IB1sBI2sBqBq')
+    _row_props_length = _row.size - 14
+    BLOCK_SIZE = 1 << 20
+
+    def __init__(self, id, connections):
+        super().__init__(id)
+        self.connections = connections
+
+    def _prop_data(self):
+        # Serialized destination properties, indexed like connections.props.
+        return [struct.pack('<BI', data_types.STRING, len(prop)) + prop for prop in self.connections.props]
+
+    def _calc_offsets(self, offset, is_last):
+        assert(self._end_offset == -1)
+        assert(self._props_length == -1)
+        assert(not self.elems)
+
+        offset += 12  # 3 uints
+        offset += 1 + len(self.id)  # len + idname
+        self._props_length = 0
+
+        conns = self.connections
+        if len(conns):
+            props_size = [len(data) for data in self._prop_data()]
+            offset += self._row.size * len(conns) + sum(props_size[idx] for idx in conns.props_dst if idx >= 0)
+            offset += encode_bin._BLOCK_SENTINEL_LENGTH
+        elif not is_last:
+            offset += encode_bin._BLOCK_SENTINEL_LENGTH
+
+        self._end_offset = offset
+        return offset
+
+    def _write(self, write, tell, is_last):
+        assert(self._end_offset != -1)
+        assert(self._props_length != -1)
+
+        write(struct.pack('<3I', self._end_offset, 0, 0))
+
+        write(bytes((len(self.id),)))
+        write(self.id)
+
+        conns = self.connections
+        if len(conns):
+            pack = self._row.pack
+            row_size = self._row.size
+            row_props_length = self._row_props_length
+            c_types = conns.c_types
+            props = self._prop_data()
+            offset = tell()
+            block = bytearray()
+            for c_type, uid_src, uid_dst, prop_idx in zip(conns.types, conns.uids_src, conns.uids_dst,
+                                                          conns.props_dst):
+                if prop_idx < 0:
+                    offset += row_size
+                    block += pack(offset, 3, row_props_length, 1, b"C", data_types.STRING, 2, c_types[c_type],
+                                  data_types.INT64, uid_src, data_types.INT64, uid_dst)
+                else:
+                    prop = props[prop_idx]
+                    offset += row_size + len(prop)
+                    block += pack(offset, 4, row_props_length + len(prop), 1, b"C", data_types.STRING, 2,
+                                  c_types[c_type], data_types.INT64, uid_src, data_types.INT64, uid_dst)
+                    block += prop
+                if len(block) >= self.BLOCK_SIZE:
+                    write(bytes(block))
+                    block.clear()
+            write(bytes(block))
+            write(encode_bin._BLOCK_SENTINEL_DATA)
+        elif not is_last:
+            write(encode_bin._BLOCK_SENTINEL_DATA)
+
+        if tell() != self._end_offset:
+            raise IOError("scope length not reached, something is wrong (%d)" % (self._end_offset - tell()))
+
+
+# ##### Streamed file content. #####
+
+class FBXElemFileBytes(encode_bin.FBXElem):
+    """
+    FBX element holding a single bytes property, whose data is read from a file only when writing the FBX file,
+    block by block, instead of being kept in memory for the whole export (embedded textures can be huge).
+    Only the size of the file is computed when generating the element tree.
+    """
+    __slots__ = ("filepath", "size")
+
+    BLOCK_SIZE = 1 << 20
+
+    def __init__(self, id, filepath):
+        super().__init__(id)
+        self.filepath = filepath
+        self.size = os.path.getsize(filepath)
+        # Only the length header of the bytes property is stored, the data itself is streamed in _write.
+        self.props_type.append(data_types.BYTES)
+        self.props.append(struct.pack('<I', self.size))
+
+    def _calc_offsets(self, offset, is_last):
+        offset = super()._calc_offsets(offset, is_last)
+        self._props_length += self.size
+        self._end_offset += self.size
+        return self._end_offset
+
+    def _write(self, write, tell, is_last):
+        assert(self._end_offset != -1)
+        assert(self._props_length != -1)
+        assert(not self.elems)
+
+        write(struct.pack('<3I', self._end_offset, len(self.props), self._props_length))
+
+        write(bytes((len(self.id),)))
+        write(self.id)
+
+        write(bytes((self.props_type[0],)))
+        write(self.props[0])
+
+        size = self.size
+        with open(self.filepath, 'rb') as f:
+            while size:
+                data = f.read(min(size, self.BLOCK_SIZE))
+                if not data:
+                    break
+                write(data)
+                size -= len(data)
+        if size:
+            # File was modified since we generated the element tree, offsets are wrong now, nothing we can do.
+            raise IOError("embedded file {} is shorter than expected ({} bytes missing)".format(self.filepath, size))
+
+        if tell() != self._end_offset:
+            raise IOError("scope length not reached, something is wrong (%d)" % (self._end_offset - tell()))
+
+
+def elem_data_single_bytes_file(elem, name, filepath):
+    sub_elem = FBXElemFileBytes(name, filepath)
+    if elem is not None:
+        elem.elems.append(sub_elem)
+    return sub_elem
+
+
 # ##### FBX objects generators. #####
 
 def fbx_data_element_custom_properties(props, bid):
@@ -707,9 +1093,12 @@ def fbx_data_camera_elements(root, cam_obj, scene_data):
     elem_data_single_float64(cam, b"CameraOrthoZoom", 1.0)
 
 
-def fbx_data_bindpose_element(root, me_obj, me, scene_data, arm_obj=None, mat_world_arm=None, bones=[]):
+def fbx_data_bindpose_element(root, me_obj, me, scene_data, arm_obj=None, mat_world_arm=None, bones=[],
+                              mat_world_bones=None, mat_world_bones_arr=None, mat_world_arm_arr=None):
     """
     Helper, since bindpose are used by both meshes shape keys and armature bones...
+    mat_world_bones (and mat_world_bones_arr, mat_world_arm_arr, their flattened arrays) may be given as pre-computed
+    mappings {bone: rest world matrix}, when writing the bind poses of several meshes deformed by the same armature.
     """
     if arm_obj is None:
         arm_obj = me_obj
@@ -733,15 +1122,19 @@ def fbx_data_bindpose_element(root, me_obj, me, scene_data, arm_obj=None, mat_wo
     if arm_obj != me_obj:
         fbx_posenode = elem_empty(fbx_pose, b"PoseNode")
         elem_data_single_int64(fbx_posenode, b"Node", arm_obj.fbx_uuid)
-        elem_data_single_float64_array(fbx_posenode, b"Matrix", matrix4_to_array(mat_world_arm))
+        elem_data_single_float64_array(fbx_posenode, b"Matrix",
+                                       mat_world_arm_arr if mat_world_arm_arr is not None else
+                                       matrix4_to_array(mat_world_arm))
     # And all bones of armature!
-    mat_world_bones = {}
+    if mat_world_bones is None:
+        mat_world_bones = {bo_obj: bo_obj.fbx_object_matrix(scene_data, rest=True, global_space=True)
+                           for bo_obj in bones}
+    if mat_world_bones_arr is None:
+        mat_world_bones_arr = {bo_obj: matrix4_to_array(mat_world_bones[bo_obj]) for bo_obj in bones}
     for bo_obj in bones:
-        bomat = bo_obj.fbx_object_matrix(scene_data, rest=True, global_space=True)
-        mat_world_bones[bo_obj] = bomat
         fbx_posenode = elem_empty(fbx_pose, b"PoseNode")
         elem_data_single_int64(fbx_posenode, b"Node", bo_obj.fbx_uuid)
-        elem_data_single_float64_array(fbx_posenode, b"Matrix", matrix4_to_array(bomat))
+        elem_data_single_float64_array(fbx_posenode, b"Matrix", mat_world_bones_arr[bo_obj])
 
     return mat_world_obj, mat_world_bones
 
@@ -833,6 +1226,16 @@ def fbx_data_mesh_elements(root, me_obj, scene_data, done_meshes):
     smooth_type = scene_data.settings.mesh_smooth_type
     write_normals = True  # smooth_type in {'OFF'}
 
+    # UE4 rebuilds edges and binormals on import. Smoothing stays as set by mesh_smooth_type.
+    is_lean = scene_data.settings.use_ue4_lean
+    # Only vertices and faces are needed for collision meshes.
+    is_collision = fbx_is_collision_object(me_obj)
+    write_edges = not (is_lean or is_collision)
+    if is_collision:
+        smooth_type = 'OFF'
+    if is_collision:
+        write_normals = False
+
     do_bake_space_transform = me_obj.use_bake_space_transform(scene_data)
 
     # Vertices are in object space, but we are post-multiplying all transforms with the inverse of the
@@ -853,7 +1256,7 @@ def fbx_data_mesh_elements(root, me_obj, scene_data, done_meshes):
     props = elem_properties(geom)
 
     # Custom properties.
-    if scene_data.settings.use_custom_props:
+    if scene_data.settings.use_custom_props and not is_collision:
         fbx_data_element_custom_properties(props, me)
 
     elem_data_single_int32(geom, b"GeometryVersion", FBX_GEOMETRY_VERSION)
@@ -877,7 +1280,7 @@ def fbx_data_mesh_elements(root, me_obj, scene_data, done_meshes):
     me.polygons.foreach_get("loop_start", t_ls)
 
     # Add "fake" faces for loose edges.
-    if scene_data.settings.use_mesh_edges:
+    if scene_data.settings.use_mesh_edges and not is_collision:
         t_le = tuple(e.vertices for e in me.edges if e.is_loose)
         t_pvi.extend(chain(*t_le))
         t_ls.extend(range(loop_nbr, loop_nbr + len(t_le), 2))
@@ -894,7 +1297,7 @@ def fbx_data_mesh_elements(root, me_obj, scene_data, done_meshes):
     t_eli = array.array(data_types.ARRAY_INT32)
     edges_map = {}
     edges_nbr = 0
-    if t_ls and t_pvi:
+    if t_ls and t_pvi and write_edges:
         t_ls = set(t_ls)
         todo_edges = [None] * len(me.edges) * 2
         # Sigh, cannot access edge.key through foreach_get... :/
@@ -927,7 +1330,8 @@ def fbx_data_mesh_elements(root, me_obj, scene_data, done_meshes):
 
     # And finally we can write data!
     elem_data_single_int32_array(geom, b"PolygonVertexIndex", t_pvi)
-    elem_data_single_int32_array(geom, b"Edges", t_eli)
+    if write_edges:
+        elem_data_single_int32_array(geom, b"Edges", t_eli)
     del t_pvi
     del t_ls
     del t_eli
@@ -1030,16 +1434,17 @@ def fbx_data_mesh_elements(root, me_obj, scene_data, done_meshes):
                     me.calc_tangents(name)
                     # Loop bitangents (aka binormals).
                     # NOTE: this is not supported by importer currently.
-                    me.loops.foreach_get("bitangent", t_ln)
-                    lay_nor = elem_data_single_int32(geom, b"LayerElementBinormal", idx)
-                    elem_data_single_int32(lay_nor, b"Version", FBX_GEOMETRY_BINORMAL_VERSION)
-                    elem_data_single_string_unicode(lay_nor, b"Name", name)
-                    elem_data_single_string(lay_nor, b"MappingInformationType", b"ByPolygonVertex")
-                    elem_data_single_string(lay_nor, b"ReferenceInformationType", b"Direct")
-                    elem_data_single_float64_array(lay_nor, b"Binormals",
-                                                   chain(*nors_transformed_gen(t_ln, geom_mat_no)))
-                    # Binormal weights, no idea what it is.
-                    # elem_data_single_float64_array(lay_nor, b"BinormalsW", t_lnw)
+                    if not is_lean:
+                        me.loops.foreach_get("bitangent", t_ln)
+                        lay_nor = elem_data_single_int32(geom, b"LayerElementBinormal", idx)
+                        elem_data_single_int32(lay_nor, b"Version", FBX_GEOMETRY_BINORMAL_VERSION)
+                        elem_data_single_string_unicode(lay_nor, b"Name", name)
+                        elem_data_single_string(lay_nor, b"MappingInformationType", b"ByPolygonVertex")
+                        elem_data_single_string(lay_nor, b"ReferenceInformationType", b"Direct")
+                        elem_data_single_float64_array(lay_nor, b"Binormals",
+                                                       chain(*nors_transformed_gen(t_ln, geom_mat_no)))
+                        # Binormal weights, no idea what it is.
+                        # elem_data_single_float64_array(lay_nor, b"BinormalsW", t_lnw)
 
                     # Loop tangents.
                     # NOTE: this is not supported by importer currently.
@@ -1061,7 +1466,7 @@ def fbx_data_mesh_elements(root, me_obj, scene_data, done_meshes):
         me.free_normals_split()
 
     # Write VertexColor Layers.
-    vcolnumber = len(me.vertex_colors)
+    vcolnumber = 0 if is_collision else len(me.vertex_colors)
     if vcolnumber:
         def _coltuples_gen(raw_cols):
             return zip(*(iter(raw_cols),) * 3 + (_infinite_gen(1.0),))  # We need a fake alpha...
@@ -1087,7 +1492,7 @@ def fbx_data_mesh_elements(root, me_obj, scene_data, done_meshes):
     # Write UV layers.
     # Note: LayerElementTexture is deprecated since FBX 2011 - luckily!
     #       Textures are now only related to materials, in FBX!
-    uvnumber = len(me.uv_layers)
+    uvnumber = 0 if is_collision else len(me.uv_layers)
     if uvnumber:
         def _uvtuples_gen(raw_uvs):
             return zip(*(iter(raw_uvs),) * 2)
@@ -1111,7 +1516,7 @@ def fbx_data_mesh_elements(root, me_obj, scene_data, done_meshes):
         del _uvtuples_gen
 
     # Face's materials.
-    me_fbxmats_idx = scene_data.mesh_mat_indices.get(me)
+    me_fbxmats_idx = None if is_collision else scene_data.mesh_mat_indices.get(me)
     if me_fbxmats_idx is not None:
         me_blmats = me.materials
         if me_fbxmats_idx and me_blmats:
@@ -1153,9 +1558,10 @@ def fbx_data_mesh_elements(root, me_obj, scene_data, done_meshes):
         elem_data_single_string(lay_nor, b"Type", b"LayerElementNormal")
         elem_data_single_int32(lay_nor, b"TypedIndex", 0)
     if tspacenumber:
-        lay_binor = elem_empty(layer, b"LayerElement")
-        elem_data_single_string(lay_binor, b"Type", b"LayerElementBinormal")
-        elem_data_single_int32(lay_binor, b"TypedIndex", 0)
+        if not is_lean:
+            lay_binor = elem_empty(layer, b"LayerElement")
+            elem_data_single_string(lay_binor, b"Type", b"LayerElementBinormal")
+            elem_data_single_int32(lay_binor, b"TypedIndex", 0)
         lay_tan = elem_empty(layer, b"LayerElement")
         elem_data_single_string(lay_tan, b"Type", b"LayerElementTangent")
         elem_data_single_int32(lay_tan, b"TypedIndex", 0)
@@ -1190,15 +1596,17 @@ def fbx_data_mesh_elements(root, me_obj, scene_data, done_meshes):
             elem_data_single_string(lay_uv, b"Type", b"LayerElementUV")
             elem_data_single_int32(lay_uv, b"TypedIndex", uvidx)
         if tspaceidx:
-            lay_binor = elem_empty(layer, b"LayerElement")
-            elem_data_single_string(lay_binor, b"Type", b"LayerElementBinormal")
-            elem_data_single_int32(lay_binor, b"TypedIndex", tspaceidx)
+            if not is_lean:
+                lay_binor = elem_empty(layer, b"LayerElement")
+                elem_data_single_string(lay_binor, b"Type", b"LayerElementBinormal")
+                elem_data_single_int32(lay_binor, b"TypedIndex", tspaceidx)
             lay_tan = elem_empty(layer, b"LayerElement")
             elem_data_single_string(lay_tan, b"Type", b"LayerElementTangent")
             elem_data_single_int32(lay_tan, b"TypedIndex", tspaceidx)
 
     # Shape keys...
-    fbx_data_mesh_shapes_elements(root, me_obj, me, scene_data, tmpl, props)
+    if not is_collision:
+        fbx_data_mesh_shapes_elements(root, me_obj, me, scene_data, tmpl, props)
 
     elem_props_template_finalize(tmpl, props)
     done_meshes.add(me_key)
@@ -1276,9 +1684,18 @@ def fbx_data_material_elements(root, mat, scene_data):
 
 def _gen_vid_path(img, scene_data):
     msetts = scene_data.settings.media_settings
-    fname_rel = bpy_extras.io_utils.path_reference(img.filepath, msetts.base_src, msetts.base_dst, msetts.path_mode,
-                                                   msetts.subdir, msetts.copy_set, img.library)
-    fname_abs = os.path.normpath(os.path.abspath(os.path.join(msetts.base_dst, fname_rel)))
+    vid_paths = scene_data.settings.batch_session["vid_paths"]
+    vid_key = (img, img.filepath, img.library, msetts.path_mode, msetts.base_src, msetts.base_dst, msetts.subdir)
+    vid_path = vid_paths.get(vid_key)
+    if vid_path is None:
+        copy_set = set()
+        fname_rel = bpy_extras.io_utils.path_reference(img.filepath, msetts.base_src, msetts.base_dst,
+                                                       msetts.path_mode, msetts.subdir, copy_set, img.library)
+        fname_abs = os.path.normpath(os.path.abspath(os.path.join(msetts.base_dst, fname_rel)))
+        vid_path = vid_paths[vid_key] = (fname_abs, fname_rel, copy_set)
+    fname_abs, fname_rel, copy_set = vid_path
+    # Even when cached, files to copy have to be copied for each export!
+    msetts.copy_set.update(copy_set)
     return fname_abs, fname_rel
 
 
@@ -1353,6 +1770,14 @@ def fbx_data_texture_file_elements(root, tex, scene_data):
         fbx_data_element_custom_properties(props, tex.texture)
 
 
+def _embedded_key(filepath):
+    """
+    Key identifying a file on disk, so that different images using the same file (through different but
+    equivalent paths, or packed and unpacked) get it embedded only once.
+    """
+    return os.path.normcase(os.path.normpath(os.path.abspath(filepath)))
+
+
 def fbx_data_video_elements(root, vid, scene_data):
     """
     Write the actual image data block.
@@ -1381,20 +1806,22 @@ def fbx_data_video_elements(root, vid, scene_data):
     if scene_data.settings.media_settings.embed_textures:
         if vid.packed_file is not None:
             # We only ever embed a given file once!
-            if fname_abs not in msetts.embedded_set:
+            embed_key = _embedded_key(fname_abs)
+            if embed_key not in msetts.embedded_set:
                 elem_data_single_bytes(fbx_vid, b"Content", vid.packed_file.data)
-                msetts.embedded_set.add(fname_abs)
+                msetts.embedded_set.add(embed_key)
         else:
-            filepath = bpy.path.abspath(vid.filepath)
+            filepath = bpy.path.abspath(vid.filepath, library=vid.library)
             # We only ever embed a given file once!
-            if filepath not in msetts.embedded_set:
+            embed_key = _embedded_key(filepath)
+            if embed_key not in msetts.embedded_set:
+                # Content is only read from disk when writing the FBX file, see FBXElemFileBytes.
                 try:
-                    with open(filepath, 'br') as f:
-                        elem_data_single_bytes(fbx_vid, b"Content", f.read())
+                    elem_data_single_bytes_file(fbx_vid, b"Content", filepath)
                 except Exception as e:
                     print("WARNING: embedding file {} failed ({})".format(filepath, e))
                     elem_data_single_bytes(fbx_vid, b"Content", b"")
-                msetts.embedded_set.add(filepath)
+                msetts.embedded_set.add(embed_key)
     # Looks like we'd rather not write any 'Content' element in this case (see T44442).
     # Sounds suspect, but let's try it!
     #~ else:
@@ -1442,10 +1869,20 @@ def fbx_data_armature_elements(root, arm_obj, scene_data):
     # Note: we might also use Deformers for our "parent to vertex" stuff???
     deformer = scene_data.data_deformers_skin.get(arm_obj, None)
     if deformer is not None:
+        # Rest matrices of bones (and their inverses) are the same for all meshes deformed by this armature,
+        # no need to compute them again for each BindPose and Cluster!
+        mat_world_bones = {bo_obj: bo_obj.fbx_object_matrix(scene_data, rest=True, global_space=True)
+                           for bo_obj in bones}
+        mat_world_bones_inv = {bo_obj: bomat.inverted_safe() for bo_obj, bomat in mat_world_bones.items()}
+        mat_world_bones_arr = {bo_obj: matrix4_to_array(bomat) for bo_obj, bomat in mat_world_bones.items()}
+        mat_world_arm_arr = matrix4_to_array(mat_world_arm)
+
         for me, (skin_key, ob_obj, clusters) in deformer.items():
             # BindPose.
-            mat_world_obj, mat_world_bones = fbx_data_bindpose_element(root, ob_obj, me, scene_data,
-                                                                       arm_obj, mat_world_arm, bones)
+            mat_world_obj, _mat_world_bones = fbx_data_bindpose_element(root, ob_obj, me, scene_data,
+                                                                        arm_obj, mat_world_arm, bones,
+                                                                        mat_world_bones, mat_world_bones_arr,
+                                                                        mat_world_arm_arr)
 
             # Deformer.
             fbx_skin = elem_data_single_int64(root, b"Deformer", get_fbx_uuid_from_key(skin_key))
@@ -1495,9 +1932,9 @@ def fbx_data_armature_elements(root, arm_obj, scene_data):
                 #          http://area.autodesk.com/forum/autodesk-fbx/fbx-sdk/why-the-values-return-
                 #                 by-fbxcluster-gettransformmatrix-x-not-same-with-the-value-in-ascii-fbx-file/
                 elem_data_single_float64_array(fbx_clstr, b"Transform",
-                                               matrix4_to_array(mat_world_bones[bo_obj].inverted_safe() * mat_world_obj))
-                elem_data_single_float64_array(fbx_clstr, b"TransformLink", matrix4_to_array(mat_world_bones[bo_obj]))
-                elem_data_single_float64_array(fbx_clstr, b"TransformAssociateModel", matrix4_to_array(mat_world_arm))
+                                               matrix4_to_array(mat_world_bones_inv[bo_obj] * mat_world_obj))
+                elem_data_single_float64_array(fbx_clstr, b"TransformLink", mat_world_bones_arr[bo_obj])
+                elem_data_single_float64_array(fbx_clstr, b"TransformAssociateModel", mat_world_arm_arr)
 
 
 def fbx_data_leaf_bone_elements(root, scene_data):
@@ -1637,8 +2074,9 @@ def fbx_data_animation_elements(root, scene_data):
 
     fps = scene.render.fps / scene.render.fps_base
 
-    def keys_to_ktimes(keys):
-        return (int(v) for v in convert_sec_to_ktime_iter((f / fps for f, _v in keys)))
+    def frames_to_ktimes(frames):
+        # Same as convert_sec_to_ktime(), on the whole array at once.
+        return array.array(data_types.ARRAY_INT64, (int(f / fps * FBX_KTIME) for f in frames))
 
     # Animation stacks.
     for astack_key, alayers, alayer_key, name, f_start, f_end in animations:
@@ -1678,18 +2116,18 @@ def fbx_data_animation_elements(root, scene_data):
                 acn_tmpl = elem_props_template_init(scene_data.templates, b"AnimationCurveNode")
                 acn_props = elem_properties(acurvenode)
 
-                for fbx_item, (acurve_key, def_value, keys, _acurve_valid) in acurves.items():
+                for fbx_item, (acurve_key, def_value, (frames, values), _acurve_valid) in acurves.items():
                     elem_props_template_set(acn_tmpl, acn_props, "p_number", fbx_item.encode(),
                                             def_value, animatable=True)
 
                     # Only create Animation curve if needed!
-                    if keys:
+                    if frames:
                         acurve = elem_data_single_int64(root, b"AnimationCurve", get_fbx_uuid_from_key(acurve_key))
                         acurve.add_string(fbx_name_class(b"", b"AnimCurve"))
                         acurve.add_string(b"")
 
                         # key attributes...
-                        nbr_keys = len(keys)
+                        nbr_keys = len(frames)
                         # flags...
                         keyattr_flags = (
                             1 << 2 |   # interpolation mode, 1 = constant, 2 = linear, 3 = cubic.
@@ -1704,8 +2142,9 @@ def fbx_data_animation_elements(root, scene_data):
                         # And now, the *real* data!
                         elem_data_single_float64(acurve, b"Default", def_value)
                         elem_data_single_int32(acurve, b"KeyVer", FBX_ANIM_KEY_VERSION)
-                        elem_data_single_int64_array(acurve, b"KeyTime", keys_to_ktimes(keys))
-                        elem_data_single_float32_array(acurve, b"KeyValueFloat", (v for _f, v in keys))
+                        elem_data_single_int64_array(acurve, b"KeyTime", frames_to_ktimes(frames))
+                        elem_data_single_float32_array(acurve, b"KeyValueFloat",
+                                                       array.array(data_types.ARRAY_FLOAT32, values))
                         elem_data_single_int32_array(acurve, b"KeyAttrFlags", keyattr_flags)
                         elem_data_single_float32_array(acurve, b"KeyAttrDataFloat", keyattr_datafloat)
                         elem_data_single_int32_array(acurve, b"KeyAttrRefCount", (nbr_keys,))
@@ -1757,13 +2196,79 @@ def fbx_mat_properties_from_texture(tex):
     return tex_fbx_props
 
 
+# Prefixes of UE4 collision meshes names (convex hull, box, sphere).
+UE4_COLLISION_PREFIXES = ("UCX_", "UBX_", "USP_")
+
+
+def fbx_is_collision_object(ob_obj):
+    """
+    Whether given mesh ObjectWrapper is an UE4 collision mesh (tagged as such by UE4EH, or named after UE4
+    conventions), from which UE4 only imports vertices and faces.
+    """
+    if ob_obj.type != 'MESH':
+        return False
+    ob = ob_obj.bdata
+    return bool(ob.get("isColOb") or ob.get("isColCopy") or ob.name.startswith(UE4_COLLISION_PREFIXES))
+
+
+def get_blender_collision_mesh_key(me_key):
+    """Return the key of the (stripped) geometry written for collision objects using the mesh of given key."""
+    return "|".join((me_key, "UE4Collision"))
+
+
+def fbx_armature_deformed_objects(objects):
+    """
+    Index all mesh objects by the Blender armature objects that deform them through an Armature modifier
+    (using vertex groups), in a single pass over objects.
+    Returns a mapping {Blender armature object: [mesh ObjectWrapper, ...]}, meshes keeping their order in objects.
+    """
+    arm_deformed = {}
+    for ob_obj in objects:
+        if not (ob_obj.is_object and ob_obj.type == 'MESH'):
+            continue
+        # We only support vertex groups binding method, not bone envelopes one!
+        arm_obs = {mod.object for mod in ob_obj.bdata.modifiers
+                   if mod.type in {'ARMATURE'} and mod.object and mod.use_vertex_groups}
+        for arm_ob in arm_obs:
+            arm_deformed.setdefault(arm_ob, []).append(ob_obj)
+    return arm_deformed
+
+
+def fbx_mat_textures(mat):
+    """
+    Returns a tuple of (texture slot, image, FBX material properties) of all textures of given material
+    that can be exported to FBX.
+    """
+    mat_texs = []
+    for tex, use_tex in zip(mat.texture_slots, mat.use_textures):
+        if tex is None or tex.texture is None or not use_tex:
+            continue
+        # For now, only consider image textures.
+        # Note FBX does has support for procedural, but this is not portable at all (opaque blob),
+        # so not useful for us.
+        # TODO I think ENVIRONMENT_MAP should be usable in FBX as well, but for now let it aside.
+        # if tex.texture.type not in {'IMAGE', 'ENVIRONMENT_MAP'}:
+        if tex.texture.type not in {'IMAGE'}:
+            continue
+        img = tex.texture.image
+        if img is None:
+            continue
+        # Find out whether we can actually use this texture for this material, in FBX context.
+        tex_fbx_props = fbx_mat_properties_from_texture(tex)
+        if not tex_fbx_props:
+            continue
+        mat_texs.append((tex, img, tex_fbx_props))
+    return tuple(mat_texs)
+
+
 def fbx_skeleton_from_armature(scene, settings, arm_obj, objects, data_meshes,
-                               data_bones, data_deformers_skin, data_empties, arm_parents):
+                               data_bones, data_deformers_skin, data_empties, arm_parents, arm_deformed):
     """
     Create skeleton from armature/bones (NodeAttribute/LimbNode and Model/LimbNode), and for each deformed mesh,
     create Pose/BindPose(with sub PoseNode) and Deformer/Skin(with Deformer/SubDeformer/Cluster).
     Also supports "parent to bone" (simple parent to Model/LimbNode).
     arm_parents is a set of tuples (armature, object) for all successful armature bindings.
+    arm_deformed is the mapping generated by fbx_armature_deformed_objects().
     """
     # We need some data for our armature 'object' too!!!
     data_empties[arm_obj] = get_blender_empty_key(arm_obj.bdata)
@@ -1790,21 +2295,14 @@ def fbx_skeleton_from_armature(scene, settings, arm_obj, objects, data_meshes,
 
     data_bones.update((bo, get_blender_bone_key(arm_obj.bdata, bo.bdata)) for bo in bones)
 
-    for ob_obj in objects:
-        if not ob_obj.is_deformed_by_armature(arm_obj):
-            continue
-
-        # Always handled by an Armature modifier...
-        found = False
-        for mod in ob_obj.bdata.modifiers:
-            if mod.type not in {'ARMATURE'} or not mod.object:
-                continue
-            # We only support vertex groups binding method, not bone envelopes one!
-            if mod.object in {arm_obj.bdata, arm_obj.bdata.proxy} and mod.use_vertex_groups:
-                found = True
-                break
+    # Always handled by an Armature modifier...
+    deformed_obs = arm_deformed.get(arm_obj.bdata, [])
+    if arm_obj.bdata.proxy is not None and arm_obj.bdata.proxy in arm_deformed:
+        deformed_obs = set(deformed_obs) | set(arm_deformed[arm_obj.bdata.proxy])
+        deformed_obs = [ob_obj for ob_obj in objects if ob_obj in deformed_obs]
 
-        if not found:
+    for ob_obj in deformed_obs:
+        if not ob_obj.is_deformed_by_armature(arm_obj):
             continue
 
         # Now we have a mesh using this armature.
@@ -1855,9 +2353,746 @@ def fbx_generate_leaf_bones(settings, data_bones):
     return leaf_bones
 
 
-def fbx_animations_do(scene_data, ref_id, f_start, f_end, start_zero, objects=None, force_keep=False):
+class AnimationCurveNodeWrapperUE4(AnimationCurveNodeWrapper):
+    """
+    Same as stock AnimationCurveNodeWrapper, but:
+        * Baked keys are stored as typed arrays, one for frames and one per channel for values and write flags,
+          preallocated from the number of baked frames when known, instead of one tuple per key.
+        * Different simplification of baked curves: a sample is dropped when linear interpolation between kept
+          samples stays within tolerance of it (FBX curves are written with linear interpolation), using the same
+          tolerance as stock simplification. All channels of the group are simplified at once, as numpy array
+          operations.
+    Final keyframes of each curve are a (frames, values) pair of arrays.
+    """
+
+    def __init__(self, elem_key, kind, force_keying, force_startend_keying, default_values=..., nbr_keys=0):
+        super().__init__(elem_key, kind, force_keying, force_startend_keying, default_values)
+        nbr_channels = len(self.fbx_props[0])
+        self._nbr_keys = 0
+        self._frames = array.array(data_types.ARRAY_FLOAT64, (0.0,)) * nbr_keys
+        self._values = [array.array(data_types.ARRAY_FLOAT64, (0.0,)) * nbr_keys for _i in range(nbr_channels)]
+        # Write everything by default.
+        self._writes = [bytearray(b"\x01") * nbr_keys for _i in range(nbr_channels)]
+
+    def __bool__(self):
+        # We are 'True' if we do have some validated keyframes...
+        self._trim()
+        return any(1 in writes for writes in self._writes)
+
+    def _trim(self):
+        # Remove unused preallocated keys.
+        nbr_keys = self._nbr_keys
+        if len(self._frames) > nbr_keys:
+            del self._frames[nbr_keys:]
+            for values, writes in zip(self._values, self._writes):
+                del values[nbr_keys:]
+                del writes[nbr_keys:]
+
+    def add_keyframe(self, frame, values):
+        """
+        Add a new keyframe to all curves of the group.
+        """
+        assert(len(values) == len(self._values))
+        idx = self._nbr_keys
+        if idx < len(self._frames):
+            self._frames[idx] = frame
+            for vals, val in zip(self._values, values):
+                vals[idx] = val
+        else:
+            self._frames.append(frame)
+            for vals, writes, val in zip(self._values, self._writes, values):
+                vals.append(val)
+                writes.append(1)
+        self._nbr_keys += 1
+
+    def set_keyframes(self, frames, channels_values):
+        """
+        Set all keyframes of the group at once, from frames and one sequence of values per curve.
+        """
+        assert(len(channels_values) == len(self._values))
+        self._frames = array.array(data_types.ARRAY_FLOAT64, frames)
+        self._values = [array.array(data_types.ARRAY_FLOAT64, values) for values in channels_values]
+        self._writes = [bytearray(b"\x01") * len(self._frames) for _values in self._values]
+        self._nbr_keys = len(self._frames)
+
+    @staticmethod
+    def simplify_exceeds(values, refs, min_reldiff_fac, min_absdiff_fac):
+        """
+        Return by how much values differ from reference ones beyond tolerance (positive when they are not similar).
+        Same relative + absolute-near-zero difference as stock simplification (see simplify_tolerances()).
+        """
+        return np.abs(values - refs) - min_reldiff_fac * np.maximum(np.abs(values) + np.abs(refs), min_absdiff_fac)
+
+    @staticmethod
+    def simplify_channels(frames, channels, min_reldiff_fac, min_absdiff_fac):
+        """
+        Return an (nbr_channels, nbr_keys) boolean array of 'keep' flags for given samples of all channels at once.
+        A channel whose values all stay similar to its first one is not keyed at all. Otherwise, starting from all
+        samples, each pass tries to drop every other kept sample (but first and last ones), and only drops those for
+        which all samples in-between their kept neighbors remain similar to their linear interpolation. Passes
+        alternate between odd and even kept samples, until neither can drop anything.
+        """
+        exceeds = AnimationCurveNodeWrapperUE4.simplify_exceeds
+        values = np.array(channels, dtype=np.float64).reshape(len(channels), len(frames))
+        keep = np.zeros(values.shape, dtype=bool)
+        keyed = (exceeds(values, values[:, :1], min_reldiff_fac, min_absdiff_fac) > 0.0).any(axis=1)
+        if not keyed.any():
+            return keep
+
+        # Work on all samples of keyed channels as a single flat array, where segments never cross channels
+        # since first and last sample of each channel are always kept.
+        nbr_channels = int(keyed.sum())
+        vals = values[keyed].ravel()
+        frms = np.tile(np.asarray(frames, dtype=np.float64), nbr_channels)
+        fixed = np.zeros(vals.shape, dtype=bool)
+        fixed.reshape(nbr_channels, -1)[:, [0, -1]] = True
+        kept = np.ones(vals.shape, dtype=bool)
+        indices = np.arange(len(vals))
+        parity = 0
+        nbr_fails = 0
+        while nbr_fails < 2:
+            candidates = kept & ~fixed & ((np.cumsum(kept) - 1) % 2 == parity)
+            parity ^= 1
+            trial = kept & ~candidates
+            # Previous and next kept samples of each sample (itself if kept).
+            prev = np.maximum.accumulate(np.where(trial, indices, 0))
+            nxt = np.minimum.accumulate(np.where(trial, indices, len(vals) - 1)[::-1])[::-1]
+            span = frms[nxt] - frms[prev]
+            fac = np.divide(frms - frms[prev], span, out=np.zeros_like(frms), where=span != 0.0)
+            error = exceeds(vals, vals[prev] + (vals[nxt] - vals[prev]) * fac, min_reldiff_fac, min_absdiff_fac)
+            # Each segment between trial kept samples holds a single candidate, dropped if all its samples are fine.
+            segments = np.cumsum(trial) - 1
+            bad_segments = np.bincount(segments, weights=error > 0.0, minlength=segments[-1] + 1) > 0.0
+            dropped = candidates & ~bad_segments[segments]
+            if dropped.any():
+                kept &= ~dropped
+                nbr_fails = 0
+            else:
+                nbr_fails += 1
+        keep[keyed] = kept.reshape(nbr_channels, -1)
+        return keep
+
+    @staticmethod
+    def simplify_tolerances(fac):
+        """
+        Return (relative, minimal absolute) tolerance factors of simplification.
+        """
+        # Same tolerances as stock simplification: 0.1% of current value 'order of magnitude', with default factor.
+        return fac * 1.0e-3, 0.1
+
+    def simplify(self, fac, step, force_keep=False):
+        """
+        Simplifies sampled curves by only enabling samples that cannot be linearly interpolated from kept ones.
+        """
+        self._trim()
+        if not self._nbr_keys:
+            return
+
+        if fac == 0.0:
+            return
+
+        min_reldiff_fac, min_absdiff_fac = self.simplify_tolerances(fac)
+
+        keep = self.simplify_channels(self._frames, self._values, min_reldiff_fac, min_absdiff_fac)
+        self._writes = [bytearray(writes.astype(np.uint8).tobytes()) for writes in keep]
+        are_keyed = keep.any(axis=1).tolist()
+
+        # If we write nothing (action doing nothing) and are in 'force_keep' mode, we key everything! :P
+        # See T41766.
+        # Also, it seems some importers (e.g. UE4) do not handle correctly armatures where some bones
+        # are not animated, but are children of animated ones, so added an option to systematically force writing
+        # one key in this case.
+        # See T41719, T41605, T41254...
+        if self.force_keying or (force_keep and not any(are_keyed)):
+            are_keyed[:] = [True] * len(are_keyed)
+
+        # If we did key something, ensure first and last sampled values are keyed as well.
+        if self.force_startend_keying:
+            for writes, is_keyed in zip(self._writes, are_keyed):
+                if is_keyed:
+                    writes[0] = writes[-1] = 1
+
+    def get_final_data(self, scene, ref_id, force_keep=False):
+        """
+        Yield final anim data for this 'curvenode' (for all curvenodes defined).
+        force_keep is to force to keep a curve even if it only has one valid keyframe.
+        """
+        self._trim()
+        curves = []
+        for values, writes in zip(self._values, self._writes):
+            if 0 not in writes:
+                curves.append((self._frames, values))
+            else:
+                curves.append((array.array(data_types.ARRAY_FLOAT64, compress(self._frames, writes)),
+                               array.array(data_types.ARRAY_FLOAT64, compress(values, writes))))
+
+        for elem_key, fbx_group, fbx_gname, fbx_props in \
+                zip(self.elem_keys, self.fbx_group, self.fbx_gname, self.fbx_props):
+            group_key = get_blender_anim_curve_node_key(scene, ref_id, elem_key, fbx_group)
+            group = OrderedDict()
+            for (frames, values), def_val, fbx_item in zip(curves, self.default_values, fbx_props):
+                fbx_item = FBX_ANIM_PROPSGROUP_NAME + "|" + fbx_item
+                curve_key = get_blender_anim_curve_key(scene, ref_id, elem_key, fbx_group, fbx_item)
+                # (curve key, default value, keyframes, write flag).
+                nbr_keys = len(frames)
+                group[fbx_item] = (curve_key, def_val, (frames, values),
+                                   True if (nbr_keys > 1 or (nbr_keys > 0 and force_keep)) else False)
+            yield elem_key, group_key, group, fbx_group, fbx_gname
+
+
+class FBXDirectTransform:
+    """
+    Compute the FBX transform of an object or a bone directly from the F-curves of its action, without having to
+    update the whole scene for each frame. Only valid for objects/bones whose transform only depends on their own
+    loc/rot/scale properties (see fbx_animations_direct_transforms()).
+    """
+    __slots__ = ("rotation_mode", "paths", "values", "values_org", "fcurves", "channels", "use_deltas",
+                 "matrix_pre", "matrix_post")
+
+    props = ("location", "rotation_euler", "rotation_quaternion", "rotation_axis_angle", "scale")
+    props_deltas = ("delta_location", "delta_rotation_euler", "delta_rotation_quaternion", "delta_scale")
+
+    def __init__(self, bdata, fcurves, use_deltas, matrix_pre, matrix_post):
+        self.rotation_mode = bdata.rotation_mode
+        self.use_deltas = use_deltas
+        self.matrix_pre = matrix_pre
+        self.matrix_post = matrix_post
+        # Unkeyed channels keep their current value.
+        props = (self.props + self.props_deltas) if use_deltas else self.props
+        self.paths = tuple(bdata.path_from_id(prop) for prop in props)
+        self.values = OrderedDict((prop, list(getattr(bdata, prop))) for prop in props)
+        self.values_org = tuple(tuple(vals) for vals in self.values.values())
+        self.set_fcurves(fcurves)
+
+    def set_fcurves(self, fcurves):
+        """
+        (Re)bind this transform to given F-curves ({data_path: {array_index: fcurve}}), e.g. to evaluate another
+        action of the same object.
+        """
+        self.fcurves = fcurves
+        self.channels = []
+        for vals, vals_org, path in zip(self.values.values(), self.values_org, self.paths):
+            vals[:] = vals_org
+            for idx, fc in fcurves.get(path, {}).items():
+                if idx < len(vals):
+                    self.channels.append((vals, idx, fc))
+
+    @staticmethod
+    def _rotation_matrix(rotation_mode, rot_euler, rot_quat, rot_axis_angle):
+        if rotation_mode == 'QUATERNION':
+            return Quaternion(rot_quat).normalized().to_matrix()
+        elif rotation_mode == 'AXIS_ANGLE':
+            return Quaternion(rot_axis_angle[1:], rot_axis_angle[0]).to_matrix()
+        return Euler(rot_euler, rotation_mode).to_matrix()
+
+    def matrix(self, frame):
+        for vals, idx, fc in self.channels:
+            vals[idx] = fc.evaluate(frame)
+        values = self.values
+        loc = Vector(values["location"])
+        scale = values["scale"]
+        mat_rot = self._rotation_matrix(self.rotation_mode, values["rotation_euler"], values["rotation_quaternion"],
+                                        values["rotation_axis_angle"])
+        if self.use_deltas:
+            loc += Vector(values["delta_location"])
+            scale = [s * ds for s, ds in zip(scale, values["delta_scale"])]
+            # Note there is no delta for axis-angle rotations.
+            if self.rotation_mode != 'AXIS_ANGLE':
+                mat_rot = self._rotation_matrix(self.rotation_mode, values["delta_rotation_euler"],
+                                                values["delta_rotation_quaternion"], None) * mat_rot
+        matrix = (mat_rot * Matrix(((scale[0], 0.0, 0.0), (0.0, scale[1], 0.0), (0.0, 0.0, scale[2])))).to_4x4()
+        matrix.translation = loc
+        return self.matrix_pre * matrix * self.matrix_post
+
+    def fbx_object_tx(self, frame, rot_euler_compat=None):
+        """
+        Same as ObjectWrapper.fbx_object_tx(), for given frame.
+        """
+        loc, rot, scale = self.matrix(frame).decompose()
+        # quat -> euler, we always use 'XYZ' order, use ref rotation if given.
+        if rot_euler_compat is not None:
+            rot = rot.to_euler('XYZ', rot_euler_compat)
+        else:
+            rot = rot.to_euler('XYZ')
+        return loc, rot, scale
+
+
+def _fbx_animdata_is_direct(anim_data):
+    """
+    Whether given animation data only evaluates its active action as-is (no drivers, no NLA, no blending).
+    """
+    if anim_data is None:
+        return True
+    if anim_data.drivers or anim_data.use_tweak_mode:
+        return False
+    if anim_data.use_nla and any(not track.mute and track.strips for track in anim_data.nla_tracks):
+        return False
+    return anim_data.action_influence == 1.0 and anim_data.action_blend_type == 'REPLACE'
+
+
+def _fbx_action_fcurves(action):
+    """
+    Return a mapping {data_path: {array_index: fcurve}} of active F-curves of given action.
+    """
+    fcurves = {}
+    if action is None:
+        return fcurves
+    for fc in action.fcurves:
+        if fc.mute or not fc.is_valid or (fc.group is not None and fc.group.mute):
+            continue
+        fcurves.setdefault(fc.data_path, {})[fc.array_index] = fc
+    return fcurves
+
+
+def fbx_action_frame_range(settings, action):
+    """
+    Return the (start, end) frame range to bake given action over, i.e. the bounds of its active F-curves keyframes,
+    padded by settings.bake_anim_action_pad_pre/post.
+    Unlike action.frame_range, muted F-curves are ignored, so that they do not stretch the baked range.
+    """
+    f_start = f_end = None
+    for fcurves in _fbx_action_fcurves(action).values():
+        for fc in fcurves.values():
+            if not fc.keyframe_points:
+                continue
+            fc_start, fc_end = fc.range()
+            if f_start is None or fc_start < f_start:
+                f_start = fc_start
+            if f_end is None or fc_end > f_end:
+                f_end = fc_end
+    if f_start is None:
+        f_start, f_end = action.frame_range  # sic!
+    f_start -= settings.bake_anim_action_pad_pre
+    f_end += settings.bake_anim_action_pad_post
+    # Always bake at least two keys (same as action.frame_range).
+    if f_end <= f_start:
+        f_end = f_start + 1.0
+    return f_start, f_end
+
+
+def fbx_animations_direct_transforms(scene_data, objects):
+    """
+    Check whether transforms of all given objects (and bones) can be computed directly from their action F-curves
+    (i.e. they are not affected by constraints, drivers, NLA, parents...), and return a mapping
+    {ob_obj: FBXDirectTransform} if so, None otherwise (in which case the whole scene has to be evaluated
+    for each frame).
+    Objects parented to an armature are skipped, their transform is never baked (same as in fbx_animations_do()).
+    Any other parent, even an armature one with another parent type, returns None.
+    """
+    settings = scene_data.settings
+    scene = scene_data.scene
+    if settings.bake_space_transform or scene.render.frame_map_old != scene.render.frame_map_new:
+        return None
+
+    direct_tx = {}
+    bones = set()
+    for ob_obj in objects:
+        if ob_obj.parented_to_armature:
+            # Not animated, no transform to compute.
+            continue
+        if ob_obj.is_bone:
+            bones.add(ob_obj)
+            continue
+        if not ob_obj.is_object or ob_obj.type not in {'MESH', 'EMPTY', 'ARMATURE'}:
+            return None
+        ob = ob_obj.bdata
+        if ob.parent is not None or ob.constraints or ob.rigid_body is not None:
+            return None
+        if not _fbx_animdata_is_direct(ob.animation_data):
+            return None
+        fcurves = _fbx_action_fcurves(ob.animation_data and ob.animation_data.action)
+        direct_tx[ob_obj] = FBXDirectTransform(ob, fcurves, True, settings.global_matrix, Matrix())
+
+        if ob_obj.type == 'ARMATURE':
+            arm = ob.data
+            if arm.pose_position != 'POSE' or (arm.animation_data and arm.animation_data.drivers):
+                return None
+            for pbo in ob.pose.bones:
+                bo = pbo.bone
+                if pbo.constraints or bo.use_relative_parent:
+                    return None
+                if not (bo.use_inherit_rotation and bo.use_inherit_scale and bo.use_local_location):
+                    return None
+            for bo_obj in ob_obj.bones:
+                if bo_obj not in objects:
+                    continue
+                direct_tx[bo_obj] = _fbx_bone_direct_transform(settings, ob, bo_obj.bdata, fcurves)
+
+    # Bones whose armature is not exported in this animation...
+    if bones - direct_tx.keys():
+        return None
+    return direct_tx
+
+
+def _fbx_bone_direct_transform(settings, arm, bo, fcurves):
+    # With default parenting options, pose matrix of a bone in its parent's pose space is simply
+    # its rest matrix (in parent's rest space) times its basis matrix.
+    matrix_pre = bo.matrix_local
+    if bo.parent is not None:
+        matrix_pre = bo.parent.matrix_local.inverted_safe() * matrix_pre
+        if settings.bone_correction_matrix_inv:
+            matrix_pre = settings.bone_correction_matrix_inv * matrix_pre
+    matrix_post = settings.bone_correction_matrix or Matrix()
+    return FBXDirectTransform(arm.pose.bones[bo.name], fcurves, False, matrix_pre, matrix_post)
+
+
+def _fbx_fcurve_is_static(fc, value):
+    """
+    Whether given F-curve always evaluates to given value (all keyframes and handles at that value, no modifiers).
+    """
+    if fc.modifiers or not fc.keyframe_points:
+        return False
+    for kp in fc.keyframe_points:
+        if not (kp.co[1] == value and kp.handle_left[1] == value and kp.handle_right[1] == value):
+            return False
+    return True
+
+
+def _fbx_channels_are_static(bdata, props, fcurves, drivers_paths):
+    """
+    Whether given transform properties of bdata (an Object or a PoseBone) cannot change, i.e. are not driven,
+    and are either not animated or only animated by flat F-curves matching their current value.
+    """
+    for prop in props:
+        path = bdata.path_from_id(prop)
+        if path in drivers_paths:
+            return False
+        prop_fcurves = fcurves.get(path)
+        if prop_fcurves:
+            values = getattr(bdata, prop)
+            for idx, fc in prop_fcurves.items():
+                if idx >= len(values) or not _fbx_fcurve_is_static(fc, values[idx]):
+                    return False
+    return True
+
+
+def fbx_animations_static_transforms(scene_data, objects, fcurves=None):
+    """
+    Find objects and bones whose transform cannot change while baking current animation: not affected by any
+    constraint, driver, NLA strip, animated parent..., and not animated by their action (or only by flat F-curves).
+    When fcurves is given, it maps objects to the F-curves (see _fbx_action_fcurves()) of the baked action (which is
+    not assigned to them), and other objects are skipped; otherwise the F-curves of the actions assigned to objects
+    are used.
+    Returns a mapping {ob_obj: FBXDirectTransform} for those, computing their (constant) transform.
+    This is a conservative analysis, anything unsure is considered as animated.
+    """
+    settings = scene_data.settings
+    if settings.bake_space_transform:
+        return {}
+
+    props_ob = FBXDirectTransform.props + FBXDirectTransform.props_deltas
+    props_bo = FBXDirectTransform.props
+    static_tx = {}
+    for ob_obj in objects:
+        if not (ob_obj.is_object and ob_obj.type in {'MESH', 'EMPTY', 'ARMATURE'}):
+            continue
+        ob = ob_obj.bdata
+        anim_data = ob.animation_data
+        if anim_data is not None and anim_data.use_nla and any(not track.mute and track.strips
+                                                               for track in anim_data.nla_tracks):
+            continue
+        if fcurves is not None:
+            if ob_obj not in fcurves:
+                continue
+            ob_fcurves = fcurves[ob_obj]
+        else:
+            ob_fcurves = _fbx_action_fcurves(anim_data and anim_data.action)
+        drivers_paths = {drv.data_path for drv in anim_data.drivers} if anim_data is not None else set()
+
+        if ob.parent is None and not ob.constraints and ob.rigid_body is None:
+            if _fbx_channels_are_static(ob, props_ob, ob_fcurves, drivers_paths):
+                static_tx[ob_obj] = FBXDirectTransform(ob, {}, True, settings.global_matrix, Matrix())
+
+        if ob_obj.type == 'ARMATURE':
+            # Bones' transforms are in their parent's space, they do not depend on the armature object.
+            if ob.data.pose_position != 'POSE':
+                continue
+            # IK chains may move any bone...
+            if any(con.type in {'IK', 'SPLINE_IK'} for pbo in ob.pose.bones for con in pbo.constraints):
+                continue
+            for bo_obj in ob_obj.bones:
+                if bo_obj not in objects:
+                    continue
+                bo = bo_obj.bdata
+                pbo = ob.pose.bones[bo.name]
+                if pbo.constraints or bo.use_relative_parent:
+                    continue
+                if not (bo.use_inherit_rotation and bo.use_inherit_scale and bo.use_local_location):
+                    continue
+                if _fbx_channels_are_static(pbo, props_bo, ob_fcurves, drivers_paths):
+                    static_tx[bo_obj] = _fbx_bone_direct_transform(settings, ob, bo, {})
+    return static_tx
+
+
+def fbx_matrices_decompose(matrices):
+    """
+    Same as Matrix.decompose(), for an (n, 4, 4) array of (row-major) matrices at once.
+    Return (n, 3) locations, (n, 4) rotation quaternions (w, x, y, z) and (n, 3) scales arrays.
+    """
+    loc = matrices[:, :3, 3]
+    mat3 = matrices[:, :3, :3]
+    # Scale is the length of each column, rotation the normalized columns, both negated for negative matrices.
+    scale = np.sqrt((mat3 * mat3).sum(axis=1))
+    rot = np.divide(mat3, scale[:, np.newaxis, :], out=np.zeros_like(mat3), where=scale[:, np.newaxis, :] != 0.0)
+    neg = np.linalg.det(rot) < 0.0
+    rot[neg] *= -1.0
+    scale[neg] *= -1.0
+
+    # Rotation matrices to quaternions, using for each the formula based on its largest diagonal term.
+    r = rot
+    diag = np.stack((1.0 + r[:, 0, 0] + r[:, 1, 1] + r[:, 2, 2],
+                     1.0 + r[:, 0, 0] - r[:, 1, 1] - r[:, 2, 2],
+                     1.0 - r[:, 0, 0] + r[:, 1, 1] - r[:, 2, 2],
+                     1.0 - r[:, 0, 0] - r[:, 1, 1] + r[:, 2, 2]), axis=1)
+    case = diag.argmax(axis=1)
+    s = 2.0 * np.sqrt(np.maximum(diag[np.arange(len(r)), case], 1e-12))
+    d21, d02, d10 = r[:, 2, 1] - r[:, 1, 2], r[:, 0, 2] - r[:, 2, 0], r[:, 1, 0] - r[:, 0, 1]
+    s01, s02, s12 = r[:, 0, 1] + r[:, 1, 0], r[:, 0, 2] + r[:, 2, 0], r[:, 1, 2] + r[:, 2, 1]
+    quat = np.select([(case == i)[:, np.newaxis] for i in range(4)], [
+        np.stack((0.25 * s, d21 / s, d02 / s, d10 / s), axis=1),
+        np.stack((d21 / s, 0.25 * s, s01 / s, s02 / s), axis=1),
+        np.stack((d02 / s, s01 / s, 0.25 * s, s12 / s), axis=1),
+        np.stack((d10 / s, s02 / s, s12 / s, 0.25 * s), axis=1),
+    ])
+    quat /= np.sqrt((quat * quat).sum(axis=1))[:, np.newaxis]
+    return loc, quat, scale
+
+
+class FBXRigPoseEvaluator:
+    """
+    Compute FBX local transforms of (some of) the bones of an armature from its current pose, for the whole rig at
+    once: all pose matrices are fetched with a single foreach_get, and brought into their parent's space and
+    decomposed as numpy array operations, instead of with mathutils once per bone (and per child bone) as with
+    ObjectWrapper.fbx_object_tx().
+    Samples are stored one (nbr_bones, 10) array of (loc, rotation quaternion, scale) per frame, and set as keyframes
+    of bones' curve nodes once all frames are baked, rotations being converted to compatible eulers then.
+    """
+    __slots__ = ("pose_bones", "bones", "indices", "parents", "parented", "buffer", "correction", "correction_inv",
+                 "frames", "samples")
+
+    def __init__(self, scene_data, arm_obj, bo_objs):
+        self.pose_bones = arm_obj.bdata.pose.bones
+        self.bones = tuple(bo_objs)
+        indices = {pbo.name: idx for idx, pbo in enumerate(self.pose_bones)}
+        # Indices of evaluated bones in pose bones, and of the parents of the parented ones.
+        self.indices = np.array([indices[bo_obj.bdata.name] for bo_obj in bo_objs], dtype=np.intp)
+        self.parented = np.array([bo_obj.bdata.parent is not None for bo_obj in bo_objs], dtype=bool)
+        self.parents = np.array([indices[bo_obj.bdata.parent.name] for bo_obj in bo_objs if bo_obj.bdata.parent],
+                                dtype=np.intp)
+        self.buffer = np.empty(len(self.pose_bones) * 16, dtype=np.float32)
+        correction = scene_data.settings.bone_correction_matrix
+        correction_inv = scene_data.settings.bone_correction_matrix_inv
+        self.correction = np.array(correction, dtype=np.float64) if correction else None
+        self.correction_inv = np.array(correction_inv, dtype=np.float64) if correction_inv else None
+        self.frames = []
+        self.samples = []
+
+    def evaluate(self):
+        """
+        Return an (nbr_bones, 10) array of (loc, rotation quaternion, scale) of all bones, from current pose.
+        """
+        self.pose_bones.foreach_get("matrix", self.buffer)
+        # Matrices are read column by column.
+        matrices = self.buffer.reshape(-1, 4, 4).transpose(0, 2, 1).astype(np.float64)
+        local = matrices[self.indices]
+        if len(self.parents):
+            # PoseBone.matrix is in armature space, bring it back into parent's space.
+            par_matrices = matrices[self.parents]
+            try:
+                par_matrices_inv = np.linalg.inv(par_matrices)
+            except np.linalg.LinAlgError:
+                # Some degenerate (zero-scaled) parent.
+                par_matrices_inv = np.array([Matrix(mat.tolist()).inverted_safe() for mat in par_matrices])
+            parented = np.matmul(par_matrices_inv, local[self.parented])
+            # Undo the parent correction.
+            if self.correction_inv is not None:
+                parented = np.matmul(self.correction_inv, parented)
+            local[self.parented] = parented
+        # Apply the bone correction.
+        if self.correction is not None:
+            local = np.matmul(local, self.correction)
+        loc, rot, scale = fbx_matrices_decompose(local)
+        return np.concatenate((loc, rot, scale), axis=1)
+
+    def add(self, real_frame, sample):
+        self.frames.append(real_frame)
+        self.samples.append(sample)
+
+    def sample(self, real_frame):
+        """
+        Add transforms of all bones at given frame (scene is expected to be evaluated at that frame).
+        """
+        self.add(real_frame, self.evaluate())
+
+    def finish(self, animdata_ob, p_rots):
+        """
+        Set sampled transforms of each bone as keyframes of its curve nodes, with rotations converted to eulers
+        compatible with previous frame ones (starting from p_rots).
+        """
+        if not self.samples:
+            return
+        samples = np.array(self.samples).reshape(len(self.frames), len(self.bones), 10)
+        for idx, bo_obj in enumerate(self.bones):
+            anim_loc, anim_rot, anim_scale = animdata_ob[bo_obj]
+            bo_samples = samples[:, idx].T
+            anim_loc.set_keyframes(self.frames, bo_samples[0:3].tolist())
+            anim_scale.set_keyframes(self.frames, bo_samples[7:10].tolist())
+            rot = p_rots[bo_obj]
+            rots = []
+            for quat in bo_samples[3:7].T.tolist():
+                rot = Quaternion(quat).to_euler('XYZ', rot)
+                rots.append(rot)
+            anim_rot.set_keyframes(self.frames, [list(convert_rad_to_deg_iter(vals)) for vals in zip(*rots)])
+
+
+def _fbx_shape_key_fcurves(key):
+    """
+    Return a mapping {shape name: fcurve} of F-curves animating values of given Key datablock's shapes, or None
+    if those values cannot be computed from them directly (drivers, NLA, other animated properties...).
+    """
+    anim_data = key.animation_data
+    if not _fbx_animdata_is_direct(anim_data):
+        return None
+    fcurves = {}
+    for data_path, fcs in _fbx_action_fcurves(anim_data.action if anim_data else None).items():
+        shape_path, _sep, prop = data_path.rpartition('.')
+        if prop != "value" or not shape_path.startswith("key_blocks[") or 0 not in fcs:
+            return None
+        try:
+            fcurves[key.path_resolve(shape_path).name] = fcs[0]
+        except ValueError:
+            return None
+    return fcurves
+
+
+def fbx_animations_shapes_direct(scene_data):
+    """
+    Whether all shape keys values can be computed directly from their F-curves (see FBXShapeKeysSampler).
+    """
+    return all(_fbx_shape_key_fcurves(me.shape_keys) is not None for me in scene_data.data_deformers_shape
+               if me.shape_keys.use_relative)  # Absolute shape keys are ignored for now.
+
+
+class FBXShapeKeysSampler:
+    """
+    Sample values of (some of) the shapes of a Key datablock, all at once for each frame: either with a single read
+    of all current values, or computed from its F-curves when only those animate it (no scene update needed then).
+    Samples are stored one row of values per frame, and split in one column per shape once all frames are baked.
+    """
+    __slots__ = ("key", "shapes", "fcurves", "frames", "values", "row")
+
+    def __init__(self, key):
+        self.key = key
+        self.shapes = []  # (curve node, index of shape in key).
+        self.frames = array.array(data_types.ARRAY_FLOAT64)
+        self.values = array.array(data_types.ARRAY_FLOAT32)
+        self.row = array.array(data_types.ARRAY_FLOAT32, (0.0,)) * len(key.key_blocks)
+        key.key_blocks.foreach_get("value", self.row)
+        # (index of shape in key, fcurve, min value, max value), or None when values have to be read from the scene.
+        self.fcurves = None
+        fcurves = _fbx_shape_key_fcurves(key)
+        if fcurves is not None:
+            self.fcurves = tuple((idx, fcurves[shape.name], shape.slider_min, shape.slider_max)
+                                 for idx, shape in enumerate(key.key_blocks) if shape.name in fcurves)
+
+    def add_shape(self, acnode, shape):
+        for idx, kb in enumerate(self.key.key_blocks):
+            if kb == shape:
+                self.shapes.append((acnode, idx))
+                return
+        assert(0)
+
+    def read(self, frame):
+        """
+        Return values of all shapes of the key at given frame (scene is expected to be evaluated at that frame,
+        unless values are computed from F-curves). Returned array is only valid until next call.
+        """
+        row = self.row
+        if self.fcurves is None:
+            self.key.key_blocks.foreach_get("value", row)
+        else:
+            for idx, fc, val_min, val_max in self.fcurves:
+                # Same clamping as when the animation system sets the value.
+                row[idx] = min(max(fc.evaluate(frame), val_min), val_max)
+        return row
+
+    def add(self, real_frame, row):
+        self.frames.append(real_frame)
+        self.values.extend(row)
+
+    def sample(self, frame, real_frame):
+        """
+        Add values of all shapes at given frame.
+        """
+        self.add(real_frame, self.read(frame))
+
+    def finish(self):
+        """
+        Set sampled values of each shape (in percents) as keyframes of its curve node.
+        """
+        nbr_shapes = len(self.row)
+        for acnode, idx in self.shapes:
+            acnode.set_keyframes(self.frames, ([val * 100.0 for val in self.values[idx::nbr_shapes]],))
+
+
+# Adaptive baking starts sampling every (1 << FBX_ANIM_ADAPTIVE_LEVELS) steps.
+FBX_ANIM_ADAPTIVE_LEVELS = 3
+
+
+def fbx_animations_adaptive_samples(sample, nbr_frames, within_tolerance):
+    """
+    Adaptive sampling of the nbr_frames frames of a fixed-step bake: frames are first sampled every
+    (1 << FBX_ANIM_ADAPTIVE_LEVELS) steps, then each interval is split at its middle frame, and that middle sample is
+    compared to the linear interpolation of the interval's ends. Only intervals where they differ by more than
+    the tolerance are split again, until they reach the fixed step.
+    sample(i) returns the sample for i-th frame, within_tolerance(sample_start, sample_mid, sample_end, factor) checks
+    middle sample against interpolation (factor being position of middle frame within interval).
+    Return a mapping {frame index: sample}.
+    """
+    if nbr_frames <= 0:
+        return {}
+    indices = list(range(0, nbr_frames - 1, 1 << FBX_ANIM_ADAPTIVE_LEVELS)) + [nbr_frames - 1]
+    samples = {i: sample(i) for i in indices}
+    intervals = list(zip(indices, indices[1:]))
+    while intervals:
+        i, j = intervals.pop()
+        if j - i < 2:
+            continue
+        m = (i + j) // 2
+        samples[m] = sample(m)
+        if not within_tolerance(samples[i], samples[m], samples[j], (m - i) / (j - i)):
+            intervals += [(i, m), (m, j)]
+    return samples
+
+
+def fbx_animations_objects(scene_data, objects):
+    """
+    Add bones and duplis of given objects (in-place), and return them.
+    """
+    scene = scene_data.scene
+    for ob_obj in tuple(objects):
+        if not ob_obj.is_object:
+            continue
+        if ob_obj.type == 'ARMATURE':
+            objects |= {bo_obj for bo_obj in ob_obj.bones if bo_obj in scene_data.objects}
+        ob_obj.dupli_list_create(scene, 'RENDER')
+        for dp_obj in ob_obj.dupli_list:
+            if dp_obj in scene_data.objects:
+                objects.add(dp_obj)
+        ob_obj.dupli_list_clear()
+    return objects
+
+
+def fbx_animations_do_iter(scene_data, ref_id, f_start, f_end, start_zero, objects=None, force_keep=False,
+                           direct_tx=None, sources=None):
     """
     Generate animation data (a single AnimStack) from objects, for a given frame range.
+    This is a generator: it yields each frame it needs the scene to be evaluated at, samples it once resumed, and
+    returns generated animation data (see fbx_animations_sweep(), which drives it).
+    direct_tx may be a mapping {ob_obj: FBXDirectTransform} (already bound to the F-curves to bake) for all objects,
+    in which case the scene is not evaluated at all (no frame is yielded).
+    sources may be a mapping {ob_obj: ObjectWrapper} of objects sampled from a copy of themselves, animated by the
+    baked action (see fbx_animations_actions_bake()).
     """
     bake_step = scene_data.settings.bake_anim_step
     simplify_fac = scene_data.settings.bake_anim_simplify_factor
@@ -1867,69 +3102,218 @@ def fbx_animations_do(scene_data, ref_id, f_start, f_end, start_zero, objects=No
 
     if objects is not None:
         # Add bones and duplis!
-        for ob_obj in tuple(objects):
-            if not ob_obj.is_object:
-                continue
-            if ob_obj.type == 'ARMATURE':
-                objects |= {bo_obj for bo_obj in ob_obj.bones if bo_obj in scene_data.objects}
-            ob_obj.dupli_list_create(scene, 'RENDER')
-            for dp_obj in ob_obj.dupli_list:
-                if dp_obj in scene_data.objects:
-                    objects.add(dp_obj)
-            ob_obj.dupli_list_clear()
+        objects = fbx_animations_objects(scene_data, objects)
     else:
         objects = scene_data.objects
+    sources = sources or {}
 
     back_currframe = scene.frame_current
     animdata_ob = OrderedDict()
     p_rots = {}
+    # Curves' keys arrays are preallocated for the whole baked range.
+    nbr_keys = max(0, int((f_end - f_start) / bake_step) + 1)
 
     for ob_obj in objects:
         if ob_obj.parented_to_armature:
             continue
-        ACNW = AnimationCurveNodeWrapper
+        ACNW = AnimationCurveNodeWrapperUE4
         loc, rot, scale, _m, _mr = ob_obj.fbx_object_tx(scene_data)
         rot_deg = tuple(convert_rad_to_deg_iter(rot))
         force_key = (simplify_fac == 0.0) or (ob_obj.is_bone and force_keying)
-        animdata_ob[ob_obj] = (ACNW(ob_obj.key, 'LCL_TRANSLATION', force_key, force_sek, loc),
-                               ACNW(ob_obj.key, 'LCL_ROTATION', force_key, force_sek, rot_deg),
-                               ACNW(ob_obj.key, 'LCL_SCALING', force_key, force_sek, scale))
+        animdata_ob[ob_obj] = (ACNW(ob_obj.key, 'LCL_TRANSLATION', force_key, force_sek, loc, nbr_keys),
+                               ACNW(ob_obj.key, 'LCL_ROTATION', force_key, force_sek, rot_deg, nbr_keys),
+                               ACNW(ob_obj.key, 'LCL_SCALING', force_key, force_sek, scale, nbr_keys))
         p_rots[ob_obj] = rot
 
     animdata_shapes = OrderedDict()
+    shapes_samplers = []
     force_key = (simplify_fac == 0.0)
     for me, (me_key, _shapes_key, shapes) in scene_data.data_deformers_shape.items():
         # Ignore absolute shape keys for now!
         if not me.shape_keys.use_relative:
             continue
+        sampler = FBXShapeKeysSampler(me.shape_keys)
+        shapes_samplers.append(sampler)
         for shape, (channel_key, geom_key, _shape_verts_co, _shape_verts_idx) in shapes.items():
-            acnode = AnimationCurveNodeWrapper(channel_key, 'SHAPE_KEY', force_key, force_sek, (0.0,))
+            acnode = AnimationCurveNodeWrapperUE4(channel_key, 'SHAPE_KEY', force_key, force_sek, (0.0,))
             # Sooooo happy to have to twist again like a mad snake... Yes, we need to write those curves twice. :/
             acnode.add_group(me_key, shape.name, shape.name, (shape.name,))
             animdata_shapes[channel_key] = (acnode, me, shape)
+            sampler.add_shape(acnode, shape)
+
+    # When possible, compute transforms and shape keys values from F-curves directly, much faster than updating
+    # the whole scene.
+    shapes_direct = all(sampler.fcurves is not None for sampler in shapes_samplers)
+    if direct_tx is None and shapes_direct:
+        direct_tx = fbx_animations_direct_transforms(scene_data, animdata_ob)
+    assert(direct_tx is None or shapes_direct)
+
+    # Objects and bones which cannot move are not sampled at all, only keyed at start and end (which gives the
+    # same curves as full sampling once simplified).
+    static_tx = {}
+    if simplify_fac != 0.0:
+        fcurves = None
+        if direct_tx is not None:
+            fcurves = {ob_obj: tx.fcurves for ob_obj, tx in direct_tx.items() if ob_obj.is_object}
+        elif sources:
+            fcurves = {ob_obj: _fbx_action_fcurves(src.bdata.animation_data.action)
+                       for ob_obj, src in sources.items()}
+        static_tx = fbx_animations_static_transforms(scene_data, animdata_ob, fcurves)
+
+    # Otherwise, bones of each armature are evaluated all at once from the scene (see FBXRigPoseEvaluator),
+    # and their rotations are converted to compatible eulers once all frames are baked.
+    rigs = []
+    rig_bones = set()
+    if direct_tx is None:
+        for ob_obj in animdata_ob:
+            if not (ob_obj.is_object and ob_obj.type == 'ARMATURE'):
+                continue
+            bo_objs = [bo_obj for bo_obj in ob_obj.bones if bo_obj in animdata_ob and bo_obj not in static_tx]
+            if bo_objs:
+                rigs.append(FBXRigPoseEvaluator(scene_data, sources.get(ob_obj, ob_obj), bo_objs))
+                rig_bones.update(bo_objs)
 
     currframe = f_start
+
+    # Adaptive baking: objects, bones and shapes are only evaluated at frames which cannot be linearly interpolated
+    # (within simplification tolerance) from their neighbors, instead of at each step. Frames may be evaluated in
+    # any order, so this does not suit simulations depending on previous frames.
+    if scene_data.settings.bake_anim_adaptive and simplify_fac != 0.0:
+        min_reldiff_fac, min_absdiff_fac = AnimationCurveNodeWrapperUE4.simplify_tolerances(simplify_fac)
+        # Layout of samples: (loc, rotation quaternion, scale) of objects, then of rigs bones, then shapes values.
+        tracked = [ob_obj for ob_obj in animdata_ob if ob_obj not in static_tx and ob_obj not in rig_bones]
+        nbr_tx = len(tracked) + sum(len(rig.bones) for rig in rigs)
+        shapes_offsets = []
+        offset = nbr_tx * 10
+        for sampler in shapes_samplers:
+            shapes_offsets.extend(offset + idx for _acnode, idx in sampler.shapes)
+            offset += len(sampler.row)
+
+        def sample(i):
+            frame = f_start + i * bake_step
+            values = array.array(data_types.ARRAY_FLOAT64)
+            if direct_tx is not None:
+                for ob_obj in tracked:
+                    loc, rot, scale = direct_tx[ob_obj].matrix(frame).decompose()
+                    values.extend(chain(loc, rot, scale))
+            else:
+                scene.frame_set(int(frame), frame - int(frame))
+                for ob_obj in animdata_ob:
+                    ob_obj.dupli_list_create(scene, 'RENDER')
+                for ob_obj in tracked:
+                    loc, _rot, scale, _m, mat_rot = sources.get(ob_obj, ob_obj).fbx_object_tx(scene_data)
+                    values.extend(chain(loc, mat_rot.to_quaternion(), scale))
+                for rig in rigs:
+                    values.extend(rig.evaluate().ravel().tolist())
+                for ob_obj in objects:
+                    ob_obj.dupli_list_clear()
+            for sampler in shapes_samplers:
+                values.extend(sampler.read(frame))
+            return values
+
+        def within_tolerance(va, vm, vb, fac):
+            def check(a_vals, m_vals, b_vals):
+                # Same test as simplification, see AnimationCurveNodeWrapperUE4.simplify_exceeds().
+                for a, m, b in zip(a_vals, m_vals, b_vals):
+                    interp = a + (b - a) * fac
+                    if abs(m - interp) > min_reldiff_fac * max(abs(m) + abs(interp), min_absdiff_fac):
+                        return False
+                return True
+            for o in range(0, nbr_tx * 10, 10):
+                # Rotations are written (and hence interpolated) as compatible eulers, in degrees.
+                ea = Quaternion(va[o + 3:o + 7]).to_euler('XYZ')
+                eb = Quaternion(vb[o + 3:o + 7]).to_euler('XYZ', ea)
+                em = Quaternion(vm[o + 3:o + 7]).to_euler('XYZ', ea)
+                if not (check(va[o:o + 3], vm[o:o + 3], vb[o:o + 3]) and
+                        check(va[o + 7:o + 10], vm[o + 7:o + 10], vb[o + 7:o + 10]) and
+                        check(convert_rad_to_deg_iter(ea), convert_rad_to_deg_iter(em), convert_rad_to_deg_iter(eb))):
+                    return False
+            # Shapes values are written in percents.
+            return check(*((v[o] * 100.0 for o in shapes_offsets) for v in (va, vm, vb)))
+
+        samples = fbx_animations_adaptive_samples(sample, nbr_keys, within_tolerance)
+        if direct_tx is None:
+            scene.frame_set(back_currframe, 0.0)
+        for i in sorted(samples):
+            values = samples[i]
+            currframe = f_start + i * bake_step
+            real_currframe = currframe - f_start if start_zero else currframe
+            o = 0
+            for ob_obj in tracked:
+                anim_loc, anim_rot, anim_scale = animdata_ob[ob_obj]
+                rot = Quaternion(values[o + 3:o + 7]).to_euler('XYZ', p_rots[ob_obj])
+                p_rots[ob_obj] = rot
+                anim_loc.add_keyframe(real_currframe, values[o:o + 3])
+                anim_rot.add_keyframe(real_currframe, tuple(convert_rad_to_deg_iter(rot)))
+                anim_scale.add_keyframe(real_currframe, values[o + 7:o + 10])
+                o += 10
+            for rig in rigs:
+                rig.add(real_currframe, values[o:o + len(rig.bones) * 10])
+                o += len(rig.bones) * 10
+            for sampler in shapes_samplers:
+                sampler.add(real_currframe, values[o:o + len(sampler.row)])
+                o += len(sampler.row)
+        # Skip fixed-step baking below.
+        currframe = f_start + nbr_keys * bake_step
+
     while currframe <= f_end:
         real_currframe = currframe - f_start if start_zero else currframe
-        scene.frame_set(int(currframe), currframe - int(currframe))
+        if direct_tx is not None:
+            for ob_obj, (anim_loc, anim_rot, anim_scale) in animdata_ob.items():
+                if ob_obj in static_tx:
+                    continue
+                p_rot = p_rots.get(ob_obj, None)
+                loc, rot, scale = direct_tx[ob_obj].fbx_object_tx(currframe, rot_euler_compat=p_rot)
+                p_rots[ob_obj] = rot
+                anim_loc.add_keyframe(real_currframe, loc)
+                anim_rot.add_keyframe(real_currframe, tuple(convert_rad_to_deg_iter(rot)))
+                anim_scale.add_keyframe(real_currframe, scale)
+            for sampler in shapes_samplers:
+                sampler.sample(currframe, real_currframe)
+            currframe += bake_step
+            continue
+
+        # Scene is evaluated at that frame by the caller.
+        yield currframe
 
         for ob_obj in animdata_ob:
             ob_obj.dupli_list_create(scene, 'RENDER')
         for ob_obj, (anim_loc, anim_rot, anim_scale) in animdata_ob.items():
+            if ob_obj in rig_bones or ob_obj in static_tx:
+                continue
             # We compute baked loc/rot/scale for all objects (rot being euler-compat with previous value!).
             p_rot = p_rots.get(ob_obj, None)
-            loc, rot, scale, _m, _mr = ob_obj.fbx_object_tx(scene_data, rot_euler_compat=p_rot)
+            loc, rot, scale, _m, _mr = sources.get(ob_obj, ob_obj).fbx_object_tx(scene_data, rot_euler_compat=p_rot)
             p_rots[ob_obj] = rot
             anim_loc.add_keyframe(real_currframe, loc)
             anim_rot.add_keyframe(real_currframe, tuple(convert_rad_to_deg_iter(rot)))
             anim_scale.add_keyframe(real_currframe, scale)
+        for rig in rigs:
+            rig.sample(real_currframe)
         for ob_obj in objects:
             ob_obj.dupli_list_clear()
-        for anim_shape, me, shape in animdata_shapes.values():
-            anim_shape.add_keyframe(real_currframe, (shape.value * 100.0,))
+        for sampler in shapes_samplers:
+            sampler.sample(currframe, real_currframe)
         currframe += bake_step
 
-    scene.frame_set(back_currframe, 0.0)
+    for sampler in shapes_samplers:
+        sampler.finish()
+
+    # Static objects and bones.
+    if static_tx and currframe > f_start:
+        real_frames = {f_start - f_start if start_zero else f_start, real_currframe}
+        for ob_obj, tx in static_tx.items():
+            anim_loc, anim_rot, anim_scale = animdata_ob[ob_obj]
+            loc, rot, scale = tx.fbx_object_tx(f_start, rot_euler_compat=p_rots[ob_obj])
+            rot_deg = tuple(convert_rad_to_deg_iter(rot))
+            for real_frame in sorted(real_frames):
+                anim_loc.add_keyframe(real_frame, loc)
+                anim_rot.add_keyframe(real_frame, rot_deg)
+                anim_scale.add_keyframe(real_frame, scale)
+
+    # Bones' baked transforms, with euler-compat filtering of their rotations.
+    for rig in rigs:
+        rig.finish(animdata_ob, p_rots)
 
     animations = OrderedDict()
 
@@ -1969,6 +3353,684 @@ def fbx_animations_do(scene_data, ref_id, f_start, f_end, start_zero, objects=No
     return (astack_key, animations, alayer_key, name, f_start, f_end) if animations else None
 
 
+def fbx_animations_sweep(scene_data, bakes):
+    """
+    Run given fbx_animations_do_iter() bakes together, in a single sweep over their frames: the scene is evaluated
+    only once for each frame needed by any of them, and sampled there by all bakes needing it.
+    Return the list of their animation data.
+    """
+    scene = scene_data.scene
+    back_currframe = scene.frame_current
+    anims = [None] * len(bakes)
+    pending = []  # Heap of (next frame to sample, bake index).
+
+    def resume(idx):
+        try:
+            heapq.heappush(pending, (next(bakes[idx]), idx))
+        except StopIteration as e:
+            anims[idx] = e.value
+
+    for idx in range(len(bakes)):
+        resume(idx)
+    if not pending:
+        return anims
+
+    while pending:
+        frame = pending[0][0]
+        scene.frame_set(int(frame), frame - int(frame))
+        while pending and pending[0][0] == frame:
+            resume(heapq.heappop(pending)[1])
+
+    scene.frame_set(back_currframe, 0.0)
+    return anims
+
+
+def fbx_animations_do(scene_data, ref_id, f_start, f_end, start_zero, objects=None, force_keep=False,
+                      direct_tx=None):
+    """
+    Generate animation data (a single AnimStack) from objects, for a given frame range (see fbx_animations_do_iter()).
+    """
+    bake = fbx_animations_do_iter(scene_data, ref_id, f_start, f_end, start_zero, objects, force_keep, direct_tx)
+    return fbx_animations_sweep(scene_data, [bake])[0]
+
+
+# ##### Actions baking. #####
+
+# Maximum number of actions of an object baked in a single sweep (each one needs a temporary copy of the object).
+FBX_ANIM_SWEEP_ACTIONS = 32
+
+def _fbx_object_restore(ob_to, ob_from):
+    # Restore org state of object (ugh :/ ).
+    props = (
+        'location', 'rotation_quaternion', 'rotation_axis_angle', 'rotation_euler', 'rotation_mode', 'scale',
+        'delta_location', 'delta_rotation_euler', 'delta_rotation_quaternion', 'delta_scale',
+        'lock_location', 'lock_rotation', 'lock_rotation_w', 'lock_rotations_4d', 'lock_scale',
+        'tag', 'layers', 'select', 'track_axis', 'up_axis', 'active_material', 'active_material_index',
+        'matrix_parent_inverse', 'empty_draw_type', 'empty_draw_size', 'empty_image_offset', 'pass_index',
+        'color', 'hide', 'hide_select', 'hide_render', 'use_slow_parent', 'slow_parent_offset',
+        'use_extra_recalc_object', 'use_extra_recalc_data', 'dupli_type', 'use_dupli_frames_speed',
+        'use_dupli_vertices_rotation', 'use_dupli_faces_scale', 'dupli_faces_scale', 'dupli_group',
+        'dupli_frames_start', 'dupli_frames_end', 'dupli_frames_on', 'dupli_frames_off',
+        'draw_type', 'show_bounds', 'draw_bounds_type', 'show_name', 'show_axis', 'show_texture_space',
+        'show_wire', 'show_all_edges', 'show_transparent', 'show_x_ray',
+        'show_only_shape_key', 'use_shape_key_edit_mode', 'active_shape_key_index',
+    )
+    for p in props:
+        if not ob_to.is_property_readonly(p):
+            setattr(ob_to, p, getattr(ob_from, p))
+
+
+def _fbx_id_follows(bid, ob):
+    # Whether given ID (a constraint or driver target) is moved by given object, i.e. is it or one of its children.
+    while isinstance(bid, bpy.types.Object):
+        if bid == ob:
+            return True
+        bid = bid.parent
+    return False
+
+
+def _fbx_object_constraints(ob):
+    constraints = list(ob.constraints)
+    if ob.type == 'ARMATURE':
+        constraints += [con for pbo in ob.pose.bones for con in pbo.constraints]
+    return constraints
+
+
+def fbx_animations_actions_shared(scene_data, ob):
+    """
+    Whether actions of given object can be baked together, each one assigned to a temporary copy of the object
+    (see fbx_animations_actions_bake()). A copy only evaluates like the object itself when nothing else depends on
+    the action: its constraints and drivers may target the object itself (they are retargeted to the copy),
+    but nothing parented to it, its data must not be driven, and shape keys must be computed from their F-curves.
+    """
+    settings = scene_data.settings
+    # Adaptive baking evaluates frames in its own order.
+    if settings.bake_anim_adaptive and settings.bake_anim_simplify_factor != 0.0:
+        return False
+    if ob.dupli_type != 'NONE' or ob.rigid_body is not None or not fbx_animations_shapes_direct(scene_data):
+        return False
+    data_anim = getattr(ob.data, "animation_data", None)
+    if data_anim is not None and data_anim.drivers:
+        return False
+    targets = [getattr(con, prop, None) for con in _fbx_object_constraints(ob) for prop in ("target", "pole_target")]
+    if ob.animation_data is not None:
+        targets += [tgt.id for fc in ob.animation_data.drivers for var in fc.driver.variables for tgt in var.targets]
+    return not any(bid != ob and _fbx_id_follows(bid, ob) for bid in targets if bid is not None)
+
+
+def _fbx_object_copy_wrapper(ob_obj, ob_copy):
+    """
+    Return an (uncached) wrapper of given copy of an object, with the same key as the object's one, so that it
+    samples its data for the object.
+    """
+    ob_obj_copy = object.__new__(ObjectWrapper)
+    for slot in ObjectWrapper.__slots__:
+        if hasattr(ob_obj, slot):
+            setattr(ob_obj_copy, slot, getattr(ob_obj, slot))
+    ob_obj_copy.bdata = ob_copy
+    return ob_obj_copy
+
+
+def _fbx_animations_actions_sweep(scene_data, ob_obj, actions):
+    # Bake given actions in a single sweep, from temporary copies of the object, one per action.
+    scene = scene_data.scene
+    ob = ob_obj.bdata
+    copies = []
+    try:
+        for act in actions:
+            ob_copy = ob.copy()
+            copies.append(ob_copy)
+            scene.objects.link(ob_copy)
+            # Constraints and drivers of the object on itself have to target the copy instead.
+            for con in _fbx_object_constraints(ob_copy):
+                for prop in ("target", "pole_target"):
+                    if getattr(con, prop, None) == ob:
+                        setattr(con, prop, ob_copy)
+            for fc in ob_copy.animation_data.drivers:
+                for var in fc.driver.variables:
+                    for tgt in var.targets:
+                        if tgt.id == ob:
+                            tgt.id = ob_copy
+            ob_copy.animation_data.action = act
+        # New objects, update dependencies.
+        scene.update()
+
+        bakes = []
+        for act, ob_copy in zip(actions, copies):
+            frame_start, frame_end = fbx_action_frame_range(scene_data.settings, act)
+            bakes.append(fbx_animations_do_iter(scene_data, (ob, act), frame_start, frame_end, True,
+                                                objects={ob_obj}, force_keep=True,
+                                                sources={ob_obj: _fbx_object_copy_wrapper(ob_obj, ob_copy)}))
+        return fbx_animations_sweep(scene_data, bakes)
+    finally:
+        for ob_copy in copies:
+            scene.objects.unlink(ob_copy)
+            bpy.data.objects.remove(ob_copy)
+
+
+def fbx_animations_actions_bake(scene_data, ob_obj, actions):
+    """
+    Bake given actions of given object (one AnimStack each). Return the list of generated animations (None for
+    actions that do not animate anything).
+    When possible (see fbx_animations_actions_shared()), actions are assigned to temporary copies of the object,
+    and baked together by FBX_ANIM_SWEEP_ACTIONS, evaluating the scene only once per frame for all of them.
+    Otherwise, they are assigned in turn to the object, each one being baked with its own sweep over the scene.
+    """
+    ob = ob_obj.bdata  # Back to real Blender Object.
+    if len(actions) > 1 and fbx_animations_actions_shared(scene_data, ob):
+        anims = []
+        for i in range(0, len(actions), FBX_ANIM_SWEEP_ACTIONS):
+            anims += _fbx_animations_actions_sweep(scene_data, ob_obj, actions[i:i + FBX_ANIM_SWEEP_ACTIONS])
+        return anims
+
+    # We can't play with animdata and actions and get back to org state easily.
+    # So we have to add a temp copy of the object to the scene, animate it, and remove it... :/
+    ob_copy = ob.copy()
+    # Great, have to handle bones as well if needed...
+    pbones_matrices = [pbo.matrix_basis.copy() for pbo in ob.pose.bones] if ob.type == 'ARMATURE' else ...
+
+    org_act = ob.animation_data.action
+
+    anims = []
+    for act in actions:
+        ob.animation_data.action = act
+        frame_start, frame_end = fbx_action_frame_range(scene_data.settings, act)
+        anims.append(fbx_animations_do(scene_data, (ob, act), frame_start, frame_end, True,
+                                       objects={ob_obj}, force_keep=True))
+        # Ugly! :/
+        if pbones_matrices is not ...:
+            for pbo, mat in zip(ob.pose.bones, pbones_matrices):
+                pbo.matrix_basis = mat.copy()
+        ob.animation_data.action = org_act
+        _fbx_object_restore(ob, ob_copy)
+
+    if pbones_matrices is not ...:
+        for pbo, mat in zip(ob.pose.bones, pbones_matrices):
+            pbo.matrix_basis = mat.copy()
+    ob.animation_data.action = org_act
+
+    bpy.data.objects.remove(ob_copy)
+    return anims
+
+
+# Settings holding matrices, which have to be converted to plain tuples to be sent to worker processes.
+_FBX_SETTINGS_MATRICES = (
+    "global_matrix", "global_matrix_inv", "global_matrix_inv_transposed",
+    "bone_correction_matrix", "bone_correction_matrix_inv",
+)
+
+
+def _fbx_id_ref(bid):
+    return bid.name, (bid.library.filepath if bid.library else None)
+
+
+def _fbx_id_from_ref(collection, ref):
+    name, lib = ref
+    bid = collection.get(name)
+    if bid is not None and _fbx_id_ref(bid) == ref:
+        return bid
+    # Same name in another library...
+    for bid in collection:
+        if _fbx_id_ref(bid) == ref:
+            return bid
+    raise KeyError("%r not found in %r" % (ref, collection))
+
+
+def _fbx_settings_to_worker(settings):
+    vals = settings._asdict()
+    for name in _FBX_SETTINGS_MATRICES:
+        if vals[name] is not None:
+            vals[name] = tuple(tuple(row) for row in vals[name])
+    vals["report"] = None
+    vals["batch_session"] = None
+    if vals["context_objects"] is not None:
+        vals["context_objects"] = [_fbx_id_ref(ob) for ob in vals["context_objects"]]
+    vals["media_settings"] = tuple(vals["media_settings"])
+    return dict(vals)
+
+
+def _fbx_worker_report(type, message):
+    # Error output of workers is forwarded to the export report, see fbx_animations_workers().
+    print("%s: %s" % (", ".join(sorted(type)), message), file=sys.stderr)
+
+
+def _fbx_settings_from_worker(vals):
+    for name in _FBX_SETTINGS_MATRICES:
+        if vals[name] is not None:
+            vals[name] = Matrix(vals[name])
+    vals["report"] = _fbx_worker_report
+    vals["batch_session"] = batch_session_get()
+    if vals["context_objects"] is not None:
+        vals["context_objects"] = [_fbx_id_from_ref(bpy.data.objects, ref) for ref in vals["context_objects"]]
+    vals["media_settings"] = FBXExportSettingsMedia(*vals["media_settings"])
+    # Actions are baked explicitly by the worker, see fbx_animations_worker().
+    vals["bake_anim"] = False
+    return FBXExportSettingsUE4(**vals)
+
+
+# Time (in seconds) a baking worker is given to load its snapshot, plus time per action to bake, before it is
+# considered hung and killed (its actions are then baked serially).
+FBX_ANIM_WORKER_TIMEOUT_BASE = 120.0
+FBX_ANIM_WORKER_TIMEOUT_JOB = 60.0
+# Last lines of the error output of a baking worker given in the export report.
+FBX_ANIM_WORKER_LOG_LINES = 20
+
+
+def _fbx_animations_worker_report(settings, message, log_path):
+    """
+    Report an issue with a baking worker, along with the end of its error output if any.
+    """
+    try:
+        with open(log_path, 'r', encoding='utf-8', errors='replace') as f:
+            log = f.read().strip().splitlines()[-FBX_ANIM_WORKER_LOG_LINES:]
+    except OSError:
+        log = ()
+    if log:
+        message = "\n".join([message + ":"] + log)
+    print("WARNING: " + message)
+    settings.report({'WARNING'}, message)
+
+
+def _fbx_remove_files(*paths):
+    for path in paths:
+        try:
+            os.remove(path)
+        except OSError:
+            pass
+
+
+def fbx_animations_workers(scene_data, jobs):
+    """
+    Bake given (object, action) jobs in parallel, in up to settings.bake_anim_workers background Blender processes,
+    working on a snapshot of current file.
+    Return the list of baked animations matching jobs, with ... for jobs that failed or timed out (which have to
+    be baked by the caller then). Error output of failed workers is given in the export report.
+    """
+    settings = scene_data.settings
+    anims = [...] * len(jobs)
+    nbr_workers = min(settings.bake_anim_workers, len(jobs))
+    tmp_dir = tempfile.mkdtemp(prefix="fbx_bake_")
+    snapshot_path = os.path.join(tmp_dir, "snapshot.blend")
+    workers = []
+    try:
+        bpy.ops.wm.save_as_mainfile(filepath=snapshot_path, check_existing=False, copy=True)
+
+        worker_settings = _fbx_settings_to_worker(settings)
+        start_time = time.perf_counter()
+        for i in range(nbr_workers):
+            # Contiguous jobs, so that actions of a same object are baked together (see fbx_animations_worker()).
+            worker_jobs = range(i * len(jobs) // nbr_workers, (i + 1) * len(jobs) // nbr_workers)
+            job_path = os.path.join(tmp_dir, "job_%d.pickle" % i)
+            result_path = os.path.join(tmp_dir, "result_%d.pickle" % i)
+            log_path = os.path.join(tmp_dir, "log_%d.txt" % i)
+            with open(job_path, 'wb') as f:
+                pickle.dump({
+                    "settings": worker_settings,
+                    "scene": _fbx_id_ref(scene_data.scene),
+                    "jobs": [(_fbx_id_ref(jobs[j][0].bdata), _fbx_id_ref(jobs[j][1])) for j in worker_jobs],
+                }, f, pickle.HIGHEST_PROTOCOL)
+            expr = "import importlib; importlib.import_module(%r).fbx_animations_worker(%r, %r)" % (
+                __name__, job_path, result_path)
+            # Error output goes to a file rather than a pipe, a worker must never block on a full pipe.
+            with open(log_path, 'wb') as log:
+                proc = subprocess.Popen((bpy.app.binary_path, "--background", "-noaudio", snapshot_path,
+                                         "--python-expr", expr), stdout=subprocess.DEVNULL, stderr=log)
+            workers.append((worker_jobs, job_path, result_path, log_path, proc))
+
+        for worker_jobs, job_path, result_path, log_path, proc in workers:
+            deadline = start_time + FBX_ANIM_WORKER_TIMEOUT_BASE + FBX_ANIM_WORKER_TIMEOUT_JOB * len(worker_jobs)
+            try:
+                proc.wait(timeout=max(deadline - time.perf_counter(), 0.0))
+            except subprocess.TimeoutExpired:
+                proc.kill()
+                proc.wait()
+                _fbx_animations_worker_report(settings, "Animation baking worker timed out, baking its actions "
+                                                        "serially", log_path)
+                continue
+            try:
+                with open(result_path, 'rb') as f:
+                    worker_anims = pickle.load(f)
+            except Exception as e:
+                _fbx_animations_worker_report(settings, "Animation baking worker failed ({}, exit code {}), "
+                                                        "baking its actions serially".format(e, proc.returncode),
+                                              log_path)
+                continue
+            finally:
+                _fbx_remove_files(job_path, result_path)
+            if os.path.getsize(log_path):
+                _fbx_animations_worker_report(settings, "Animation baking worker reported issues", log_path)
+            for j, anim in zip(worker_jobs, worker_anims):
+                anims[j] = anim
+    except Exception as e:
+        message = "Could not bake animations in worker processes ({}), baking them serially".format(e)
+        print("WARNING: " + message)
+        settings.report({'WARNING'}, message)
+    finally:
+        # Never leave workers running behind us (e.g. if we failed while starting them), they keep their files open.
+        for _worker_jobs, _job_path, _result_path, _log_path, proc in workers:
+            if proc.poll() is None:
+                proc.kill()
+                proc.wait()
+        _fbx_remove_files(snapshot_path)
+        shutil.rmtree(tmp_dir, ignore_errors=True)
+        if os.path.exists(tmp_dir):
+            print("WARNING: could not remove temporary animation baking directory {}".format(tmp_dir))
+    return anims
+
+
+def fbx_animations_worker(job_path, result_path):
+    """
+    Entry point of background Blender processes started by fbx_animations_workers().
+    """
+    with open(job_path, 'rb') as f:
+        job = pickle.load(f)
+
+    ObjectWrapper.cache_clear()
+    scene = _fbx_id_from_ref(bpy.data.scenes, job["scene"])
+    settings = _fbx_settings_from_worker(job["settings"])
+    scene_data = fbx_data_from_scene(scene, settings)
+
+    # Actions of a same object are baked together.
+    ob_jobs = OrderedDict()
+    for idx, (ob_ref, act_ref) in enumerate(job["jobs"]):
+        ob_jobs.setdefault(ob_ref, []).append((idx, act_ref))
+    anims = [None] * len(job["jobs"])
+    for ob_ref, act_jobs in ob_jobs.items():
+        ob_obj = ObjectWrapper(_fbx_id_from_ref(bpy.data.objects, ob_ref))
+        actions = [_fbx_id_from_ref(bpy.data.actions, act_ref) for _idx, act_ref in act_jobs]
+        for (idx, _act_ref), anim in zip(act_jobs, fbx_animations_actions_bake(scene_data, ob_obj, actions)):
+            anims[idx] = anim
+
+    fbx_scene_data_cleanup(scene_data)
+    ObjectWrapper.cache_clear()
+
+    # An incomplete result file must never be read by the parent process.
+    with open(result_path + ".tmp", 'wb') as f:
+        pickle.dump(anims, f, pickle.HIGHEST_PROTOCOL)
+    os.replace(result_path + ".tmp", result_path)
+
+
+# ##### Baked animations cache. #####
+
+class _FBXAnimCacheHasher:
+    """
+    Feed everything a bake depends on into a hash. Other IDs the baked data depends on (parents, constraints
+    and drivers targets) are only accepted if they are not animated themselves, in which case their current
+    state is hashed as well; otherwise the bake is not cacheable.
+    """
+    __slots__ = ("hash", "owners", "cacheable")
+
+    def __init__(self, owners):
+        self.hash = hashlib.sha1()
+        self.owners = set(owners)  # IDs whose data is hashed explicitly.
+        self.cacheable = True
+
+    @staticmethod
+    def _plain(val):
+        if isinstance(val, Matrix):
+            return tuple(tuple(row) for row in val)
+        if isinstance(val, (Vector, Quaternion, Euler)):
+            return tuple(val)
+        if isinstance(val, bpy.types.ID):
+            return _fbx_id_ref(val)
+        if isinstance(val, (set, frozenset)):
+            return tuple(sorted(val))
+        # ID properties: reprs of groups hold memory addresses, and reprs of arrays do not show their values.
+        if hasattr(val, "to_dict"):
+            val = val.to_dict()
+        elif hasattr(val, "to_list"):
+            val = val.to_list()
+        if isinstance(val, dict):
+            return tuple((k, _FBXAnimCacheHasher._plain(v)) for k, v in sorted(val.items()))
+        if isinstance(val, (str, bytes)) or not hasattr(val, "__len__"):
+            return val
+        return tuple(_FBXAnimCacheHasher._plain(v) for v in val)
+
+    def feed(self, *vals):
+        self.hash.update(repr(self._plain(vals)).encode())
+
+    def rna(self, struct):
+        # All plain properties of given struct, and its references to other IDs.
+        for prop in struct.bl_rna.properties:
+            pid = prop.identifier
+            if pid == "rna_type" or prop.type == 'COLLECTION':
+                continue
+            val = getattr(struct, pid, None)
+            if prop.type == 'POINTER':
+                if not isinstance(val, bpy.types.ID):
+                    continue
+                self.external(val)
+            self.feed(pid, val)
+
+    def custom_props(self, bid):
+        self.feed(sorted(bid.items()))
+
+    def external(self, bid, data_path=None):
+        if bid is None or bid in self.owners:
+            return
+        anim_data = getattr(bid, "animation_data", None)
+        if anim_data is not None and (anim_data.action or anim_data.drivers or anim_data.nla_tracks):
+            self.cacheable = False
+            return
+        if isinstance(bid, bpy.types.Object):
+            if bid.parent is not None or bid.constraints:
+                self.cacheable = False
+                return
+            self.feed(_fbx_id_ref(bid), bid.matrix_world)
+            if bid.type == 'ARMATURE':
+                self.feed([pbo.matrix for pbo in bid.pose.bones])
+        if data_path:
+            try:
+                self.feed(_fbx_id_ref(bid), data_path, bid.path_resolve(data_path))
+            except ValueError:
+                self.cacheable = False
+
+    def fcurve(self, fc):
+        kps = fc.keyframe_points
+        co = array.array(data_types.ARRAY_FLOAT32, (0.0,)) * (len(kps) * 2)
+        hl = array.array(data_types.ARRAY_FLOAT32, (0.0,)) * (len(kps) * 2)
+        hr = array.array(data_types.ARRAY_FLOAT32, (0.0,)) * (len(kps) * 2)
+        kps.foreach_get("co", co)
+        kps.foreach_get("handle_left", hl)
+        kps.foreach_get("handle_right", hr)
+        self.feed(fc.data_path, fc.array_index, fc.mute, fc.group is not None and fc.group.mute, fc.extrapolation)
+        self.hash.update(co.tobytes())
+        self.hash.update(hl.tobytes())
+        self.hash.update(hr.tobytes())
+        self.feed([(kp.interpolation, kp.easing, kp.back, kp.amplitude, kp.period) for kp in kps])
+        for mod in fc.modifiers:
+            self.rna(mod)
+
+    def action(self, act):
+        self.feed(_fbx_id_ref(act))
+        for fc in act.fcurves:
+            self.fcurve(fc)
+
+    def constraints(self, constraints):
+        for con in constraints:
+            self.rna(con)
+
+    def anim_data(self, bid):
+        anim_data = bid.animation_data
+        if anim_data is None:
+            self.feed(None)
+            return
+        self.feed(anim_data.action_blend_type, anim_data.action_extrapolation, anim_data.action_influence,
+                  anim_data.use_nla)
+        # Assigned action is evaluated along NLA tracks, and may be read by drivers.
+        if anim_data.action is not None:
+            self.action(anim_data.action)
+        else:
+            self.feed(None)
+        for track in anim_data.nla_tracks:
+            self.feed(track.name, track.mute, track.is_solo)
+            for strip in track.strips:
+                self.rna(strip)
+                if strip.action is not None:
+                    self.action(strip.action)
+        for fc in anim_data.drivers:
+            self.fcurve(fc)
+            driver = fc.driver
+            self.feed(driver.type, driver.expression, driver.use_self)
+            for var in driver.variables:
+                self.feed(var.name, var.type)
+                for tgt in var.targets:
+                    self.feed(_fbx_id_ref(tgt.id) if tgt.id is not None else None, tgt.data_path, tgt.bone_target,
+                              tgt.transform_type, tgt.transform_space)
+                    self.external(tgt.id, tgt.data_path if var.type == 'SINGLE_PROP' else None)
+
+
+class FBXAnimationsCache:
+    """
+    On-disk cache of baked actions (as generated by fbx_animations_do()), so that re-exporting unchanged actions
+    does not bake them again. Entries are keyed by a hash of the action F-curves, the object and its rig
+    (rest pose, constraints, drivers), the shape keys animations baked along, and the bake settings.
+    Entries only hold plain data (marshalled tuples, lists, strings, numbers, and keyframes as raw float64 bytes),
+    so loading one never runs code.
+    """
+    __slots__ = ("cache_dir", "hits", "misses")
+
+    VERSION = 2  # Bump when baked data layout changes!
+    SETTINGS = (
+        "to_axes", "global_matrix", "global_scale", "apply_unit_scale", "unit_scale", "bake_space_transform",
+        "object_types", "armature_nodetype", "use_armature_deform_only", "add_leaf_bones", "bone_correction_matrix",
+        "bake_anim_use_all_bones", "bake_anim_step", "bake_anim_simplify_factor", "bake_anim_force_startend_keying",
+        "bake_anim_adaptive",
+    )
+
+    def __init__(self, cache_dir):
+        self.cache_dir = cache_dir
+        self.hits = self.misses = 0
+
+    def key(self, scene_data, ob_obj, act, f_start, f_end):
+        """
+        Return the cache key of given action baked on given object over given frame range, or None if that bake
+        cannot be cached.
+        """
+        settings = scene_data.settings
+        scene = scene_data.scene
+        ob = ob_obj.bdata
+        if ob.dupli_type != 'NONE':
+            return None
+
+        shape_keys = [me.shape_keys for me in scene_data.data_deformers_shape]
+        hasher = _FBXAnimCacheHasher([ob, ob.data] + shape_keys)
+        feed = hasher.feed
+
+        feed(self.VERSION, [getattr(settings, name) for name in self.SETTINGS])
+        feed(_fbx_id_ref(scene), scene.render.fps, scene.render.fps_base, f_start, f_end)
+        feed([o.key for o in fbx_animations_objects(scene_data, {ob_obj})])
+        hasher.action(act)
+
+        # The object.
+        feed(_fbx_id_ref(ob), ob.type, ob.rotation_mode, ob.matrix_basis, ob.matrix_parent_inverse,
+             ob.delta_location, ob.delta_rotation_euler, ob.delta_rotation_quaternion, ob.delta_scale,
+             ob.parent_type, ob.parent_bone)
+        hasher.external(ob.parent)
+        hasher.custom_props(ob)
+        hasher.constraints(ob.constraints)
+        hasher.anim_data(ob)
+
+        # Its rig, rest pose and current pose (for non-animated channels).
+        if ob.type == 'ARMATURE':
+            arm = ob.data
+            for bo in arm.bones:
+                feed(bo.name, bo.parent.name if bo.parent else None, bo.matrix_local, bo.use_connect,
+                     bo.use_inherit_rotation, bo.use_inherit_scale, bo.use_local_location, bo.use_deform)
+            for pbo in ob.pose.bones:
+                feed(pbo.name, pbo.rotation_mode, pbo.matrix_basis)
+                hasher.custom_props(pbo)
+                hasher.constraints(pbo.constraints)
+            hasher.anim_data(arm)
+
+        # Shape keys of all meshes are baked along each action.
+        for me, (me_key, _shapes_key, shapes) in scene_data.data_deformers_shape.items():
+            key = me.shape_keys
+            feed(me_key, key.use_relative)
+            for shape in key.key_blocks:
+                feed(shape.name, shape.relative_key.name, shape.value, shape.mute, shape.slider_min,
+                     shape.slider_max, shape.vertex_group, shape.interpolation)
+            hasher.anim_data(key)
+
+        return hasher.hash.hexdigest() if hasher.cacheable else None
+
+    def _path(self, key):
+        return os.path.join(self.cache_dir, key + ".fbxanim")
+
+    @staticmethod
+    def to_plain(anim):
+        """
+        Convert a baked animation to plain data: OrderedDicts become lists of (key, ...) tuples (order matters),
+        keyframes arrays become bytes.
+        """
+        astack_key, animations, alayer_key, name, f_start, f_end = anim
+        return (astack_key, [
+            (obj_key, dummy_key, [
+                (fbx_group, group_key, [
+                    (fbx_item, curve_key, def_val, frames.tobytes(), values.tobytes(), write)
+                    for fbx_item, (curve_key, def_val, (frames, values), write) in group.items()
+                ], fbx_gname)
+                for fbx_group, (group_key, group, fbx_gname) in groups.items()
+            ])
+            for obj_key, (dummy_key, groups) in animations.items()
+        ], alayer_key, name, f_start, f_end)
+
+    @staticmethod
+    def from_plain(plain):
+        """
+        Inverse of to_plain().
+        """
+        def keys(data):
+            arr = array.array(data_types.ARRAY_FLOAT64)
+            arr.frombytes(data)
+            return arr
+
+        astack_key, animations, alayer_key, name, f_start, f_end = plain
+        return (astack_key, OrderedDict(
+            (obj_key, (dummy_key, OrderedDict(
+                (fbx_group, (group_key, OrderedDict(
+                    (fbx_item, (curve_key, def_val, (keys(frames), keys(values)), write))
+                    for fbx_item, curve_key, def_val, frames, values, write in group
+                ), fbx_gname))
+                for fbx_group, group_key, group, fbx_gname in groups
+            )))
+            for obj_key, dummy_key, groups in animations
+        ), alayer_key, name, f_start, f_end)
+
+    def get(self, key):
+        """
+        Return baked animation stored under given key, or ... if there is none.
+        """
+        try:
+            with open(self._path(key), 'rb') as f:
+                anim = self.from_plain(marshal.load(f))
+        except FileNotFoundError:
+            self.misses += 1
+            return ...
+        except Exception as e:
+            print("WARNING: invalid baked animation cache entry {} ({})".format(self._path(key), e))
+            self.misses += 1
+            return ...
+        self.hits += 1
+        return anim
+
+    def set(self, key, anim):
+        path = self._path(key)
+        # Another export may read the cache concurrently, never leave incomplete entries around.
+        tmp_path = "%s.%d.tmp" % (path, os.getpid())
+        try:
+            os.makedirs(self.cache_dir, exist_ok=True)
+            with open(tmp_path, 'wb') as f:
+                marshal.dump(self.to_plain(anim), f)
+            os.replace(tmp_path, path)
+        except (OSError, ValueError) as e:
+            print("WARNING: could not write baked animation cache entry {} ({})".format(path, e))
+            try:
+                os.remove(tmp_path)
+            except OSError:
+                pass
+
+
 def fbx_animations(scene_data):
     """
     Generate global animation data from objects.
@@ -2042,25 +4104,20 @@ def fbx_animations(scene_data):
                     return False  # Invalid.
             return True  # Valid.
 
-        def restore_object(ob_to, ob_from):
-            # Restore org state of object (ugh :/ ).
-            props = (
-                'location', 'rotation_quaternion', 'rotation_axis_angle', 'rotation_euler', 'rotation_mode', 'scale',
-                'delta_location', 'delta_rotation_euler', 'delta_rotation_quaternion', 'delta_scale',
-                'lock_location', 'lock_rotation', 'lock_rotation_w', 'lock_rotations_4d', 'lock_scale',
-                'tag', 'layers', 'select', 'track_axis', 'up_axis', 'active_material', 'active_material_index',
-                'matrix_parent_inverse', 'empty_draw_type', 'empty_draw_size', 'empty_image_offset', 'pass_index',
-                'color', 'hide', 'hide_select', 'hide_render', 'use_slow_parent', 'slow_parent_offset',
-                'use_extra_recalc_object', 'use_extra_recalc_data', 'dupli_type', 'use_dupli_frames_speed',
-                'use_dupli_vertices_rotation', 'use_dupli_faces_scale', 'dupli_faces_scale', 'dupli_group',
-                'dupli_frames_start', 'dupli_frames_end', 'dupli_frames_on', 'dupli_frames_off',
-                'draw_type', 'show_bounds', 'draw_bounds_type', 'show_name', 'show_axis', 'show_texture_space',
-                'show_wire', 'show_all_edges', 'show_transparent', 'show_x_ray',
-                'show_only_shape_key', 'use_shape_key_edit_mode', 'active_shape_key_index',
-            )
-            for p in props:
-                if not ob_to.is_property_readonly(p):
-                    setattr(ob_to, p, getattr(ob_from, p))
+        # Actions needing a scene evaluation, to be baked by worker processes (if enabled).
+        worker_jobs = [] if scene_data.settings.bake_anim_workers > 1 else None
+
+        # Actions baked by previous exports are re-used as-is, when nothing they depend on has changed.
+        cache = None
+        cache_keys = {}
+        if scene_data.settings.bake_anim_cache_dir:
+            cache = FBXAnimationsCache(scene_data.settings.bake_anim_cache_dir)
+
+        def add_action_anim(animations, animated, ob_obj, act, anim):
+            add_anim(animations, animated, anim)
+            cache_key = cache_keys.get((ob_obj, act))
+            if cache_key is not None:
+                cache.set(cache_key, anim)
 
         for ob_obj in scene_data.objects:
             # Actions only for objects, not bones!
@@ -2075,38 +4132,62 @@ def fbx_animations(scene_data):
             if ob.animation_data.is_property_readonly('action'):
                 continue  # Cannot re-assign 'active action' to this object (usually related to NLA usage, see T48089).
 
-            # We can't play with animdata and actions and get back to org state easily.
-            # So we have to add a temp copy of the object to the scene, animate it, and remove it... :/
-            ob_copy = ob.copy()
-            # Great, have to handle bones as well if needed...
-            pbones_matrices = [pbo.matrix_basis.copy() for pbo in ob.pose.bones] if ob.type == 'ARMATURE' else ...
-
             org_act = ob.animation_data.action
             path_resolve = ob.path_resolve
 
-            for act in bpy.data.actions:
-                # For now, *all* paths in the action must be valid for the object, to validate the action.
-                # Unless that action was already assigned to the object!
-                if act != org_act and not validate_actions(act, path_resolve):
-                    continue
-                ob.animation_data.action = act
-                frame_start, frame_end = act.frame_range  # sic!
-                add_anim(animations, animated,
-                         fbx_animations_do(scene_data, (ob, act), frame_start, frame_end, True,
-                                           objects={ob_obj}, force_keep=True))
-                # Ugly! :/
-                if pbones_matrices is not ...:
-                    for pbo, mat in zip(ob.pose.bones, pbones_matrices):
-                        pbo.matrix_basis = mat.copy()
-                ob.animation_data.action = org_act
-                restore_object(ob, ob_copy)
-
-            if pbones_matrices is not ...:
-                for pbo, mat in zip(ob.pose.bones, pbones_matrices):
-                    pbo.matrix_basis = mat.copy()
-            ob.animation_data.action = org_act
-
-            bpy.data.objects.remove(ob_copy)
+            # For now, *all* paths in the action must be valid for the object, to validate the action.
+            # Unless that action was already assigned to the object!
+            actions = [act for act in bpy.data.actions if act == org_act or validate_actions(act, path_resolve)]
+
+            if cache is not None:
+                to_bake = []
+                for act in actions:
+                    cache_key = cache.key(scene_data, ob_obj, act, *fbx_action_frame_range(scene_data.settings, act))
+                    anim = ... if cache_key is None else cache.get(cache_key)
+                    if anim is ...:
+                        cache_keys[(ob_obj, act)] = cache_key
+                        to_bake.append(act)
+                    else:
+                        add_anim(animations, animated, anim)
+                actions = to_bake
+
+            # If the object (and its bones) transforms, and shape keys values, only depend on their F-curves,
+            # all actions are evaluated directly, re-using the same per-object data, and without assigning them
+            # to the object.
+            direct_tx = None
+            if fbx_animations_shapes_direct(scene_data):
+                direct_tx = fbx_animations_direct_transforms(scene_data, fbx_animations_objects(scene_data, {ob_obj}))
+
+            if direct_tx is not None:
+                for act in actions:
+                    fcurves = _fbx_action_fcurves(act)
+                    for tx in direct_tx.values():
+                        tx.set_fcurves(fcurves)
+                    frame_start, frame_end = fbx_action_frame_range(scene_data.settings, act)
+                    add_action_anim(animations, animated, ob_obj, act,
+                                    fbx_animations_do(scene_data, (ob, act), frame_start, frame_end, True,
+                                                      objects={ob_obj}, force_keep=True, direct_tx=direct_tx))
+            elif worker_jobs is not None:
+                worker_jobs.extend((ob_obj, act) for act in actions)
+            else:
+                for act, anim in zip(actions, fbx_animations_actions_bake(scene_data, ob_obj, actions)):
+                    add_action_anim(animations, animated, ob_obj, act, anim)
+
+        if worker_jobs:
+            anims = fbx_animations_workers(scene_data, worker_jobs) if len(worker_jobs) > 1 else [...]
+            # Jobs that failed in workers are baked here instead.
+            failed_jobs = OrderedDict()
+            for (ob_obj, act), anim in zip(worker_jobs, anims):
+                if anim is ...:
+                    failed_jobs.setdefault(ob_obj, []).append(act)
+                else:
+                    add_action_anim(animations, animated, ob_obj, act, anim)
+            for ob_obj, actions in failed_jobs.items():
+                for act, anim in zip(actions, fbx_animations_actions_bake(scene_data, ob_obj, actions)):
+                    add_action_anim(animations, animated, ob_obj, act, anim)
+
+        if cache is not None and (cache.hits or cache.misses):
+            print("    baked actions cache: %d re-used, %d baked" % (cache.hits, cache.misses))
 
     # Global (containing everything) animstack, only if not exporting NLA strips and/or all actions.
     if not scene_data.settings.bake_anim_use_nla_strips and not scene_data.settings.bake_anim_use_all_actions:
@@ -2204,14 +4285,21 @@ def fbx_data_from_scene(scene, settings):
         if org_ob_obj is not None:
             data_meshes[org_ob_obj] = data_meshes[ob_obj]
 
+    # Geometry of collision objects is stripped, it cannot be shared with other objects using the same mesh.
+    for ob_obj, (me_key, me, free) in data_meshes.items():
+        if fbx_is_collision_object(ob_obj):
+            data_meshes[ob_obj] = (get_blender_collision_mesh_key(me_key), me, free)
+
     perfmon.step("FBX export prepare: Wrapping ShapeKeys...")
 
     # ShapeKeys.
     data_deformers_shape = OrderedDict()
     geom_mat_co = settings.global_matrix if settings.bake_space_transform else None
-    for me_key, me, _free in data_meshes.values():
+    for ob_obj, (me_key, me, _free) in data_meshes.items():
         if not (me.shape_keys and len(me.shape_keys.key_blocks) > 1):  # We do not want basis-only relative skeys...
             continue
+        if fbx_is_collision_object(ob_obj):
+            continue
         if me in data_deformers_shape:
             continue
 
@@ -2253,11 +4341,12 @@ def fbx_data_from_scene(scene, settings):
     data_deformers_skin = OrderedDict()
     data_bones = OrderedDict()
     arm_parents = set()
+    arm_deformed = fbx_armature_deformed_objects(objects)
     for ob_obj in tuple(objects):
         if not (ob_obj.is_object and ob_obj.type in {'ARMATURE'}):
             continue
         fbx_skeleton_from_armature(scene, settings, ob_obj, objects, data_meshes,
-                                   data_bones, data_deformers_skin, data_empties, arm_parents)
+                                   data_bones, data_deformers_skin, data_empties, arm_parents, arm_deformed)
 
     # Generate leaf bones
     data_leaf_bones = []
@@ -2280,6 +4369,8 @@ def fbx_data_from_scene(scene, settings):
     #       XXX However, material indices would probably break...
     data_materials = OrderedDict()
     for ob_obj in objects:
+        if fbx_is_collision_object(ob_obj):
+            continue
         # If obj is not a valid object for materials, wrapper will just return an empty tuple...
         for mat_s in ob_obj.material_slots:
             mat = mat_s.material
@@ -2303,26 +4394,14 @@ def fbx_data_from_scene(scene, settings):
     # FbxVideo also used to store static images...
     data_videos = OrderedDict()
     # For now, do not use world textures, don't think they can be linked to anything FBX wise...
+    mats_cache = settings.batch_session["materials"]
     for mat in data_materials.keys():
         if check_skip_material(mat):
             continue
-        for tex, use_tex in zip(mat.texture_slots, mat.use_textures):
-            if tex is None or tex.texture is None or not use_tex:
-                continue
-            # For now, only consider image textures.
-            # Note FBX does has support for procedural, but this is not portable at all (opaque blob),
-            # so not useful for us.
-            # TODO I think ENVIRONMENT_MAP should be usable in FBX as well, but for now let it aside.
-            # if tex.texture.type not in {'IMAGE', 'ENVIRONMENT_MAP'}:
-            if tex.texture.type not in {'IMAGE'}:
-                continue
-            img = tex.texture.image
-            if img is None:
-                continue
-            # Find out whether we can actually use this texture for this material, in FBX context.
-            tex_fbx_props = fbx_mat_properties_from_texture(tex)
-            if not tex_fbx_props:
-                continue
+        mat_texs = mats_cache.get(mat)
+        if mat_texs is None:
+            mat_texs = mats_cache[mat] = fbx_mat_textures(mat)
+        for tex, img, tex_fbx_props in mat_texs:
             tex_data = data_textures.get(tex)
             if tex_data is not None:
                 tex_data[1][mat] = tex_fbx_props
@@ -2419,8 +4498,8 @@ def fbx_data_from_scene(scene, settings):
             for _alayer_key, alayer in astack.values():
                 for _acnode_key, acnode, _acnode_name in alayer.values():
                     nbr_acnodes += 1
-                    for _acurve_key, _dval, acurve, acurve_valid in acnode.values():
-                        if acurve:
+                    for _acurve_key, _dval, (frames, _values), acurve_valid in acnode.values():
+                        if frames:
                             nbr_acurves += 1
 
         templates[b"AnimationStack"] = fbx_template_def_animstack(scene, settings, nbr_users=nbr_astacks)
@@ -2436,7 +4515,7 @@ def fbx_data_from_scene(scene, settings):
 
     perfmon.step("FBX export prepare: Generating Connections...")
 
-    connections = []
+    connections = FBXConnections()
 
     # Objects (with classical parenting).
     for ob_obj in objects:
@@ -2445,50 +4524,50 @@ def fbx_data_from_scene(scene, settings):
             par_obj = ob_obj.parent
             # Meshes parented to armature are handled separately, yet we want the 'no parent' connection (0).
             if par_obj and ob_obj.has_valid_parent(objects) and (par_obj, ob_obj) not in arm_parents:
-                connections.append((b"OO", ob_obj.fbx_uuid, par_obj.fbx_uuid, None))
+                connections.add(b"OO", ob_obj.fbx_uuid, par_obj.fbx_uuid, None)
             else:
-                connections.append((b"OO", ob_obj.fbx_uuid, 0, None))
+                connections.add(b"OO", ob_obj.fbx_uuid, 0, None)
 
     # Armature & Bone chains.
     for bo_obj in data_bones.keys():
         par_obj = bo_obj.parent
         if par_obj not in objects:
             continue
-        connections.append((b"OO", bo_obj.fbx_uuid, par_obj.fbx_uuid, None))
+        connections.add(b"OO", bo_obj.fbx_uuid, par_obj.fbx_uuid, None)
 
     # Object data.
     for ob_obj in objects:
         if ob_obj.is_bone:
             bo_data_key = data_bones[ob_obj]
-            connections.append((b"OO", get_fbx_uuid_from_key(bo_data_key), ob_obj.fbx_uuid, None))
+            connections.add(b"OO", get_fbx_uuid_from_key(bo_data_key), ob_obj.fbx_uuid, None)
         else:
             if ob_obj.type == 'LAMP':
                 lamp_key = data_lamps[ob_obj.bdata.data]
-                connections.append((b"OO", get_fbx_uuid_from_key(lamp_key), ob_obj.fbx_uuid, None))
+                connections.add(b"OO", get_fbx_uuid_from_key(lamp_key), ob_obj.fbx_uuid, None)
             elif ob_obj.type == 'CAMERA':
                 cam_key = data_cameras[ob_obj]
-                connections.append((b"OO", get_fbx_uuid_from_key(cam_key), ob_obj.fbx_uuid, None))
+                connections.add(b"OO", get_fbx_uuid_from_key(cam_key), ob_obj.fbx_uuid, None)
             elif ob_obj.type == 'EMPTY' or ob_obj.type == 'ARMATURE':
                 empty_key = data_empties[ob_obj]
-                connections.append((b"OO", get_fbx_uuid_from_key(empty_key), ob_obj.fbx_uuid, None))
+                connections.add(b"OO", get_fbx_uuid_from_key(empty_key), ob_obj.fbx_uuid, None)
             elif ob_obj.type in BLENDER_OBJECT_TYPES_MESHLIKE:
                 mesh_key, _me, _free = data_meshes[ob_obj]
-                connections.append((b"OO", get_fbx_uuid_from_key(mesh_key), ob_obj.fbx_uuid, None))
+                connections.add(b"OO", get_fbx_uuid_from_key(mesh_key), ob_obj.fbx_uuid, None)
 
     # Leaf Bones
     for (_node_name, par_uuid, node_uuid, attr_uuid, _matrix, _hide, _size) in data_leaf_bones:
-        connections.append((b"OO", node_uuid, par_uuid, None))
-        connections.append((b"OO", attr_uuid, node_uuid, None))
+        connections.add(b"OO", node_uuid, par_uuid, None)
+        connections.add(b"OO", attr_uuid, node_uuid, None)
 
     # 'Shape' deformers (shape keys, only for meshes currently)...
     for me_key, shapes_key, shapes in data_deformers_shape.values():
         # shape -> geometry
-        connections.append((b"OO", get_fbx_uuid_from_key(shapes_key), get_fbx_uuid_from_key(me_key), None))
+        connections.add(b"OO", get_fbx_uuid_from_key(shapes_key), get_fbx_uuid_from_key(me_key), None)
         for channel_key, geom_key, _shape_verts_co, _shape_verts_idx in shapes.values():
             # shape channel -> shape
-            connections.append((b"OO", get_fbx_uuid_from_key(channel_key), get_fbx_uuid_from_key(shapes_key), None))
+            connections.add(b"OO", get_fbx_uuid_from_key(channel_key), get_fbx_uuid_from_key(shapes_key), None)
             # geometry (keys) -> shape channel
-            connections.append((b"OO", get_fbx_uuid_from_key(geom_key), get_fbx_uuid_from_key(channel_key), None))
+            connections.add(b"OO", get_fbx_uuid_from_key(geom_key), get_fbx_uuid_from_key(channel_key), None)
 
     # 'Skin' deformers (armature-to-geometry, only for meshes currently)...
     for arm, deformed_meshes in data_deformers_skin.items():
@@ -2496,19 +4575,19 @@ def fbx_data_from_scene(scene, settings):
             # skin -> geometry
             mesh_key, _me, _free = data_meshes[ob_obj]
             assert(me == _me)
-            connections.append((b"OO", get_fbx_uuid_from_key(skin_key), get_fbx_uuid_from_key(mesh_key), None))
+            connections.add(b"OO", get_fbx_uuid_from_key(skin_key), get_fbx_uuid_from_key(mesh_key), None)
             for bo_obj, clstr_key in clusters.items():
                 # cluster -> skin
-                connections.append((b"OO", get_fbx_uuid_from_key(clstr_key), get_fbx_uuid_from_key(skin_key), None))
+                connections.add(b"OO", get_fbx_uuid_from_key(clstr_key), get_fbx_uuid_from_key(skin_key), None)
                 # bone -> cluster
-                connections.append((b"OO", bo_obj.fbx_uuid, get_fbx_uuid_from_key(clstr_key), None))
+                connections.add(b"OO", bo_obj.fbx_uuid, get_fbx_uuid_from_key(clstr_key), None)
 
     # Materials
     mesh_mat_indices = OrderedDict()
     _objs_indices = {}
     for mat, (mat_key, ob_objs) in data_materials.items():
         for ob_obj in ob_objs:
-            connections.append((b"OO", get_fbx_uuid_from_key(mat_key), ob_obj.fbx_uuid, None))
+            connections.add(b"OO", get_fbx_uuid_from_key(mat_key), ob_obj.fbx_uuid, None)
             # Get index of this mat for this object (or dupliobject).
             # Mat indices for mesh faces are determined by their order in 'mat to ob' connections.
             # Only mats for meshes currently...
@@ -2527,13 +4606,13 @@ def fbx_data_from_scene(scene, settings):
             mat_key, _ob_objs = data_materials[mat]
             for fbx_prop in fbx_mat_props:
                 # texture -> material properties
-                connections.append((b"OP", get_fbx_uuid_from_key(tex_key), get_fbx_uuid_from_key(mat_key), fbx_prop))
+                connections.add(b"OP", get_fbx_uuid_from_key(tex_key), get_fbx_uuid_from_key(mat_key), fbx_prop)
 
     # Images
     for vid, (vid_key, texs) in data_videos.items():
         for tex in texs:
             tex_key, _texs = data_textures[tex]
-            connections.append((b"OO", get_fbx_uuid_from_key(vid_key), get_fbx_uuid_from_key(tex_key), None))
+            connections.add(b"OO", get_fbx_uuid_from_key(vid_key), get_fbx_uuid_from_key(tex_key), None)
 
     # Animations
     for astack_key, astack, alayer_key, _name, _fstart, _fend in animations:
@@ -2541,22 +4620,22 @@ def fbx_data_from_scene(scene, settings):
         astack_id = get_fbx_uuid_from_key(astack_key)
         # For now, only one layer!
         alayer_id = get_fbx_uuid_from_key(alayer_key)
-        connections.append((b"OO", alayer_id, astack_id, None))
+        connections.add(b"OO", alayer_id, astack_id, None)
         for elem_key, (alayer_key, acurvenodes) in astack.items():
             elem_id = get_fbx_uuid_from_key(elem_key)
             # Animlayer -> animstack.
             # alayer_id = get_fbx_uuid_from_key(alayer_key)
-            # connections.append((b"OO", alayer_id, astack_id, None))
+            # connections.add(b"OO", alayer_id, astack_id, None)
             for fbx_prop, (acurvenode_key, acurves, acurvenode_name) in acurvenodes.items():
                 # Animcurvenode -> animalayer.
                 acurvenode_id = get_fbx_uuid_from_key(acurvenode_key)
-                connections.append((b"OO", acurvenode_id, alayer_id, None))
+                connections.add(b"OO", acurvenode_id, alayer_id, None)
                 # Animcurvenode -> object property.
-                connections.append((b"OP", acurvenode_id, elem_id, fbx_prop.encode()))
-                for fbx_item, (acurve_key, default_value, acurve, acurve_valid) in acurves.items():
-                    if acurve:
+                connections.add(b"OP", acurvenode_id, elem_id, fbx_prop.encode())
+                for fbx_item, (acurve_key, default_value, (frames, _values), acurve_valid) in acurves.items():
+                    if frames:
                         # Animcurve -> Animcurvenode.
-                        connections.append((b"OP", get_fbx_uuid_from_key(acurve_key), acurvenode_id, fbx_item.encode()))
+                        connections.add(b"OP", get_fbx_uuid_from_key(acurve_key), acurvenode_id, fbx_item.encode())
 
     perfmon.level_down()
 
@@ -2836,10 +4915,7 @@ def fbx_connections_elements(root, scene_data):
     """
     Relations between Objects (which material uses which texture, and so on).
     """
-    connections = elem_empty(root, b"Connections")
-
-    for c in scene_data.connections:
-        elem_connection(connections, *c)
+    root.elems.append(FBXElemConnections(b"Connections", scene_data.connections))
 
 
 def fbx_takes_elements(root, scene_data):
@@ -2899,6 +4975,13 @@ def save_single(operator, scene, filepath="",
                 use_custom_props=False,
                 bake_space_transform=False,
                 armature_nodetype='NULL',
+                use_media_hardlinks=False,
+                use_ue4_lean=False,
+                bake_anim_workers=0,
+                bake_anim_action_pad_pre=0.0,
+                bake_anim_action_pad_post=0.0,
+                bake_anim_cache_dir=None,
+                bake_anim_adaptive=False,
                 **kwargs
                 ):
 
@@ -2957,7 +5040,7 @@ def save_single(operator, scene, filepath="",
         set(),  # embedded_set
     )
 
-    settings = FBXExportSettings(
+    settings = FBXExportSettingsUE4(
         operator.report, (axis_up, axis_forward), global_matrix, global_scale, apply_unit_scale, unit_scale,
         bake_space_transform, global_matrix_inv, global_matrix_inv_transposed,
         context_objects, object_types, use_mesh_modifiers, use_mesh_modifiers_render,
@@ -2967,6 +5050,8 @@ def save_single(operator, scene, filepath="",
         bake_anim, bake_anim_use_all_bones, bake_anim_use_nla_strips, bake_anim_use_all_actions,
         bake_anim_step, bake_anim_simplify_factor, bake_anim_force_startend_keying,
         False, media_settings, use_custom_props,
+        batch_session_get(), use_ue4_lean, bake_anim_workers,
+        bake_anim_action_pad_pre, bake_anim_action_pad_post, bake_anim_cache_dir, bake_anim_adaptive,
     )
 
     import bpy_extras.io_utils
@@ -3009,9 +5094,14 @@ def save_single(operator, scene, filepath="",
 
     # copy all collected files, if we did not embed them.
     if not media_settings.embed_textures:
-        bpy_extras.io_utils.path_reference_copy(media_settings.copy_set)
-
-    print('export finished in %.4f sec.' % (time.process_time() - start_time))
+        media_copier = settings.batch_session["media_copier"]
+        media_copier.copy(media_settings.copy_set, use_media_hardlinks)
+        # In batch exports, copies are done in the background, and waited for by batch_session_end().
+        if settings.batch_session is not _batch_session:
+            media_copier.finish()
+
+    print('export finished in %.4f sec., %.1f KiB written.' % (time.process_time() - start_time,
+                                                              os.path.getsize(filepath) / 1024))
     return {'FINISHED'}
 
 
@@ -3101,59 +5191,68 @@ def save(operator, context,
         # orig_sce = context.scene
 
         new_fbxpath = fbxpath  # own dir option modifies, we need to keep an original
-        for data in data_seq:  # scene or group
-            newname = "_".join((prefix, bpy.path.clean_name(data.name))) if prefix else bpy.path.clean_name(data.name)
-
-            if use_batch_own_dir:
-                new_fbxpath = os.path.join(fbxpath, newname)
-                # path may already exist
-                # TODO - might exist but be a file. unlikely but should probably account for it.
-
-                if not os.path.exists(new_fbxpath):
-                    os.makedirs(new_fbxpath)
-
-            filepath = os.path.join(new_fbxpath, newname + '.fbx')
-
-            print('\nBatch exporting %s as...\n\t%r' % (data, filepath))
-
-            if batch_mode == 'GROUP':  # group
-                # group, so objects update properly, add a dummy scene.
-                scene = bpy.data.scenes.new(name="FBX_Temp")
-                scene.layers = [True] * 20
-                # bpy.data.scenes.active = scene # XXX, cant switch
-                src_scenes = {}  # Count how much each 'source' scenes are used.
-                for ob_base in data.objects:
-                    for src_sce in ob_base.users_scene:
-                        if src_sce not in src_scenes:
-                            src_scenes[src_sce] = 0
-                        src_scenes[src_sce] += 1
-                    scene.objects.link(ob_base)
-
-                # Find the 'most used' source scene, and use its unit settings. This is somewhat weak, but should work
-                # fine in most cases, and avoids stupid issues like T41931.
-                best_src_scene = None
-                best_src_scene_users = -1
-                for sce, nbr_users in src_scenes.items():
-                    if (nbr_users) > best_src_scene_users:
-                        best_src_scene_users = nbr_users
-                        best_src_scene = sce
-                scene.unit_settings.system = best_src_scene.unit_settings.system
-                scene.unit_settings.system_rotation = best_src_scene.unit_settings.system_rotation
-                scene.unit_settings.scale_length = best_src_scene.unit_settings.scale_length
-
-                scene.update()
-                # TODO - BUMMER! Armatures not in the group wont animate the mesh
-            else:
-                scene = data
-
-            kwargs_batch = kwargs.copy()
-            kwargs_batch["context_objects"] = data.objects
-
-            save_single(operator, scene, filepath, **kwargs_batch)
-
-            if batch_mode == 'GROUP':
-                # remove temp group scene
-                bpy.data.scenes.remove(scene)
+        # Do not end a batch session started by our caller (e.g. UE4EH)!
+        own_batch_session = _batch_session is None
+        if own_batch_session:
+            batch_session_begin()
+        try:
+            for data in data_seq:  # scene or group
+                newname = "_".join((prefix, bpy.path.clean_name(data.name))) if prefix else bpy.path.clean_name(data.name)
+
+                if use_batch_own_dir:
+                    new_fbxpath = os.path.join(fbxpath, newname)
+                    # path may already exist
+                    # TODO - might exist but be a file. unlikely but should probably account for it.
+
+                    if not os.path.exists(new_fbxpath):
+                        os.makedirs(new_fbxpath)
+
+                filepath = os.path.join(new_fbxpath, newname + '.fbx')
+
+                print('\nBatch exporting %s as...\n\t%r' % (data, filepath))
+
+                if batch_mode == 'GROUP':  # group
+                    # group, so objects update properly, add a dummy scene.
+                    scene = bpy.data.scenes.new(name="FBX_Temp")
+                    scene.layers = [True] * 20
+                    # bpy.data.scenes.active = scene # XXX, cant switch
+                    src_scenes = {}  # Count how much each 'source' scenes are used.
+                    for ob_base in data.objects:
+                        for src_sce in ob_base.users_scene:
+                            if src_sce not in src_scenes:
+                                src_scenes[src_sce] = 0
+                            src_scenes[src_sce] += 1
+                        scene.objects.link(ob_base)
+
+                    # Find the 'most used' source scene, and use its unit settings. This is somewhat weak, but should work
+                    # fine in most cases, and avoids stupid issues like T41931.
+                    best_src_scene = None
+                    best_src_scene_users = -1
+                    for sce, nbr_users in src_scenes.items():
+                        if (nbr_users) > best_src_scene_users:
+                            best_src_scene_users = nbr_users
+                            best_src_scene = sce
+                    scene.unit_settings.system = best_src_scene.unit_settings.system
+                    scene.unit_settings.system_rotation = best_src_scene.unit_settings.system_rotation
+                    scene.unit_settings.scale_length = best_src_scene.unit_settings.scale_length
+
+                    scene.update()
+                    # TODO - BUMMER! Armatures not in the group wont animate the mesh
+                else:
+                    scene = data
+
+                kwargs_batch = kwargs.copy()
+                kwargs_batch["context_objects"] = data.objects
+
+                save_single(operator, scene, filepath, **kwargs_batch)
+
+                if batch_mode == 'GROUP':
+                    # remove temp group scene
+                    bpy.data.scenes.remove(scene)
+
+        finally:
+            if own_batch_session:
+                batch_session_end()
 
         # no active scene changing!
         # bpy.data.scenes.active = orig_sce
@@ -0,0 +1,361 @@
+import io
+import math
+import random
+
+import pytest
+
+np = pytest.importorskip("numpy")
+
+
+def test_matrices_decompose(fbx_exporter):
+    from mathutils import Euler, Matrix, Quaternion, Vector
+    rnd = random.Random(0)
+    matrices = []
+    for i in range(200):
+        rot = Euler([rnd.uniform(-math.pi, math.pi) for _i in range(3)], 'XYZ').to_matrix()
+        scale = [rnd.uniform(0.1, 3.0) * rnd.choice((1.0, -1.0)) for _i in range(3)]
+        mat = (rot * Matrix.Scale(scale[0], 3, (1, 0, 0)) * Matrix.Scale(scale[1], 3, (0, 1, 0)) *
+               Matrix.Scale(scale[2], 3, (0, 0, 1))).to_4x4()
+        mat.translation = Vector([rnd.uniform(-10.0, 10.0) for _i in range(3)])
+        matrices.append(mat)
+    # Half turns around main axes, zero scale.
+    matrices += [Matrix.Rotation(math.pi, 4, axis) for axis in 'XYZ'] + [Matrix.Scale(0.0, 4)]
+
+    locs, quats, scales = fbx_exporter.fbx_matrices_decompose(np.array([[list(row) for row in mat]
+                                                                        for mat in matrices]))
+    for mat, loc, quat, scale in zip(matrices, locs, quats, scales):
+        ref_loc, ref_quat, ref_scale = mat.decompose()
+        assert loc == pytest.approx(list(ref_loc), abs=1e-5)
+        assert scale == pytest.approx(list(ref_scale), abs=1e-5)
+        # q and -q are the same rotation.
+        assert abs(ref_quat.dot(Quaternion(quat))) == pytest.approx(1.0, abs=1e-5)
+
+
+def stock_simplify(values, min_reldiff_fac, min_absdiff_fac):
+    # Keys kept by stock AnimationCurveNodeWrapper.simplify() for a single channel.
+    keep = [False] * len(values)
+    p_val = p_keyedval = values[0]
+    for idx, val in enumerate(values):
+        if val == p_val:
+            continue
+        if abs(val - p_val) > (min_reldiff_fac * max(abs(val) + abs(p_val), min_absdiff_fac)):
+            keep[idx] = keep[idx - 1] = True
+            p_keyedval = val
+        elif abs(val - p_keyedval) > (min_reldiff_fac * max(abs(val) + abs(p_keyedval), min_absdiff_fac)):
+            keep[idx] = True
+            p_keyedval = val
+        p_val = val
+    return keep
+
+
+def interpolate(frames, values, keep):
+    # Values of the written (linear) curve at all frames, first value when nothing is keyed.
+    kept = [idx for idx, k in enumerate(keep) if k]
+    if not kept:
+        return [values[0]] * len(frames)
+    return np.interp(frames, [frames[idx] for idx in kept], [values[idx] for idx in kept]).tolist()
+
+
+def test_simplify_channels(fbx_exporter):
+    wrapper = fbx_exporter.AnimationCurveNodeWrapperUE4
+    min_reldiff_fac, min_absdiff_fac = wrapper.simplify_tolerances(1.0)
+    rnd = random.Random(0)
+    frames = [float(f) for f in range(300)]
+    channels = [
+        [0.0] * 300,
+        [5.0 + rnd.uniform(-1e-4, 1e-4) for f in frames],
+        [f * 0.25 for f in frames],
+        [math.sin(f * 0.05) * 10.0 for f in frames],
+        [math.sin(f * 0.05) * 10.0 + rnd.uniform(-0.05, 0.05) for f in frames],
+        [(0.0 if f < 150 else 90.0) for f in frames],
+        [math.cos(f * 0.3) * (f % 37) for f in frames],
+    ]
+    keep = wrapper.simplify_channels(frames, channels, min_reldiff_fac, min_absdiff_fac)
+    assert keep.shape == (len(channels), len(frames))
+
+    for values, ch_keep in zip(channels, keep.tolist()):
+        stock_keep = stock_simplify(values, min_reldiff_fac, min_absdiff_fac)
+        if not any(stock_keep):
+            assert not any(ch_keep)
+        else:
+            assert ch_keep[0] and ch_keep[-1]
+        assert sum(ch_keep) <= len(frames)
+        curve = interpolate(frames, values, ch_keep)
+        stock_curve = interpolate(frames, values, stock_keep)
+        for val, res, stock_res in zip(values, curve, stock_curve):
+            tol = min_reldiff_fac * max(abs(val) * 2.0, min_absdiff_fac)
+            # Each sample is kept within tolerance, and so within twice the tolerance of stock curves.
+            assert abs(res - val) <= tol * 1.01
+            assert abs(res - stock_res) <= tol * 2.02
+
+    # Nothing can be simplified away from a curve alternating between two far values.
+    keep = wrapper.simplify_channels(frames, [[float(f % 2) * 100.0 for f in frames]], min_reldiff_fac,
+                                     min_absdiff_fac)
+    assert keep.all()
+
+
+def test_connections_element(fbx_exporter):
+    """The flat Connections element must serialize to the same bytes as one built from elem_connection()."""
+    encode_bin = fbx_exporter.encode_bin
+    if hasattr(encode_bin, "init_version"):
+        encode_bin.init_version(fbx_exporter.FBX_VERSION)
+
+    def serialize(elem, is_last):
+        f = io.BytesIO()
+        f.write(b"\0" * 27)
+        elem._calc_offsets(27, is_last)
+        elem._write(f.write, f.tell, is_last)
+        return f.getvalue()
+
+    rows = [(b"OO", 1, 0, None), (b"OP", 2 ** 62, 3, b"DiffuseColor"), (b"OO", 5, 6, None), (b"OP", 7, 8, b"d|X")]
+    connections = fbx_exporter.FBXConnections()
+    ref = encode_bin.FBXElem(b"Connections")
+    for row in rows * 1000:
+        connections.add(*row)
+        fbx_exporter.elem_connection(ref, *row)
+    elem = fbx_exporter.FBXElemConnections(b"Connections", connections)
+    assert serialize(elem, False) == serialize(ref, False)
+
+    for is_last in (False, True):
+        elem = fbx_exporter.FBXElemConnections(b"Connections", fbx_exporter.FBXConnections())
+        assert serialize(elem, is_last) == serialize(encode_bin.FBXElem(b"Connections"), is_last)
+
+
+def test_animations_cache_plain(fbx_exporter):
+    """Cache entries are marshalled plain data, read back as the baked animation they were made from."""
+    import array
+    import marshal
+    from collections import OrderedDict
+    cache = fbx_exporter.FBXAnimationsCache
+    frames = array.array('d', (0.0, 1.0, 2.5))
+    group = OrderedDict((
+        ("d|X", ("AnimCurve::X", 1.5, (frames, array.array('d', (1.0, -2.0, 3.25))), True)),
+        ("d|Y", ("AnimCurve::Y", 0.0, (array.array('d'), array.array('d')), False)),
+    ))
+    animations = OrderedDict((
+        ("Object::Cube", ("dummy_unused_key", OrderedDict((("T", ("AnimCurveNode::T", group, "T")),)))),
+        ("Geometry::Key", ("dummy_unused_key", OrderedDict())),
+    ))
+    anim = ("AnimStack::Walk", animations, "AnimLayer::Walk", b"Walk", 1.0, 25.0)
+
+    data = marshal.dumps(cache.to_plain(anim))
+    result = cache.from_plain(marshal.loads(data))
+    assert result == anim
+    assert list(result[1]) == list(animations)
+    assert list(result[1]["Object::Cube"][1]["T"][1]) == ["d|X", "d|Y"]
+    assert isinstance(result[1]["Object::Cube"][1]["T"][1]["d|X"][2][0], array.array)
+
+
+def fake_fcurve(points, data_path="location", array_index=0, modifiers=(), mute=False, group=None, evaluate=None):
+    """Duck-typed F-curve, points being (frame, value, left handle value, right handle value) tuples."""
+    from types import SimpleNamespace
+    keyframe_points = [SimpleNamespace(co=(f, v), handle_left=(f - 1.0, hl), handle_right=(f + 1.0, hr))
+                       for f, v, hl, hr in points]
+    frames = [f for f, _v, _hl, _hr in points]
+    return SimpleNamespace(keyframe_points=keyframe_points, modifiers=list(modifiers), data_path=data_path,
+                           array_index=array_index, mute=mute, is_valid=True, group=group,
+                           range=lambda: (min(frames), max(frames)), evaluate=evaluate)
+
+
+def test_fcurve_is_static(fbx_exporter):
+    from types import SimpleNamespace
+    is_static = fbx_exporter._fbx_fcurve_is_static
+    flat = fake_fcurve([(1.0, 2.0, 2.0, 2.0), (10.0, 2.0, 2.0, 2.0)])
+    assert is_static(flat, 2.0)
+    assert not is_static(flat, 1.0)
+    # A handle off the value makes the curve move between keys.
+    assert not is_static(fake_fcurve([(1.0, 2.0, 2.0, 2.5), (10.0, 2.0, 2.0, 2.0)]), 2.0)
+    assert not is_static(fake_fcurve([(1.0, 2.0, 2.0, 2.0)], modifiers=[SimpleNamespace(type='NOISE')]), 2.0)
+    assert not is_static(fake_fcurve([]), 0.0)
+
+    bdata = SimpleNamespace(location=(1.0, 2.0, 3.0), scale=(1.0, 1.0, 1.0), path_from_id=lambda prop: prop)
+    fcurves = {"location": {0: fake_fcurve([(1.0, 1.0, 1.0, 1.0)]), 2: fake_fcurve([(1.0, 3.0, 3.0, 3.0)])}}
+    are_static = fbx_exporter._fbx_channels_are_static
+    assert are_static(bdata, ("location", "scale"), fcurves, set())
+    assert not are_static(bdata, ("location", "scale"), fcurves, {"scale"})
+    fcurves["location"][1] = fake_fcurve([(1.0, 2.0, 2.0, 2.0), (5.0, 4.0, 4.0, 4.0)])
+    assert not are_static(bdata, ("location",), fcurves, set())
+    assert not are_static(bdata, ("location",), {"location": {3: fake_fcurve([(1.0, 0.0, 0.0, 0.0)])}}, set())
+
+
+def test_action_frame_range(fbx_exporter):
+    from types import SimpleNamespace
+    frame_range = fbx_exporter.fbx_action_frame_range
+    settings = SimpleNamespace(bake_anim_action_pad_pre=2.0, bake_anim_action_pad_post=3.0)
+    muted_group = SimpleNamespace(mute=True)
+    action = SimpleNamespace(frame_range=(0.0, 200.0), fcurves=[
+        fake_fcurve([(5.0, 0.0, 0.0, 0.0), (20.0, 1.0, 1.0, 1.0)]),
+        fake_fcurve([(10.0, 0.0, 0.0, 0.0), (30.0, 1.0, 1.0, 1.0)], array_index=1),
+        # Muted curves do not stretch the range.
+        fake_fcurve([(0.0, 0.0, 0.0, 0.0), (100.0, 1.0, 1.0, 1.0)], data_path="scale", mute=True),
+        fake_fcurve([(-50.0, 0.0, 0.0, 0.0), (200.0, 1.0, 1.0, 1.0)], data_path="rotation_euler", group=muted_group),
+    ])
+    assert frame_range(settings, action) == (3.0, 33.0)
+
+    # Without keyframes, the action frame range is used.
+    assert frame_range(settings, SimpleNamespace(frame_range=(1.0, 10.0), fcurves=[])) == (-1.0, 13.0)
+
+    # At least two frames are baked.
+    settings = SimpleNamespace(bake_anim_action_pad_pre=0.0, bake_anim_action_pad_post=0.0)
+    action = SimpleNamespace(frame_range=(7.0, 8.0), fcurves=[fake_fcurve([(7.0, 1.0, 1.0, 1.0)])])
+    assert frame_range(settings, action) == (7.0, 8.0)
+
+
+class FakeKeyBlocks(list):
+    def foreach_get(self, attr, seq):
+        seq[:] = type(seq)(seq.typecode, [getattr(kb, attr) for kb in self])
+
+
+def fake_shape_key(anim_data):
+    from types import SimpleNamespace
+    key_blocks = FakeKeyBlocks(SimpleNamespace(name=name, value=value, slider_min=0.0, slider_max=1.0)
+                               for name, value in (("Basis", 0.0), ("Smile", 0.5), ("Blink", 0.25)))
+    paths = {'key_blocks["%s"]' % kb.name: kb for kb in key_blocks}
+
+    def path_resolve(path):
+        if path not in paths:
+            raise ValueError(path)
+        return paths[path]
+    return SimpleNamespace(key_blocks=key_blocks, animation_data=anim_data, path_resolve=path_resolve)
+
+
+def test_shape_keys_sampler(fbx_exporter):
+    from types import SimpleNamespace
+
+    class CurveNode:
+        def set_keyframes(self, frames, channels):
+            self.frames, self.values = list(frames), [list(values) for values in channels]
+
+    def anim_data(fcurves, drivers=()):
+        return SimpleNamespace(drivers=list(drivers), use_tweak_mode=False, use_nla=False, nla_tracks=[],
+                               action_influence=1.0, action_blend_type='REPLACE',
+                               action=SimpleNamespace(fcurves=fcurves))
+
+    smile = fake_fcurve([(0.0, 0.0, 0.0, 0.0)], data_path='key_blocks["Smile"].value', evaluate=lambda f: f * 0.5)
+    key = fake_shape_key(anim_data([smile]))
+    assert set(fbx_exporter._fbx_shape_key_fcurves(key)) == {"Smile"}
+
+    # Only F-curves animate the key: values are computed from them (clamped to the slider range), others keep
+    # their current value.
+    sampler = fbx_exporter.FBXShapeKeysSampler(key)
+    assert sampler.fcurves is not None
+    nodes = [CurveNode(), CurveNode()]
+    sampler.add_shape(nodes[0], key.key_blocks[1])
+    sampler.add_shape(nodes[1], key.key_blocks[2])
+    for frame in range(4):
+        sampler.sample(float(frame), frame * 2.0)
+    sampler.finish()
+    assert nodes[0].frames == [0.0, 2.0, 4.0, 6.0]
+    assert nodes[0].values == [[0.0, 50.0, 100.0, 100.0]]
+    assert nodes[1].values == [[25.0] * 4]
+
+    # Other animated properties, or drivers, need the values read from the evaluated key.
+    other = fake_fcurve([(0.0, 0.0, 0.0, 0.0)], data_path="eval_time")
+    assert fbx_exporter._fbx_shape_key_fcurves(fake_shape_key(anim_data([smile, other]))) is None
+    key = fake_shape_key(anim_data([smile], drivers=[other]))
+    sampler = fbx_exporter.FBXShapeKeysSampler(key)
+    assert sampler.fcurves is None
+    node = CurveNode()
+    sampler.add_shape(node, key.key_blocks[1])
+    for frame in range(3):
+        key.key_blocks[1].value = frame * 0.25
+        sampler.sample(float(frame), float(frame))
+    sampler.finish()
+    assert node.values == [[0.0, 25.0, 50.0]]
+
+
+def test_adaptive_samples(fbx_exporter):
+    adaptive_samples = fbx_exporter.fbx_animations_adaptive_samples
+    step = 1 << fbx_exporter.FBX_ANIM_ADAPTIVE_LEVELS
+
+    def within_tolerance(start, mid, end, factor):
+        return abs(start + (end - start) * factor - mid) <= 1e-6
+
+    assert adaptive_samples(float, 0, within_tolerance) == {}
+    assert adaptive_samples(float, 1, within_tolerance) == {0: 0.0}
+    assert adaptive_samples(float, 2, within_tolerance) == {0: 0.0, 1: 1.0}
+
+    # Linear motion only needs the coarse samples, and one middle sample per interval to check it.
+    samples = adaptive_samples(lambda i: 2.0 * i, 100, within_tolerance)
+    coarse = set(range(0, 99, step)) | {99}
+    assert coarse <= set(samples) and len(samples) < 2 * len(coarse)
+    assert all(val == 2.0 * i for i, val in samples.items())
+
+    # A jump is refined down to the fixed step, and the samples reproduce every frame.
+    def jump(i):
+        return 0.0 if i < 37 else 10.0
+    samples = adaptive_samples(jump, 100, within_tolerance)
+    assert {36, 37} <= set(samples) and len(samples) < 50
+    keys = sorted(samples)
+    for i in range(100):
+        prev = max(k for k in keys if k <= i)
+        nxt = min(k for k in keys if k >= i)
+        val = samples[prev] if prev == nxt else \
+            samples[prev] + (samples[nxt] - samples[prev]) * (i - prev) / (nxt - prev)
+        assert abs(val - jump(i)) <= 1e-6
+
+
+def test_batch_session(fbx_exporter):
+    assert fbx_exporter.batch_session_get() is not fbx_exporter.batch_session_get()
+    fbx_exporter.batch_session_begin()
+    try:
+        session = fbx_exporter.batch_session_get()
+        assert fbx_exporter.batch_session_get() is session
+        session["materials"]["Material"] = ()
+    finally:
+        fbx_exporter.batch_session_end()
+    assert "Material" not in fbx_exporter.batch_session_get()["materials"]
+
+
+def test_media_copier(fbx_exporter, tmp_path):
+    import os
+    src = tmp_path / "src" / "diffuse.png"
+    src.parent.mkdir()
+    src.write_bytes(b"png data")
+    dst = tmp_path / "dst" / "textures" / "diffuse.png"
+
+    copier = fbx_exporter.FBXMediaCopier()
+    # A same copy is only done once per session.
+    copier.copy([(str(src), str(dst)), (str(src), str(dst))])
+    copier.finish()
+    assert dst.read_bytes() == b"png data"
+    assert os.stat(str(dst)).st_mtime_ns == os.stat(str(src)).st_mtime_ns
+
+    # Changed sources are copied again.
+    src.write_bytes(b"new png data")
+    copier.copy([(str(src), str(dst))])
+    copier.finish()
+    assert dst.read_bytes() == b"new png data"
+
+    # Same size and content, only the modification time differs: the destination is kept.
+    os.utime(str(dst), ns=(0, 0))
+    copier.copy([(str(src), str(dst))])
+    copier.finish()
+    assert dst.read_bytes() == b"new png data"
+    assert os.stat(str(dst)).st_mtime_ns == os.stat(str(src)).st_mtime_ns
+
+    link = tmp_path / "dst" / "linked.png"
+    copier.copy([(str(src), str(link))], use_hardlinks=True)
+    copier.finish()
+    assert link.read_bytes() == b"new png data"
+
+
+def test_is_collision_object(fbx_exporter):
+    from types import SimpleNamespace
+
+    class FakeObject(dict):
+        def __init__(self, name, **props):
+            super().__init__(props)
+            self.name = name
+
+    def wrapper(name, type='MESH', **props):
+        return SimpleNamespace(type=type, bdata=FakeObject(name, **props))
+
+    is_collision = fbx_exporter.fbx_is_collision_object
+    for name in ("UCX_Wall_00", "UBX_Wall_01", "USP_Ball_00"):
+        assert is_collision(wrapper(name))
+    assert is_collision(wrapper("Wall.001", isColCopy=True))
+    assert is_collision(wrapper("Wall.002", isColOb=True))
+    assert not is_collision(wrapper("Wall"))
+    assert not is_collision(wrapper("Wall_UCX_00"))
+    assert not is_collision(wrapper("UCX_Wall_00", type='EMPTY'))